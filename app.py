@@ -1,10 +1,9 @@
 from flask import Flask, jsonify, request
 from auth.auth_client import create_supabase_client
 from config import Config
-from model import db, Customer, Order, User, Route, Node
+from model import db, Customer, Order, User, Route, Node, SolveJob
 from datetime import datetime
-import pandas as pd
-import json, os, uuid, jwt
+import copy, json, os, uuid, jwt
 from dotenv import load_dotenv
 from functools import wraps
 from sqlalchemy import desc
@@ -13,6 +12,7 @@ from haversine import haversine, Unit
 
 # Helpers
 from helpers.ortools import ortools_vrp
+from helpers.dist_comp import MatrixContext
 from helpers.enrich import enrich_customers
 from helpers.dist_look import build_distance_lookup
 from helpers.user_pref import get_user_preferences
@@ -20,12 +20,14 @@ from helpers.payload_llm import make_payload_for_llm
 from helpers.llm import call_llm, extract_json
 from helpers.traffic_durations import add_traffic_durations
 from helpers.traffic_reroute import reroute_with_traffic
+from helpers.local_reroute import reroute_locally, TRAFFIC_REROUTE_ENGINE
 from helpers.nearby_places import enrich_with_support_stations
 from helpers.trip_description import generate_trip_descriptions
 from helpers.breakage import generate_situation_recommendation
 from helpers.fuel import generate_fuel_recommendation
-from helpers.fatigue import generate_fatigue_recommendation
-from helpers.s3_bucket import read_csv_from_s3
+from helpers.fatigue import generate_fatigue_recommendation, enrich_with_rest_stops, has_rest_stops
+from helpers.traffic_store import get_traffic_reference
+from helpers.job_queue import submit_job, map_in_app_context
 
 load_dotenv()
 
@@ -43,6 +45,10 @@ CORS(app, origins=[
 
 S3_BUCKET = os.getenv("S3_BUCKET_NAME", "your-bucket-name")
 USE_S3 = False
+# queued/running jobs untouched for this long are reported as failed (lost on restart)
+SOLVE_JOB_STALE_SECONDS = int(os.getenv("SOLVE_JOB_STALE_SECONDS", "1800"))
+# debug: write each LLM payload to this directory (off when unset)
+LLM_PAYLOAD_DUMP_DIR = os.getenv("LLM_PAYLOAD_DUMP_DIR")
 app.config["SQLALCHEMY_DATABASE_URI"] = Config.DB_URI
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = Config.ENGINE_OPTIONS
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
@@ -125,6 +131,45 @@ def parse_float(val, default=None, name=None, min_value=None, max_value=None):
         raise ValueError(f"{name} must be <= {max_value}")
     return fv
 
+def parse_bool(val, default=None, name=None):
+    if val is None or (isinstance(val, str) and val.strip() == ""):
+        return default
+    if isinstance(val, bool):
+        return val
+    sval = str(val).strip().lower()
+    if sval in ("1", "true", "yes", "on"):
+        return True
+    if sval in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(f"Invalid boolean for {name}: {val!r}")
+
+
+def parse_vehicle_profiles(val, vehicle_capacity, tank_size, mileage):
+    """
+    Optional "vehicles" list for a mixed fleet:
+    [{"name": "van", "count": 4, "capacity": 120, "tankSize": 60, "mileage": 12}, ...]
+    Missing capacity / tankSize / mileage take the request-wide values.
+    """
+    if val is None:
+        return None
+    if not isinstance(val, list) or not val:
+        raise ValueError("vehicles must be a non-empty list")
+    profiles = []
+    for k, item in enumerate(val):
+        if not isinstance(item, dict):
+            raise ValueError(f"vehicles[{k}] must be an object")
+        profiles.append({
+            "name": str(item.get("name") or f"vehicle-{k + 1}"),
+            "count": parse_int(item.get("count"), default=1, name=f"vehicles[{k}].count", min_value=1),
+            "capacity": parse_int(item.get("capacity"), default=vehicle_capacity,
+                                  name=f"vehicles[{k}].capacity", min_value=1),
+            "tank_size": parse_float(item.get("tankSize"), default=tank_size,
+                                     name=f"vehicles[{k}].tankSize", min_value=0.1),
+            "mileage": parse_float(item.get("mileage"), default=mileage,
+                                   name=f"vehicles[{k}].mileage", min_value=0.1)
+        })
+    return profiles
+
 
 # ------------------------------------------------
 # 🔑 Auth Endpoints
@@ -288,54 +333,117 @@ def get_pending_nodes():
 
 import uuid
 # ------------------------------------------------
-# 📌 Solve VRP (JWT version)
+# 📌 Solve VRP pipeline (runs in the background job pool)
 # ------------------------------------------------
-@app.route("/api/solve", methods=["POST"])
-@require_auth
-def solve_routes():
-    """Run VRP pipeline on Node table for logged-in manager."""
-    supabase_uid = request.user_id   # comes from JWT
-    user = User.query.filter_by(user_id=supabase_uid).first()
-    if not user:
-        print("User not found")
-        return jsonify({"status": "error", "message": "User not found"}), 404
-
-    # ----------------------------
-    # 1. Parse frontend config
-    # ----------------------------
-    data = request.get_json() or {}
-    try:
-        num_vehicles = parse_int(data.get("numVehicles"), default=3, name="numVehicles", min_value=1)
-        vehicle_capacity = parse_int(data.get("vehicleCapacity"), default=200, name="vehicleCapacity", min_value=1)
-        # allow tank_size from fuelRequired or a separate tankSize field
-        fuel_required = parse_float(
-            data.get("fuelRequired") or data.get("tankSize"),
-            default=45.0,
-            name="tankSize",
-            min_value=0.1
-        )
-        mileage = parse_float(data.get("mileage"), default=15.0, name="mileage", min_value=0.1)
-
-        # ✅ Handle preference (string or None)
-        preference = data.get("preference")
-        if preference is not None:
-            # strip whitespace and normalize empty string -> None
-            preference = str(preference).strip() or None
-
-    except ValueError as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
-
+class SolveError(Exception):
+    """Pipeline failure surfaced to the client through the job status."""
+    def __init__(self, message, diagnostics=None):
+        super().__init__(message)
+        self.message = message
+        self.diagnostics = diagnostics
+
+
+def parse_solve_config(data):
+    """Validate the /api/solve body up front so bad input is rejected before queuing."""
+    num_vehicles = parse_int(data.get("numVehicles"), default=3, name="numVehicles", min_value=1)
+    vehicle_capacity = parse_int(data.get("vehicleCapacity"), default=200, name="vehicleCapacity", min_value=1)
+    # allow tank_size from fuelRequired or a separate tankSize field
+    fuel_required = parse_float(
+        data.get("fuelRequired") or data.get("tankSize"),
+        default=45.0,
+        name="tankSize",
+        min_value=0.1
+    )
+    mileage = parse_float(data.get("mileage"), default=15.0, name="mileage", min_value=0.1)
+    # re-plans start OR-Tools from the previous trip (latest one unless previousTripId is given)
+    warm_start = parse_bool(data.get("warmStart"), default=True, name="warmStart")
+    previous_trip_id = data.get("previousTripId") or None
+    # mixed fleet: one solve over all vehicle profiles (replaces numVehicles)
+    vehicle_profiles = parse_vehicle_profiles(data.get("vehicles"), vehicle_capacity, fuel_required, mileage)
+    if vehicle_profiles:
+        num_vehicles = sum(p["count"] for p in vehicle_profiles)
+
+    # ✅ Handle preference (string or None)
+    preference = data.get("preference")
+    if preference is not None:
+        # strip whitespace and normalize empty string -> None
+        preference = str(preference).strip() or None
+
+    return {
+        "num_vehicles": num_vehicles,
+        "vehicle_capacity": vehicle_capacity,
+        "fuel_required": float(fuel_required) if fuel_required else None,
+        "mileage": float(mileage) if mileage else None,
+        "preference": preference,
+        "warm_start": warm_start,
+        "previous_trip_id": previous_trip_id,
+        "vehicle_profiles": vehicle_profiles
+    }
 
 
-    fuel_required = float(fuel_required) if fuel_required else None
-    mileage = float(mileage) if mileage else None
+def previous_route_sequences(user, trip_id=None, warehouse_id=None):
+    """
+    Customer ids per vehicle of the user's previous Route (None if there is none).
+    Only Routes planned from warehouse_id (default: the user's warehouse) are
+    considered, so a plan never seeds the solve of another depot.
+    """
+    warehouse_id = warehouse_id or user.warehouse
+    query = Route.query.filter_by(user_id=user.id)
+    if trip_id:
+        query = query.filter_by(trip_id=trip_id)
+    routes = query.order_by(desc(Route.created_at))
+    if warehouse_id:
+        route = next((r for r in routes.limit(20) if isinstance(r.route_detail, dict)
+                      and (r.route_detail.get("depot") or {}).get("id") == warehouse_id), None)
+    else:
+        route = routes.first()
+    if not route or not isinstance(route.route_detail, dict):
+        return None
+
+    detail = route.route_detail
+    depot_id = (detail.get("depot") or {}).get("id")
+    sequences = [
+        [stop.get("id") for stop in r.get("sequence", []) if isinstance(stop, dict) and stop.get("id") != depot_id]
+        for r in detail.get("refined_routes", [])
+    ]
+    return sequences if any(sequences) else None
+
+
+def route_capacities(plan, baseline_routes, vehicle_capacity):
+    """
+    Capacity of each refined route. Mixed fleets map the "V1".."Vn" labels
+    back to the OR-Tools vehicles; unknown labels get the smallest capacity.
+    """
+    capacities = [r["capacity"] for r in baseline_routes if "capacity" in r]
+    if not capacities:
+        return vehicle_capacity
+    by_label = {f"V{i + 1}": c for i, c in enumerate(capacities)}
+    return [by_label.get(str(r.get("vehicle")), min(capacities)) for r in plan.get("refined_routes", [])]
+
+
+def run_solve_pipeline(user, config, report_stage=print, warehouse_id=None, traffic_ref=None):
+    """
+    Run the full VRP pipeline on the Node table for one manager and save the Route.
+    Only pending nodes of warehouse_id (default: the user's warehouse) are
+    routed, from that warehouse's depot; traffic_ref
+    lets a multi-depot run share one loaded reference set.
+    Returns {"trip_id", "message"}; raises SolveError on failure.
+    """
+    num_vehicles = config["num_vehicles"]
+    vehicle_capacity = config["vehicle_capacity"]
+    fuel_required = config["fuel_required"]
+    mileage = config["mileage"]
+    preference = config["preference"]
     print(f"User input: {preference}, num_vehicles: {num_vehicles}, vehicle_capacity: {vehicle_capacity}, fuel_required: {fuel_required}, mileage: {mileage}")
     # ----------------------------
     # 2. Load nodes from DB
     # ----------------------------
-    nodes = Node.query.filter_by(user_id=user.id, status="pending").all()
+    report_stage("loading_nodes")
+    # one depot per run: never route another warehouse's nodes from this depot
+    warehouse_id = warehouse_id or user.warehouse
+    nodes = Node.query.filter_by(user_id=user.id, status="pending", warehouse_id=warehouse_id).all()
     if not nodes:
-        return jsonify({"status": "error", "message": "No pending nodes found"}), 404
+        raise SolveError("No pending nodes found")
 
     # Slot map (minutes since midnight)
     slot_map = {
@@ -356,7 +464,7 @@ def solve_routes():
     # ----------------------------
     first_order = Order.query.get(nodes[0].order_id)
     depot = {
-        "id": user.warehouse,
+        "id": warehouse_id,
         "lat": first_order.wh_lat,
         "lon": first_order.wh_long
     }
@@ -383,9 +491,33 @@ def solve_routes():
             "priority": "normal"
         })
     print(f"{len(customers)} customers loaded.")
+
+    # One distance/time matrix per request, shared by every stage below
+    matrix_ctx = MatrixContext()
+    initial_routes = None
+    if config.get("warm_start"):
+        initial_routes = previous_route_sequences(user, config.get("previous_trip_id"), warehouse_id)
+    # ----------------------------
+    # 3. Enrich + Distances (expected speeds feed the solver's time dimension)
+    # ----------------------------
+    report_stage("enrichment")
+    print("Enriching customers with traffic data and building distance lookup...")
+    # Cached per worker; only re-read when the source files/ETags change
+    if traffic_ref is None:
+        traffic_ref = get_traffic_reference(use_s3=USE_S3, bucket=S3_BUCKET)
+    print("Traffic reference data ready.")
+    customers_info = enrich_customers(
+        customers, traffic_ref.df1, traffic_ref.df2, traffic_ref.df3,
+        tree=traffic_ref.tree, indexes=traffic_ref.indexes
+    )
+    for c, info in zip(customers, customers_info):
+        c["expected_speed_kmph"] = info["expected_speed_kmph"]
+    distance_lookup = build_distance_lookup(depot, customers, matrix_ctx=matrix_ctx)
+    print("Customer enrichment and distance lookup done.")
     # ----------------------------
-    # 3. OR-Tools baseline
+    # 4. OR-Tools baseline
     # ----------------------------
+    report_stage("ortools")
     print("Computing baseline routes with OR-Tools...")
     baseline = ortools_vrp(
     depot,
@@ -394,13 +526,16 @@ def solve_routes():
     vehicle_capacity=vehicle_capacity,
     mileage=mileage or 15,
     fuel_price=1.35,
-    tank_size=fuel_required or 45
+    tank_size=fuel_required or 45,
+    matrix_ctx=matrix_ctx,
+    initial_routes=initial_routes,
+    vehicle_profiles=config.get("vehicle_profiles")
 )
 
     print("Baseline routes computed.")
     print(baseline)
     # ----------------------------
-    # 3.a Check OR-Tools result for feasibility (supports both dict or list returns)
+    # 4.a Check OR-Tools result for feasibility (supports both dict or list returns)
     # ----------------------------
     def _ortools_no_solution(baseline_obj):
         # New-style: dict with "routes" and "diagnostics"
@@ -429,47 +564,32 @@ def solve_routes():
         if isinstance(baseline, dict):
             diag = baseline.get("diagnostics")
         print("OR-Tools found no feasible solution:", diag)
-        return jsonify({
-            "status": "error",
-            "message": "Route not possible; trying increase vehicles or capacity",
-            "diagnostics": diag
-        }), 500
-    # ----------------------------
-    # 4. Enrich + Distances
-    # ----------------------------
-    print("Enriching customers with traffic data and building distance lookup...")
-    if USE_S3:
-        df1, df2, df3 = (
-            read_csv_from_s3(S3_BUCKET, "local_authority_traffic.csv"),
-            read_csv_from_s3(S3_BUCKET, "region_traffic.csv"),
-            read_csv_from_s3(S3_BUCKET, "dft_traffic_counts_raw_counts.csv")
-        )
-    else:
-        df1, df2, df3 = (
-            pd.read_csv("data/local_authority_traffic.csv"),
-            pd.read_csv("data/region_traffic.csv"),
-            pd.read_csv("data/dft_traffic_counts_raw_counts.csv")
-        )
-    print("CSV files loaded from S3")
-    customers_info = enrich_customers(customers, df1, df2, df3)
-    distance_lookup = build_distance_lookup(depot, customers)
-    print("Customer enrichment and distance lookup done.")
+        reasons = (diag or {}).get("precheck", {}).get("reasons") or []
+        message = "Route not possible; trying increase vehicles or capacity"
+        if reasons:
+            message += f" ({', '.join(reasons)})"
+        raise SolveError(message, diag)
     # ----------------------------
     # 5. Preferences
     # ----------------------------
+    report_stage("preferences")
     print("Parsing user preferences...")
     preferences = get_user_preferences(preference)
-    payload = make_payload_for_llm(depot, baseline, distance_lookup, customers_info, preferences)
+    payload = make_payload_for_llm(depot, baseline["routes"], distance_lookup, customers_info, preferences)
     
     
-    with open("llm_payload.json", "w", encoding="utf-8") as f:
-        json.dump(payload, f, indent=4, ensure_ascii=False)
+    if LLM_PAYLOAD_DUMP_DIR:
+        # one file per depot and run: depots of a multi-depot job solve concurrently
+        dump_path = os.path.join(LLM_PAYLOAD_DUMP_DIR, f"llm_payload_{depot['id']}_{uuid.uuid4().hex[:8]}.json")
+        with open(dump_path, "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=4, ensure_ascii=False)
     
     
 
     # ----------------------------
     # 6. Call LLM
     # ----------------------------
+    report_stage("llm_refinement")
     try:
         raw_text = call_llm(payload)
         parsed = extract_json(raw_text)
@@ -477,11 +597,12 @@ def solve_routes():
         print("LLM call and JSON parse successful.")
     except Exception as e:
         print("LLM call or JSON parse error:", e)
-        return jsonify({"status": "error", "message": f"LLM failed: {e}"}), 500
+        raise SolveError(f"LLM failed: {e}")
 
     # ----------------------------
     # 7. Live Data Integration
     # ----------------------------
+    report_stage("traffic")
     print("Integrating live traffic data...")
     traffic_enriched, traffic_matrix = add_traffic_durations(
         parsed_json,
@@ -491,35 +612,59 @@ def solve_routes():
     print(traffic_enriched)
     print(traffic_matrix)
     try:
-        rerouted_json = reroute_with_traffic(traffic_enriched,traffic_matrix)
+        if TRAFFIC_REROUTE_ENGINE == "llm":
+            rerouted_json = reroute_with_traffic(traffic_enriched,traffic_matrix)
+        else:
+            # deterministic local search on traffic time, respecting vehicle capacity
+            rerouted_json = reroute_locally(
+                traffic_enriched,
+                traffic_matrix,
+                demands={c["customer_id"]: c["weight"] for c in customers},
+                vehicle_capacity=route_capacities(traffic_enriched, baseline["routes"], vehicle_capacity),
+                # keep the slot windows the solver enforced (absent when it ran without them)
+                time_windows={c["customer_id"]: c["time_window"] for c in customers}
+                if "time_windows" in baseline["diagnostics"] else None,
+                # the search estimates unfetched legs: measure the new order before keeping it
+                measure=lambda plan: add_traffic_durations(plan, api_key=os.getenv("GOOGLE_API_KEY"))
+            )
     except Exception as e:
-        return jsonify({"status": "error", "message": f"Traffic rerouting failed: {e}"}), 500
+        raise SolveError(f"Traffic rerouting failed: {e}")
+    # the reroute pass rebuilds the plan; carry the traffic cache counters over
+    rerouted_json.setdefault("diagnostics", {}).update(traffic_enriched.get("diagnostics", {}))
 
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
-        return jsonify({"status": "error", "message": "Missing Google API Key"}), 500
+        raise SolveError("Missing Google API Key")
     print("Rerouting with traffic data done.")
+    report_stage("support_stations")
     final_plan = enrich_with_support_stations(rerouted_json, api_key=api_key)
+    final_plan = enrich_with_rest_stops(final_plan)   # read later by the fatigue endpoint
     for route in final_plan["refined_routes"]:
         vehicle = route["vehicle"]
         seq = route["sequence"]
 
         total_distance = 0
         for i in range(len(seq) - 1):
-            p1 = (seq[i]["lat"], seq[i]["lon"])
-            p2 = (seq[i+1]["lat"], seq[i+1]["lon"])
-            dist = haversine(p1, p2, unit=Unit.KILOMETERS)
+            dist = matrix_ctx.distance_km(seq[i].get("id"), seq[i+1].get("id"))
+            if dist is None:
+                # stop not in the solved node set (e.g. renamed by the LLM)
+                p1 = (seq[i]["lat"], seq[i]["lon"])
+                p2 = (seq[i+1]["lat"], seq[i+1]["lon"])
+                dist = haversine(p1, p2, unit=Unit.KILOMETERS)
             total_distance += dist
 
         # ✅ Add total distance back into the route dictionary
         route["total_distance_km"] = round(total_distance, 3)
             
-    final_plan["ortools"] = baseline
+    final_plan["ortools"] = baseline["routes"]
+    final_plan.setdefault("diagnostics", {})["ortools"] = baseline["diagnostics"]
+    report_stage("trip_descriptions")
     driver_notes = generate_trip_descriptions(final_plan)
     print("Support station enrichment and trip descriptions done.")
     # ----------------------------
     # 8. Save Route to DB
     # ----------------------------
+    report_stage("saving")
     print("Saving route to DB...")
     trip_id = str(uuid.uuid4())[:8]
     new_route = Route(
@@ -536,10 +681,249 @@ def solve_routes():
 
     db.session.commit()
 
+    return {
+        "trip_id": trip_id,
+        "message": f"Route saved for warehouse {depot['id']}. Fetch using /api/routes/{trip_id}"
+    }
+
+
+def update_solve_job(job_id, **fields):
+    job = SolveJob.query.filter_by(job_id=job_id).first()
+    if job is None:
+        return None
+    for k, v in fields.items():
+        setattr(job, k, v)
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def expire_stale_job(job):
+    """
+    Jobs run on an in-memory pool, so a worker restart leaves them queued or
+    running forever: fail them once they have not moved for SOLVE_JOB_STALE_SECONDS.
+    """
+    if job.status not in ("queued", "running") or job.updated_at is None:
+        return job
+    if (datetime.utcnow() - job.updated_at).total_seconds() <= SOLVE_JOB_STALE_SECONDS:
+        return job
+    job.status = "failed"
+    job.error = f"Job stalled in stage {job.stage!r} (worker restarted?); please resubmit"
+    job.updated_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+
+def run_job(job_id, pipeline, trip_id_of):
+    """
+    Shared queued -> running -> succeeded/failed bookkeeping for a SolveJob:
+    pipeline(user, params, report_stage) produces the result, trip_id_of(result)
+    the trip recorded on the job. A job already failed as stale is not started.
+    """
+    job = SolveJob.query.filter_by(job_id=job_id).first()
+    if job is None or job.status != "queued":
+        return
+    job = update_solve_job(job_id, status="running", stage="starting")
+    user = User.query.get(job.user_id)
+    try:
+        result = pipeline(
+            user,
+            job.params,
+            report_stage=lambda stage: update_solve_job(job_id, stage=stage)
+        )
+        update_solve_job(job_id, status="succeeded", stage="done", trip_id=trip_id_of(result), result=result)
+    except SolveError as e:
+        db.session.rollback()
+        update_solve_job(job_id, status="failed", error=e.message, result={"diagnostics": e.diagnostics})
+    except Exception as e:
+        db.session.rollback()
+        print(f"Solve job {job_id} crashed:", e)
+        update_solve_job(job_id, status="failed", error=f"Unexpected error: {e}")
+
+
+def run_solve_job(job_id):
+    """Background entry point: run the pipeline for a queued SolveJob and record the outcome."""
+    run_job(job_id, run_solve_pipeline, lambda result: result["trip_id"])
+
+
+def run_multi_depot_solve(user, config, report_stage=print):
+    """
+    Group the manager's pending nodes by warehouse and run the pipeline once per
+    depot, side by side, with the traffic reference loaded once and shared.
+    Each depot saves its own Route; a failed depot does not roll back the others.
+    Returns {"trip_ids", "depots", "failed", "message"}; raises SolveError only
+    when no depot could be routed.
+    """
+    report_stage("loading_nodes")
+    rows = db.session.query(Node.warehouse_id).filter_by(user_id=user.id, status="pending").distinct().all()
+    warehouses = sorted(r[0] for r in rows)
+    if config.get("warehouses"):
+        warehouses = [w for w in warehouses if w in config["warehouses"]]
+    if not warehouses:
+        raise SolveError("No pending nodes found")
+    print(f"Multi-depot solve over {len(warehouses)} warehouses: {warehouses}")
+
+    report_stage("enrichment")
+    traffic_ref = get_traffic_reference(use_s3=USE_S3, bucket=S3_BUCKET)
+    user_id = user.id
+
+    def solve_depot(warehouse_id):
+        # runs on its own thread/app context, so re-load the user in this session
+        depot_user = User.query.get(user_id)
+        try:
+            return run_solve_pipeline(
+                depot_user, config,
+                report_stage=lambda stage: report_stage(f"{warehouse_id}:{stage}"),
+                warehouse_id=warehouse_id,
+                traffic_ref=traffic_ref
+            )
+        except Exception:
+            db.session.rollback()
+            raise
+
+    outcomes = map_in_app_context(app, solve_depot, warehouses)
+
+    depots, failed = {}, {}
+    for warehouse_id in warehouses:
+        outcome = outcomes[warehouse_id]
+        if isinstance(outcome, SolveError):
+            failed[warehouse_id] = {"error": outcome.message, "diagnostics": outcome.diagnostics}
+        elif isinstance(outcome, Exception):
+            print(f"Depot {warehouse_id} crashed:", outcome)
+            failed[warehouse_id] = {"error": f"Unexpected error: {outcome}"}
+        else:
+            depots[warehouse_id] = outcome["trip_id"]
+    if not depots:
+        raise SolveError("No depot could be routed", {"failed": failed})
+
+    return {
+        "trip_ids": list(depots.values()),
+        "depots": depots,
+        "failed": failed,
+        "message": f"{len(depots)} of {len(warehouses)} depots routed. Fetch each using /api/routes/<trip_id>"
+    }
+
+
+def run_multi_depot_job(job_id):
+    """Background entry point for a queued multi-depot SolveJob; trip_id holds the first trip."""
+    run_job(job_id, run_multi_depot_solve, lambda result: result["trip_ids"][0])
+
+
+# ------------------------------------------------
+# 📌 Solve VRP (JWT version)
+# ------------------------------------------------
+@app.route("/api/solve", methods=["POST"])
+@require_auth
+def solve_routes():
+    """Queue the VRP pipeline for the logged-in manager; poll /api/solve/<job_id> for the result."""
+    supabase_uid = request.user_id   # comes from JWT
+    user = User.query.filter_by(user_id=supabase_uid).first()
+    if not user:
+        print("User not found")
+        return jsonify({"status": "error", "message": "User not found"}), 404
+
+    # ----------------------------
+    # 1. Parse frontend config
+    # ----------------------------
+    data = request.get_json() or {}
+    try:
+        config = parse_solve_config(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    pending = Node.query.filter_by(user_id=user.id, status="pending")
+    if not pending.first():
+        return jsonify({"status": "error", "message": "No pending nodes found"}), 404
+    other = pending.filter(Node.warehouse_id != user.warehouse).first()
+    if other is not None:
+        return jsonify({
+            "status": "error",
+            "message": f"Pending nodes span several warehouses (e.g. {other.warehouse_id}); "
+                       "use /api/solve/multi-depot to route each from its own depot"
+        }), 400
+
+    job_id = str(uuid.uuid4())
+    db.session.add(SolveJob(job_id=job_id, user_id=user.id, status="queued", stage="queued", params=config))
+    db.session.commit()
+
+    submit_job(app, run_solve_job, job_id)
+
+    return jsonify({
+        "status": "accepted",
+        "job_id": job_id,
+        "message": f"Solve queued. Poll /api/solve/{job_id} for progress"
+    }), 202
+
+
+# ------------------------------------------------
+# 📌 Solve VRP for every warehouse at once (JWT version)
+# ------------------------------------------------
+@app.route("/api/solve/multi-depot", methods=["POST"])
+@require_auth
+def solve_multi_depot():
+    """
+    Queue one solve per warehouse of the manager's pending nodes (optionally
+    limited to body "warehouses"); the job result lists one trip_id per depot.
+    """
+    supabase_uid = request.user_id   # comes from JWT
+    user = User.query.filter_by(user_id=supabase_uid).first()
+    if not user:
+        return jsonify({"status": "error", "message": "User not found"}), 404
+
+    data = request.get_json() or {}
+    try:
+        config = parse_solve_config(data)
+        warehouses = data.get("warehouses")
+        if warehouses is not None:
+            if not isinstance(warehouses, list) or not all(isinstance(w, str) for w in warehouses):
+                raise ValueError("warehouses must be a list of warehouse ids")
+            config["warehouses"] = warehouses
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    query = Node.query.filter_by(user_id=user.id, status="pending")
+    if config.get("warehouses"):
+        query = query.filter(Node.warehouse_id.in_(config["warehouses"]))
+    if not query.first():
+        return jsonify({"status": "error", "message": "No pending nodes found"}), 404
+
+    job_id = str(uuid.uuid4())
+    db.session.add(SolveJob(job_id=job_id, user_id=user.id, status="queued", stage="queued", params=config))
+    db.session.commit()
+
+    submit_job(app, run_multi_depot_job, job_id)
+
+    return jsonify({
+        "status": "accepted",
+        "job_id": job_id,
+        "message": f"Multi-depot solve queued. Poll /api/solve/{job_id} for progress"
+    }), 202
+
+
+@app.route("/api/solve/<job_id>", methods=["GET"])
+@require_auth
+def get_solve_job(job_id):
+    """Status, current stage and (when finished) trip_id of a queued solve."""
+    supabase_uid = request.user_id   # comes from JWT
+    user = User.query.filter_by(user_id=supabase_uid).first()
+    if not user:
+        return jsonify({"status": "error", "message": "User not found"}), 404
+
+    job = SolveJob.query.filter_by(job_id=job_id, user_id=user.id).first()
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+    job = expire_stale_job(job)
+
     return jsonify({
         "status": "success",
-        "trip_id": trip_id,
-        "message": f"Route saved for warehouse {user.warehouse}. Fetch using /api/routes/{trip_id}"
+        "job_id": job.job_id,
+        "job_status": job.status,
+        "stage": job.stage,
+        "trip_id": job.trip_id,
+        "error": job.error,
+        "result": job.result,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "updated_at": job.updated_at.isoformat() if job.updated_at else None
     }), 200
 
 
@@ -813,6 +1197,11 @@ def situation_fatigue(tripid):
     if not latest_route:
         return jsonify({"status": "error", "message": f"No route found for trip id {tripid}"}), 404
 
+    # Routes saved before rest stops were precomputed: fetch them once and persist
+    if not has_rest_stops(latest_route.route_detail):
+        latest_route.route_detail = enrich_with_rest_stops(copy.deepcopy(latest_route.route_detail))
+        db.session.commit()
+
     # Maintain conversation in memory
     if supabase_uid not in fatigue_chat_history:
         fatigue_chat_history[supabase_uid] = []
@@ -0,0 +1,51 @@
+"""
+Benchmark: monolithic OR-Tools solve vs cluster-first decomposition.
+
+Synthetic stops of weight 1 around central England, one vehicle (capacity
+50) per 40 stops, 10 s time limit. The monolithic model is skipped above
+--monolithic-max (its N x N matrices dominate memory at 5k stops).
+
+Usage:
+    python -m benchmarks.bench_cluster_vrp [--sizes 500 2000 5000] [--methods kmeans sweep]
+"""
+import argparse
+import time
+
+import helpers.cluster_vrp as cluster_vrp
+import helpers.ortools as ortools
+from benchmarks.bench_distance_matrix import synthetic_problem
+
+
+def solve(n, decompose, method=None):
+    depot, customers = synthetic_problem(n + 1, 0)
+    start = time.perf_counter()
+    if decompose:
+        result = cluster_vrp.solve_clustered(
+            depot, customers, num_vehicles=max(3, n // 40), vehicle_capacity=50, tank_size=10 ** 4,
+            time_limit=10, method=method
+        )
+    else:
+        result = ortools.ortools_vrp(
+            depot, customers, num_vehicles=max(3, n // 40), vehicle_capacity=50, tank_size=10 ** 4,
+            time_limit=10, decompose=False
+        )
+    km = sum(r["total_distance_km"] for r in result["routes"])
+    return f"{km:9.1f} km {time.perf_counter() - start:5.1f}s"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--methods", nargs="+", default=["kmeans", "sweep"])
+    parser.add_argument("--monolithic-max", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'stops':>6} | {'monolithic':>18} | " + " | ".join(f"{m:>18}" for m in args.methods))
+    for n in args.sizes:
+        mono = solve(n, False) if n <= args.monolithic_max else f"{'skipped':>18}"
+        clustered = [solve(n, True, m) for m in args.methods]
+        print(f"{n:>6} | {mono} | " + " | ".join(clustered))
+
+
+if __name__ == "__main__":
+    main()
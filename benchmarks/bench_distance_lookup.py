@@ -0,0 +1,80 @@
+"""
+Benchmark: memory and JSON serialization of the distance lookup.
+
+Compares the legacy nested {a: {b: {...}}} dict against the array-backed
+DistanceLookup (dense rows and k-nearest-neighbour forms).
+
+Usage:
+    python -m benchmarks.bench_distance_lookup [--sizes 500 2000] [--k 10]
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+from benchmarks.bench_distance_matrix import synthetic_problem
+from helpers.dist_comp import compute_distance_matrix
+from helpers.dist_look import build_distance_lookup
+
+
+def legacy_lookup(depot, customers, base_speed_kmph=40):
+    """The original nested-dict structure, built from the same matrix."""
+    dist, time_s, node_ids = compute_distance_matrix(depot, customers, base_speed_kmph)
+    node_ids = [depot["id"]] + node_ids[1:]
+    dist_rows, time_rows = dist.tolist(), time_s.tolist()
+    return {
+        a: {
+            b: {"distance_km": round(dist_rows[i][j], 2), "travel_time_min": round(time_rows[i][j] / 60, 1)}
+            for j, b in enumerate(node_ids)
+        }
+        for i, a in enumerate(node_ids)
+    }
+
+
+def measure(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    obj = build()
+    build_s = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, build_s, current / 1e6, peak / 1e6
+
+
+def timed_dumps(obj):
+    start = time.perf_counter()
+    text = json.dumps(obj)
+    return time.perf_counter() - start, len(text) / 1e6
+
+
+def timed_dumps_of(serialize):
+    start = time.perf_counter()
+    text = json.dumps(serialize())
+    return time.perf_counter() - start, len(text) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 2000])
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'nodes':>6} | {'variant':>12} | {'build':>8} | {'held MB':>8} | {'peak MB':>8} | {'json':>8} | {'json MB':>8}")
+    for n in args.sizes:
+        depot, customers = synthetic_problem(n)
+
+        legacy, b, held, peak = measure(lambda: legacy_lookup(depot, customers))
+        s, size = timed_dumps(legacy)
+        print(f"{n:>6} | {'nested dict':>12} | {b:6.2f} s | {held:8.1f} | {peak:8.1f} | {s:6.2f} s | {size:8.1f}")
+        del legacy
+
+        lookup, b, held, peak = measure(lambda: build_distance_lookup(depot, customers))
+        for label, serialize in (("dense", lookup.to_dense), (f"knn k={args.k}", lambda: lookup.to_knn(args.k))):
+            # time includes the to_dense/to_knn conversion
+            s, size = timed_dumps_of(serialize)
+            print(f"{n:>6} | {label:>12} | {b:6.2f} s | {held:8.1f} | {peak:8.1f} | {s:6.2f} s | {size:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
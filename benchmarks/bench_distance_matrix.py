@@ -0,0 +1,76 @@
+"""
+Benchmark: distance/time matrix build time, legacy double loop vs vectorized engine.
+
+Usage:
+    python -m benchmarks.bench_distance_matrix [--sizes 100 1000 5000]
+"""
+import argparse
+import time
+
+import numpy as np
+from haversine import haversine
+
+from helpers.dist_comp import compute_distance_matrix
+
+
+def legacy_distance_matrix(depot, customers, base_speed_kmph=40):
+    """The original per-pair loop, kept here as the baseline."""
+    points = [("DEPOT", depot["lat"], depot["lon"])] + [
+        (c["customer_id"], c["lat"], c["lon"]) for c in customers
+    ]
+    size = len(points)
+    dist_matrix = np.zeros((size, size))
+    time_matrix = np.zeros((size, size))
+    for i, (_, lat_i, lon_i) in enumerate(points):
+        for j, (_, lat_j, lon_j) in enumerate(points):
+            if i != j:
+                dist_km = haversine((lat_i, lon_i), (lat_j, lon_j))
+                dist_matrix[i][j] = dist_km
+                time_matrix[i][j] = dist_km / base_speed_kmph * 3600
+    return dist_matrix, time_matrix
+
+
+def synthetic_problem(n, seed=0):
+    """Depot + (n - 1) customers scattered around central England."""
+    rng = np.random.default_rng(seed)
+    depot = {"id": "W001", "lat": 52.48, "lon": -1.89}
+    customers = [
+        {"customer_id": f"C{i:05d}", "lat": float(lat), "lon": float(lon), "weight": 1.0}
+        for i, (lat, lon) in enumerate(zip(rng.uniform(51.5, 53.5, n - 1), rng.uniform(-3.0, 0.0, n - 1)))
+    ]
+    return depot, customers
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--skip-legacy-above", type=int, default=5000,
+                        help="skip the slow loop for sizes larger than this")
+    args = parser.parse_args()
+
+    print(f"{'nodes':>6} | {'legacy loop':>12} | {'vector f64':>11} | {'vector f32':>11} | {'speedup':>8} | max err (m)")
+    for n in args.sizes:
+        depot, customers = synthetic_problem(n)
+
+        (d64, _, _), t64 = timed(compute_distance_matrix, depot, customers)
+        (d32, _, _), t32 = timed(compute_distance_matrix, depot, customers, dtype=np.float32)
+
+        if n <= args.skip_legacy_above:
+            (d_ref, _), t_ref = timed(legacy_distance_matrix, depot, customers)
+            err_m = float(np.abs(d32 - d_ref).max()) * 1000
+            legacy = f"{t_ref:10.3f} s"
+            speedup = f"{t_ref / t64:7.0f}x"
+        else:
+            err_m, legacy, speedup = float("nan"), "skipped", "-"
+
+        print(f"{n:>6} | {legacy:>12} | {t64:9.4f} s | {t32:9.4f} s | {speedup:>8} | {err_m:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+"""
+Benchmark: full arc graph vs the k-nearest-neighbour candidate graph.
+
+One monolithic OR-Tools model per size (decomposition off), same synthetic
+stops and 10 s time limit; "auto" picks k from the problem size.
+
+Usage:
+    python -m benchmarks.bench_knn_candidates [--sizes 200 500 1000] [--k auto]
+"""
+import argparse
+import time
+
+import helpers.ortools as ortools
+from benchmarks.bench_distance_matrix import synthetic_problem
+
+
+def solve(n, knn):
+    depot, customers = synthetic_problem(n + 1, 0)
+    start = time.perf_counter()
+    result = ortools.ortools_vrp(
+        depot, customers, num_vehicles=max(3, n // 40), vehicle_capacity=50, tank_size=10 ** 4,
+        time_limit=10, decompose=False, knn=knn
+    )
+    km = sum(r["total_distance_km"] for r in result["routes"])
+    k = result["diagnostics"].get("candidate_graph", {}).get("k", "-")
+    return f"{km:9.1f} km {time.perf_counter() - start:5.1f}s", k
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 500, 1000])
+    parser.add_argument("--k", default="auto")
+    args = parser.parse_args()
+
+    print(f"{'stops':>6} | {'full graph':>18} | {'candidate graph':>18} | k")
+    for n in args.sizes:
+        full, _ = solve(n, "off")
+        pruned, k = solve(n, args.k)
+        print(f"{n:>6} | {full} | {pruned} | {k}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark: support-station enrichment wall-clock, sequential vs concurrent fan-out.
+
+A local HTTP server stands in for the Places API and sleeps --latency seconds
+per request. Every stop gets its own geohash cell and a fresh cache, so each
+run issues 2 requests per stop.
+
+Usage:
+    python -m benchmarks.bench_places_fanout [--stops 10 30 60] [--latency 0.2]
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import helpers.nearby_places as nearby_places
+from helpers.cache_store import SqliteTTLCache
+from helpers.http_client import HTTP_MAX_CONCURRENCY
+
+LATENCY = 0.2
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(LATENCY)
+        payload = json.dumps({"status": "OK", "results": []}).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def plan(n):
+    return {"refined_routes": [{"vehicle": "V1", "sequence": [
+        {"id": f"C{i:03d}", "lat": 51.0 + i * 0.05, "lon": -1.0} for i in range(n)
+    ]}]}
+
+
+def run(n, max_workers, tmp):
+    cache = SqliteTTLCache(f"{tmp}/places-{n}-{max_workers}.sqlite3", "places_cache", 3600)
+    start = time.perf_counter()
+    nearby_places.enrich_with_support_stations(plan(n), api_key="k", cache=cache, max_workers=max_workers)
+    return time.perf_counter() - start
+
+
+def main():
+    global LATENCY
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--stops", type=int, nargs="+", default=[10, 30, 60])
+    parser.add_argument("--latency", type=float, default=0.2)
+    args = parser.parse_args()
+    LATENCY = args.latency
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    nearby_places.PLACES_API_URL = f"http://127.0.0.1:{server.server_port}/nearbysearch/json"
+
+    print(f"{'stops':>6} | {'sequential':>10} | {'concurrent':>10} | speedup (cap={HTTP_MAX_CONCURRENCY})")
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.stops:
+            seq = run(n, 1, tmp)
+            conc = run(n, None, tmp)
+            print(f"{n:>6} | {seq:8.2f} s | {conc:8.2f} s | {seq / conc:5.1f}x")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+"""
+Benchmark: single-strategy OR-Tools solve vs the multi-process portfolio.
+
+Both runs use the same adaptive budget; the portfolio runs one strategy pair
+per process (SOLVER_PORTFOLIO_STRATEGIES, capped by --workers) and keeps the
+best objective. Gains need as many free cores as pairs.
+
+Usage:
+    python -m benchmarks.bench_solver_portfolio [--sizes 50 200] [--workers 4]
+"""
+import argparse
+import time
+
+import helpers.ortools as ortools
+from benchmarks.bench_distance_matrix import synthetic_problem
+
+
+def solve(depot, customers, portfolio):
+    start = time.perf_counter()
+    result = ortools.ortools_vrp(
+        depot, customers, num_vehicles=5, vehicle_capacity=10 ** 6, tank_size=10 ** 4, portfolio=portfolio
+    )
+    km = sum(r["total_distance_km"] for r in result["routes"])
+    return time.perf_counter() - start, km, result["diagnostics"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[50, 200])
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+    ortools.SOLVER_PORTFOLIO_WORKERS = args.workers
+
+    # start the pool once so process spawn time is not billed to the first size
+    depot, customers = synthetic_problem(10, 0)[:2]
+    solve(depot, customers, True)
+
+    print(f"{'nodes':>6} | {'single':>18} | {'portfolio':>18} | winner")
+    for n in args.sizes:
+        depot, customers = synthetic_problem(n, 0)[:2]
+        single_s, single_km, _ = solve(depot, customers, False)
+        multi_s, multi_km, diag = solve(depot, customers, True)
+        winner = diag["portfolio"][-1]["winner"]
+        print(f"{n:>6} | {single_km:9.1f} km {single_s:5.1f}s | {multi_km:9.1f} km {multi_s:5.1f}s | {winner}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark: trip description wall-clock vs fleet size with a stubbed Gemini model.
+
+Each stubbed generate_content call sleeps for --latency seconds, standing in
+for a real model round trip.
+
+Usage:
+    python -m benchmarks.bench_trip_descriptions [--fleets 1 5 10 20] [--latency 0.5]
+"""
+import argparse
+import time
+
+import helpers.trip_description as trip_description
+
+
+class _StubResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class StubModel:
+    latency = 0.5
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, parts):
+        time.sleep(self.latency)
+        return _StubResponse("Drive safely. " + parts[-1][:40])
+
+
+def fleet(n):
+    return {"refined_routes": [
+        {"vehicle": f"V{i + 1}", "sequence": [{"id": "W010", "lat": 51.5, "lon": -0.12}]}
+        for i in range(n)
+    ]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--fleets", type=int, nargs="+", default=[1, 5, 10, 20])
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+
+    StubModel.latency = args.latency
+    trip_description.genai.GenerativeModel = StubModel
+
+    print(f"{'vehicles':>8} | {'sequential':>10} | {'concurrent':>10} | speedup (cap={trip_description.TRIP_DESCRIPTION_CONCURRENCY})")
+    for n in args.fleets:
+        start = time.perf_counter()
+        trip_description.generate_trip_descriptions(fleet(n), max_workers=1)
+        seq = time.perf_counter() - start
+
+        start = time.perf_counter()
+        trip_description.generate_trip_descriptions(fleet(n))
+        conc = time.perf_counter() - start
+        print(f"{n:>8} | {seq:8.2f} s | {conc:8.2f} s | {seq / conc:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def geohash_encode(lat, lon, precision=6):
+    """Standard base32 geohash of a coordinate (precision 6 ≈ 1.2 km x 0.6 km cell)."""
+    base32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bit, ch, even = [], 0, 0, True
+    while len(chars) < precision:
+        rng, val = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if val >= mid:
+            ch |= 1 << (4 - bit)
+            rng[0] = mid
+        else:
+            rng[1] = mid
+        even = not even
+        if bit < 4:
+            bit += 1
+        else:
+            chars.append(base32[ch])
+            bit, ch = 0, 0
+    return "".join(chars)
+
+
+class CacheStats:
+    """Hit/miss counters for one solve (thread-safe)."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None
+        }
+
+
+class SqliteTTLCache:
+    """
+    Persistent JSON key/value cache with TTL expiry and LRU eviction.
+
+    Backed by a SQLite file (WAL mode), so entries survive restarts and are
+    shared by every gunicorn worker on the host. Each thread gets its own
+    connection.
+    """
+
+    def __init__(self, path, table, ttl_seconds, max_entries=50000):
+        self.path = path
+        self.table = table
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        """Cached value, or None if missing/expired."""
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute(
+            f"SELECT value, created_at FROM {self.table} WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > self.ttl_seconds:
+            conn.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            conn.commit()
+            return None
+        conn.execute(f"UPDATE {self.table} SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            f"INSERT OR REPLACE INTO {self.table} (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now, now)
+        )
+        conn.commit()
+
+        with self._lock:
+            self._writes += 1
+            evict = self._writes % 100 == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop expired rows, then the least recently used ones above max_entries."""
+        conn = self._conn()
+        conn.execute(f"DELETE FROM {self.table} WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        conn.execute(
+            f"DELETE FROM {self.table} WHERE key IN ("
+            f" SELECT key FROM {self.table} ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,)
+        )
+        conn.commit()
+
+    def __len__(self):
+        return self._conn().execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
@@ -0,0 +1,434 @@
+"""
+Cluster-first, route-second decomposition for very large depots.
+
+Above ortools.SOLVER_CLUSTER_THRESHOLD customers, ortools_vrp() hands over to
+solve_clustered(): customers are partitioned around the depot (polar sweep
+or capacity-aware k-means over lat/lon), each cluster is solved as its own
+sub-VRP on the solver process pool, and a boundary repair pass runs
+improve_routes() over the routes of neighbouring clusters so stops near a
+cut can move to the vehicle that serves them cheapest.
+
+The output keeps the ortools_vrp() shape: {"routes": [...], "diagnostics": {...}}.
+"""
+import math
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import helpers.ortools as solver
+from helpers.dist_comp import compute_distance_matrix
+from helpers.local_reroute import improve_routes
+
+SOLVER_CLUSTER_MAX_NODES = int(os.getenv("SOLVER_CLUSTER_MAX_NODES", "150"))    # customers per sub-VRP
+SOLVER_CLUSTER_METHOD = os.getenv("SOLVER_CLUSTER_METHOD", "sweep").lower()     # "sweep" or "kmeans"
+CLUSTER_REPAIR_TIME_BUDGET = float(os.getenv("CLUSTER_REPAIR_TIME_BUDGET", "2.0"))   # seconds, whole pass
+CLUSTER_REPAIR_NEIGHBOURS = 2     # nearest clusters (by centroid) repaired with each cluster
+KMEANS_ITERATIONS = 20
+EARTH_RADIUS_KM = 6371.0
+
+
+def _planar_km(depot, customers):
+    """Equirectangular x/y (km) of customers relative to the depot; fine at city/region scale."""
+    lat0 = math.radians(depot["lat"])
+    lats = np.radians([c["lat"] for c in customers])
+    lons = np.radians([c["lon"] for c in customers])
+    x = (lons - math.radians(depot["lon"])) * math.cos(lat0) * EARTH_RADIUS_KM
+    y = (lats - lat0) * EARTH_RADIUS_KM
+    return np.column_stack([x, y])
+
+
+def sweep_clusters(depot, customers, demands, cluster_load, max_nodes):
+    """
+    Polar sweep around the depot: customers sorted by angle (starting after the
+    widest empty sector) and cut whenever the next one would exceed
+    cluster_load or max_nodes. Returns lists of customer indices.
+    """
+    if not customers:
+        return []
+    xy = _planar_km(depot, customers)
+    angles = np.arctan2(xy[:, 1], xy[:, 0])
+    order = np.argsort(angles, kind="stable")
+    sorted_angles = angles[order]
+    gaps = np.diff(np.r_[sorted_angles, sorted_angles[0] + 2 * np.pi])
+    order = np.roll(order, -(int(np.argmax(gaps)) + 1))
+
+    clusters, current, load = [], [], 0
+    for i in order.tolist():
+        if current and (load + demands[i] > cluster_load or len(current) >= max_nodes):
+            clusters.append(current)
+            current, load = [], 0
+        current.append(i)
+        load += demands[i]
+    clusters.append(current)
+    return clusters
+
+
+def kmeans_clusters(depot, customers, demands, cluster_load, max_nodes, iterations=KMEANS_ITERATIONS):
+    """
+    Capacity-aware k-means over planar coordinates, seeded with the sweep
+    clusters' centroids (deterministic). Each round assigns customers, nearest
+    first, to the closest centroid that still has load and size headroom.
+    """
+    seeds = sweep_clusters(depot, customers, demands, cluster_load, max_nodes)
+    if len(seeds) <= 1:
+        return seeds
+    xy = _planar_km(depot, customers)
+    centroids = np.array([xy[c].mean(axis=0) for c in seeds])
+    k = len(centroids)
+
+    assignment = None
+    for _ in range(iterations):
+        d = np.linalg.norm(xy[:, None, :] - centroids[None, :, :], axis=2)
+        preference = np.argsort(d, axis=1)
+        loads, sizes = np.zeros(k), np.zeros(k, dtype=int)
+        new_assignment = np.full(len(customers), -1)
+        for i in np.argsort(d.min(axis=1), kind="stable").tolist():
+            for c in preference[i].tolist():
+                if loads[c] + demands[i] <= cluster_load and sizes[c] < max_nodes:
+                    break
+            else:
+                c = int(np.argmin(loads))   # no headroom anywhere: least loaded cluster
+            new_assignment[i] = c
+            loads[c] += demands[i]
+            sizes[c] += 1
+        if assignment is not None and np.array_equal(assignment, new_assignment):
+            break
+        assignment = new_assignment
+        for c in range(k):
+            members = assignment == c
+            if members.any():
+                centroids[c] = xy[members].mean(axis=0)
+
+    clusters = [np.flatnonzero(assignment == c).tolist() for c in range(k)]
+    return [c for c in clusters if c]
+
+
+def allocate_vehicles(cluster_loads, num_vehicles, vehicle_capacity):
+    """
+    Vehicles per cluster: enough for its load, then the spare fleet one at a
+    time to the cluster with the highest load per vehicle. None if the
+    clusters need more vehicles than the fleet has.
+    """
+    needed = [max(1, math.ceil(load / vehicle_capacity)) for load in cluster_loads]
+    spare = int(num_vehicles) - sum(needed)
+    if spare < 0:
+        return None
+    for _ in range(spare):
+        c = max(range(len(needed)), key=lambda j: cluster_loads[j] / needed[j])
+        needed[c] += 1
+    return needed
+
+
+def lend_idle_vehicles(results, vehicles, failed):
+    """
+    Move vehicles that solved clusters left empty to the failed clusters, one
+    per failed cluster (the donor's empty route is dropped from its result).
+    Returns (vehicles per cluster, {failed cluster: vehicles lent}).
+    """
+    vehicles = list(vehicles)
+    idle = {k: [i for i, route in enumerate(r["routes"]) if not route["route"]]
+            for k, r in enumerate(results) if r["routes"]}
+    lent = {}
+    for k in failed:
+        donor = next((d for d, empty in idle.items() if empty), None)
+        if donor is None:
+            break
+        results[donor]["routes"].pop(idle[donor].pop())
+        vehicles[donor] -= 1
+        vehicles[k] += 1
+        lent[k] = 1
+    return vehicles, lent
+
+
+def _solve_clusters(depot, cluster_customers, vehicles, kwargs, warm_starts=None):
+    """Run ortools_vrp per cluster, on the solver pool when there is more than one worker."""
+    warm_starts = warm_starts or [None] * len(vehicles)
+    calls = [
+        dict(kwargs, num_vehicles=v, portfolio=False, decompose=False, initial_routes=warm)
+        for v, warm in zip(vehicles, warm_starts)
+    ]
+    if solver.SOLVER_PORTFOLIO_WORKERS > 1 and len(calls) > 1:
+        try:
+            pool = solver.get_portfolio_pool()
+            futures = [pool.submit(solver.ortools_vrp, depot, custs, **call)
+                       for custs, call in zip(cluster_customers, calls)]
+            return [f.result() for f in futures]
+        except BrokenProcessPool as e:
+            print("⚠️ Cluster pool unavailable, solving in-process:", e)
+            solver.get_portfolio_pool(reset=True)
+    return [solver.ortools_vrp(depot, custs, **call) for custs, call in zip(cluster_customers, calls)]
+
+
+def cluster_warm_starts(initial_routes, cluster_customers):
+    """
+    Split previous vehicle sequences over the clusters: each cluster keeps the
+    sequences restricted to its own customers (longest first, empty ones
+    dropped), or None when no previous stop falls inside it.
+    """
+    warm_starts = []
+    for custs in cluster_customers:
+        ids = {c["customer_id"] for c in custs}
+        seqs = [[cid for cid in seq if cid in ids] for seq in initial_routes]
+        seqs = sorted((seq for seq in seqs if seq), key=len, reverse=True)
+        warm_starts.append(seqs or None)
+    return warm_starts
+
+
+def _neighbour_pairs(depot, customers, clusters):
+    """Unordered pairs of clusters whose centroids are among each other's nearest."""
+    if len(clusters) < 2:
+        return []
+    xy = _planar_km(depot, customers)
+    centroids = np.array([xy[c].mean(axis=0) for c in clusters])
+    d = np.linalg.norm(centroids[:, None, :] - centroids[None, :, :], axis=2)
+    np.fill_diagonal(d, np.inf)
+    pairs = set()
+    for a in range(len(clusters)):
+        for b in np.argsort(d[a])[:CLUSTER_REPAIR_NEIGHBOURS].tolist():
+            pairs.add((min(a, b), max(a, b)))
+    return sorted(pairs)
+
+
+def _late_stops(routes, customers, dist_matrix):
+    """Stops served after their window closes (routes: local node lists without depot)."""
+    model = solver.build_time_model(dist_matrix, customers)
+    late = 0
+    for nodes, (times, _) in zip(routes, solver.simulate_arrivals(routes, model)):
+        late += sum(1 for node, t in zip(nodes, times) if t > model["windows"][node][1])
+    return late
+
+
+def repair_boundaries(depot, customers, routes, route_cluster, pairs, vehicle_capacity, range_km,
+                      use_windows, time_budget=None):
+    """
+    improve_routes() over the routes of each neighbouring cluster pair (in place).
+
+    routes are global customer-index lists per vehicle. A pair's result is
+    kept only if it is shorter, no route exceeds the fuel range (unless that
+    route already did, and then it may not get longer) and no extra stop
+    becomes late.
+    """
+    time_budget = CLUSTER_REPAIR_TIME_BUDGET if time_budget is None else time_budget
+    stats = {"pairs": len(pairs), "accepted": 0, "saved_m": 0,
+             "moves": {"two_opt": 0, "or_opt": 0, "relocate": 0, "exchange": 0}}
+    per_pair = time_budget / max(1, len(pairs))
+    demands = [c.get("weight", 0) for c in customers]
+
+    for a, b in pairs:
+        vehicles = [v for v, c in enumerate(route_cluster) if c in (a, b)]
+        members = [i for v in vehicles for i in routes[v]]
+        if len(members) < 2:
+            continue
+        local_customers = [customers[i] for i in members]
+        dist, _, _ = compute_distance_matrix(depot, local_customers)
+        meters = np.rint(dist * 1000.0).astype(np.int64).tolist()
+        local_of = {i: k + 1 for k, i in enumerate(members)}
+        start = [[0] + [local_of[i] for i in routes[v]] + [0] for v in vehicles]
+        demand = [0] + [int(round(demands[i])) for i in members]
+
+        improved, result = improve_routes(start, meters, demand, vehicle_capacity, per_pair)
+        if result["after"] >= result["before"]:
+            continue
+
+        km_before = [sum(meters[x][y] for x, y in zip(r, r[1:])) / 1000.0 for r in start]
+        km_after = [sum(meters[x][y] for x, y in zip(r, r[1:])) / 1000.0 for r in improved]
+        ok = all(after <= max(range_km, before) for after, before in zip(km_after, km_before))
+        if ok and use_windows:
+            ok = _late_stops([r[1:-1] for r in improved], local_customers, dist) <= \
+                 _late_stops([r[1:-1] for r in start], local_customers, dist)
+        if not ok:
+            continue
+
+        for v, r in zip(vehicles, improved):
+            routes[v] = [members[k - 1] for k in r[1:-1]]
+        stats["saved_m"] += int(round(result["before"] - result["after"]))
+        stats["accepted"] += 1
+        for move, count in result["moves"].items():
+            stats["moves"][move] += count
+    return stats
+
+
+def solve_clustered(
+    depot,
+    customers,
+    num_vehicles=3,
+    vehicle_capacity=200,
+    mileage=15,
+    fuel_price=1.35,
+    tank_size=45,
+    time_limit=10,
+    method=None,
+    max_nodes=None,
+    time_windows=None,
+    knn=None,
+    initial_routes=None,
+    matrix_ctx=None
+):
+    """
+    Cluster-first, route-second ortools_vrp() for large depots.
+
+    The fleet is split over the clusters by load; each cluster gets an equal
+    share of time_limit per solver worker, so the whole solve stays within
+    roughly time_limit. Falls back to one monolithic solve when the clusters
+    would need more vehicles than the fleet has. A cluster without a solution
+    is retried with a vehicle another cluster left idle, and the whole problem
+    is solved monolithically if that is not enough (diagnostics["cluster_retry"]).
+    initial_routes are split
+    over the clusters (cluster_warm_starts) to warm-start each sub-solve;
+    matrix_ctx is only used by that monolithic fallback.
+    Returns: {"routes": [...], "diagnostics": {...}} as ortools_vrp().
+    """
+    started = time.perf_counter()
+    method = method or SOLVER_CLUSTER_METHOD
+    max_nodes = max_nodes or SOLVER_CLUSTER_MAX_NODES
+    capacity = int(vehicle_capacity)
+    demands = [int(round(c.get("weight", 0))) for c in customers]
+    solver_kwargs = dict(vehicle_capacity=vehicle_capacity, mileage=mileage, fuel_price=fuel_price,
+                         tank_size=tank_size, time_windows=time_windows, knn=knn)
+
+    # same capacity verdict as precheck_feasibility, without an N x N matrix
+    total_demand, fleet_capacity = sum(demands), int(num_vehicles) * capacity
+    oversized = [c["customer_id"] for c, d in zip(customers, demands) if d > capacity]
+    if total_demand > fleet_capacity or oversized:
+        reasons = (["total_demand_exceeds_fleet_capacity"] if total_demand > fleet_capacity else []) + \
+                  (["package_exceeds_vehicle_capacity"] if oversized else [])
+        return {"routes": [], "diagnostics": {
+            "attempts": [], "search": [], "result": "no_solution_precheck",
+            "precheck": {"verdict": "infeasible", "reasons": reasons, "total_demand": total_demand,
+                         "fleet_capacity": fleet_capacity, "oversized_packages": oversized}
+        }}
+
+    # vehicles per cluster so the expected cluster count can share the fleet
+    expected_clusters = max(1, math.ceil(len(customers) / max_nodes))
+    cluster_load = max(1, int(num_vehicles) // expected_clusters) * capacity
+    partition = kmeans_clusters if method == "kmeans" else sweep_clusters
+    clusters = partition(depot, customers, demands, cluster_load, max_nodes)
+    loads = [sum(demands[i] for i in c) for c in clusters]
+    vehicles = allocate_vehicles(loads, num_vehicles, capacity)
+    if vehicles is None:
+        print(f"Clusters need more than {num_vehicles} vehicles; solving monolithically")
+        result = solver.ortools_vrp(depot, customers, num_vehicles=num_vehicles, time_limit=time_limit,
+                                    decompose=False, initial_routes=initial_routes, matrix_ctx=matrix_ctx,
+                                    **solver_kwargs)
+        result["diagnostics"]["attempts"].insert(0, "cluster_fleet_short")
+        return result
+
+    workers = max(1, min(solver.SOLVER_PORTFOLIO_WORKERS, len(clusters)))
+    cluster_time = max(solver.SOLVER_MIN_TIME_LIMIT, float(time_limit) * workers / len(clusters))
+    cluster_customers = [[customers[i] for i in c] for c in clusters]
+    print(f"Clustered solve: {len(customers)} customers -> {len(clusters)} {method} clusters, "
+          f"{cluster_time:.2f}s each on {workers} worker(s)")
+    warm_starts = cluster_warm_starts(initial_routes, cluster_customers) if initial_routes else None
+    results = _solve_clusters(depot, cluster_customers, vehicles, dict(solver_kwargs, time_limit=cluster_time),
+                              warm_starts)
+
+    retry = None
+    failed = [k for k, r in enumerate(results) if not r["routes"]]
+    if failed:
+        # allocate_vehicles only covers each cluster's load (no time windows): retry the
+        # failed clusters with vehicles other clusters left idle, else solve monolithically
+        vehicles, lent = lend_idle_vehicles(results, vehicles, failed)
+        if lent:
+            retry_ks = sorted(lent)
+            retried = _solve_clusters(
+                depot, [cluster_customers[k] for k in retry_ks], [vehicles[k] for k in retry_ks],
+                dict(solver_kwargs, time_limit=cluster_time),
+                [warm_starts[k] for k in retry_ks] if warm_starts else None
+            )
+            for k, r in zip(retry_ks, retried):
+                results[k] = r
+        retry = {"failed_clusters": failed, "lent_vehicles": lent,
+                 "still_failed": [k for k, r in enumerate(results) if not r["routes"]]}
+        if retry["still_failed"]:
+            print(f"Clusters {retry['still_failed']} have no solution; solving monolithically")
+            result = solver.ortools_vrp(depot, customers, num_vehicles=num_vehicles, time_limit=time_limit,
+                                        decompose=False, initial_routes=initial_routes, matrix_ctx=matrix_ctx,
+                                        **solver_kwargs)
+            result["diagnostics"]["attempts"].insert(0, "cluster_fallback_monolithic")
+            result["diagnostics"]["cluster_retry"] = retry
+            return result
+    solve_s = time.perf_counter() - started
+
+    diagnostics = {
+        "attempts": ["cluster_decomposition"],
+        "search": [],
+        "clusters": {
+            "method": method, "count": len(clusters), "sizes": [len(c) for c in clusters],
+            "loads": loads, "vehicles": vehicles, "time_limit_s": round(cluster_time, 3),
+            "solve_s": round(solve_s, 3)
+        },
+        "cluster_results": [r["diagnostics"].get("result") for r in results]
+    }
+    if initial_routes:
+        seeded = [r["diagnostics"]["warm_start"] for r in results if "warm_start" in r["diagnostics"]]
+        current = {c["customer_id"] for c in customers}
+        diagnostics["warm_start"] = {
+            "used": any(w["used"] for w in seeded),
+            "kept": sum(w["kept"] for w in seeded),
+            "dropped": sum(1 for seq in initial_routes for cid in seq if cid not in current),
+            "inserted": sum(w["inserted"] for w in seeded),
+            "clusters": len(seeded)
+        }
+    for k, r in enumerate(results):
+        for entry in r["diagnostics"].get("search", []):
+            diagnostics["search"].append({key: v for key, v in entry.items() if key != "objective_trace"}
+                                         | {"cluster": k})
+    if retry is not None:
+        diagnostics["attempts"].append("cluster_retry_more_vehicles")
+        diagnostics["cluster_retry"] = retry
+
+    # global customer indices per vehicle, and the cluster each vehicle came from
+    routes, route_cluster = [], []
+    for k, (cluster, result) in enumerate(zip(clusters, results)):
+        index_of = {}
+        for i in cluster:
+            index_of.setdefault(customers[i]["customer_id"], []).append(i)
+        for r in result["routes"]:
+            routes.append([index_of[cid].pop(0) for cid in r["route"]])
+            route_cluster.append(k)
+
+    use_windows = any("time_windows" in r["diagnostics"] for r in results)
+    repair = repair_boundaries(
+        depot, customers, routes, route_cluster, _neighbour_pairs(depot, customers, clusters),
+        capacity, float(tank_size) * float(mileage), use_windows
+    )
+    diagnostics["boundary_repair"] = repair
+    diagnostics["result"] = "solution_clustered"
+    diagnostics["used_fuel_model"] = all(r["diagnostics"].get("used_fuel_model") for r in results)
+
+    # route details per vehicle from its own small matrix
+    final = []
+    windows = solver.node_windows(customers) if use_windows else None
+    arrival_of = {}
+    for v, nodes in enumerate(routes):
+        route_customers = [customers[i] for i in nodes]
+        dist, _, _ = compute_distance_matrix(depot, route_customers)
+        local = list(range(1, len(nodes) + 1))
+        arrivals = None
+        if use_windows:
+            arrivals = solver.simulate_arrivals([local], solver.build_time_model(dist, route_customers))
+            arrival_of.update(zip(nodes, arrivals[0][0]))
+        meters = np.rint(dist * 1000.0).astype(np.int64).tolist()
+        route = solver.describe_routes([local], route_customers, meters, mileage, fuel_price, arrivals)[0]
+        route["vehicle_id"] = v
+        final.append(route)
+
+    if use_windows:
+        node_routes = [[i + 1 for i in nodes] for nodes in routes]
+        arrivals = [([arrival_of[i] for i in nodes], 0) for nodes in routes]
+        # clusters without any windowed customer carry no time_windows entry
+        cluster_windows = [r["diagnostics"].get("time_windows", {}) for r in results]
+        unreachable = [cid for w in cluster_windows for cid in w.get("precheck_unreachable", [])]
+        diagnostics["time_windows"] = {
+            "mode": "soft" if any(w.get("mode") == "soft" for w in cluster_windows) else "hard",
+            "service_time_min": solver.SERVICE_TIME_MIN,
+            "precheck_unreachable": unreachable,
+            "windows": solver.window_diagnostics(node_routes, arrivals, {"windows": windows}, customers, unreachable)
+        }
+
+    diagnostics["clusters"]["wall_s"] = round(time.perf_counter() - started, 3)
+    print("Clustered solve:", {k: diagnostics["clusters"][k] for k in ("count", "vehicles", "wall_s")},
+          "repair:", {k: repair[k] for k in ("pairs", "accepted", "saved_m")})
+    return {"routes": final, "diagnostics": diagnostics}
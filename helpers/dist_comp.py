@@ -1,10 +1,50 @@
 import numpy as np
-from haversine import haversine
+
+# Mean earth radius used by the `haversine` package, so results match it exactly
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_matrix(lats, lons, dtype=np.float64, symmetric=True, block_size=256):
+    """
+    Great-circle distance matrix (km) for a set of points in one broadcast pass.
+
+    Args:
+        lats, lons (array-like): coordinates in degrees
+        dtype: output dtype (np.float64 or np.float32)
+        symmetric (bool): compute the upper triangle only and mirror it
+        block_size (int): rows per broadcast block, bounds temporary memory
+
+    Returns:
+        np.ndarray: [n x n] distance matrix in km
+    """
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    cos_lat = np.cos(lat)
+    n = len(lat)
+
+    dist = np.empty((n, n), dtype=dtype)
+    for start in range(0, n, block_size):
+        stop = min(start + block_size, n)
+        col0 = start if symmetric else 0
+
+        dlat = lat[start:stop, None] - lat[None, col0:]
+        dlon = lon[start:stop, None] - lon[None, col0:]
+        a = (np.sin(dlat * 0.5) ** 2
+             + cos_lat[start:stop, None] * cos_lat[None, col0:] * np.sin(dlon * 0.5) ** 2)
+        block = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+        dist[start:stop, col0:] = block
+        if symmetric:
+            dist[col0:, start:stop] = block.T
+
+    np.fill_diagonal(dist, 0.0)
+    return dist
+
 
 # -------------------------
 # 2) Distance Matrix + OR-Tools baseline (enhanced)
 # -------------------------
-def compute_distance_matrix(depot, customers, base_speed_kmph=40):
+def compute_distance_matrix(depot, customers, base_speed_kmph=40, dtype=np.float64, symmetric=True):
     """
     Compute pairwise distance matrix (km) and baseline travel time (sec).
 
@@ -12,31 +52,86 @@ def compute_distance_matrix(depot, customers, base_speed_kmph=40):
         depot (dict): {id, lat, lon}
         customers (list): list of customer dicts with lat/lon
         base_speed_kmph (float): assumed average speed for conversion
+        dtype: output dtype (np.float64 or np.float32 to halve memory)
+        symmetric (bool): mirror the upper triangle instead of computing both halves
 
     Returns:
         dist_matrix (np.ndarray): distance matrix [n x n] in km
         time_matrix (np.ndarray): travel time matrix [n x n] in seconds
         node_ids (list): index → node_id (DEPOT + customers)
     """
-    points = [("DEPOT", depot["lat"], depot["lon"])] + [
-        (c["customer_id"], c["lat"], c["lon"]) for c in customers
-    ]
-    size = len(points)
-
-    dist_matrix = np.zeros((size, size))
-    time_matrix = np.zeros((size, size))
-    node_ids = [pid for pid, _, _ in points]
-
-    for i, (id_i, lat_i, lon_i) in enumerate(points):
-        for j, (id_j, lat_j, lon_j) in enumerate(points):
-            if i == j:
-                dist_matrix[i][j] = 0.0
-                time_matrix[i][j] = 0.0
-            else:
-                dist_km = haversine((lat_i, lon_i), (lat_j, lon_j))
-                dist_matrix[i][j] = dist_km
-                # Convert to time (sec) using baseline avg speed
-                travel_time_hr = dist_km / base_speed_kmph if base_speed_kmph > 0 else 0
-                time_matrix[i][j] = travel_time_hr * 3600
+    node_ids = ["DEPOT"] + [c["customer_id"] for c in customers]
+    lats = [depot["lat"]] + [c["lat"] for c in customers]
+    lons = [depot["lon"]] + [c["lon"] for c in customers]
+
+    dist_matrix = haversine_matrix(lats, lons, dtype=dtype, symmetric=symmetric)
+
+    # Convert to time (sec) using baseline avg speed
+    if base_speed_kmph > 0:
+        time_matrix = dist_matrix * (3600.0 / base_speed_kmph)
+    else:
+        time_matrix = np.zeros_like(dist_matrix)
 
     return dist_matrix, time_matrix, node_ids
+
+
+def travel_time_matrix(dist_matrix, speeds_kmph):
+    """
+    Travel time (sec) per arc at the mean expected speed of its two endpoints.
+
+    Args:
+        dist_matrix (np.ndarray): [n x n] distances in km
+        speeds_kmph (array-like): expected speed per node (e.g. enrich_customers'
+            expected_speed_kmph, depot first)
+
+    Returns:
+        np.ndarray: [n x n] seconds
+    """
+    speeds = np.asarray(speeds_kmph, dtype=np.float64)
+    pair_speed = (speeds[:, None] + speeds[None, :]) * 0.5
+    return np.asarray(dist_matrix, dtype=np.float64) * 3600.0 / np.maximum(pair_speed, 1e-6)
+
+
+class MatrixContext:
+    """
+    Per-request cache of distance/time matrices, keyed by the node ID list.
+
+    One instance is created per /api/solve call and handed to every stage
+    (OR-Tools attempts, LLM distance lookup, final route totals) so the
+    matrix is only computed once for a given depot + customers set.
+    """
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = dtype
+        self._matrices = {}    # node_ids tuple -> (dist_matrix, {speed: time_matrix})
+        self._index = {}       # node_id -> (node_ids tuple, position)
+
+    def get(self, depot, customers, base_speed_kmph=40):
+        """Same contract as compute_distance_matrix, but computed at most once per node set."""
+        node_ids = ["DEPOT"] + [c["customer_id"] for c in customers]
+        key = tuple(node_ids)
+
+        if key not in self._matrices:
+            dist_matrix, time_matrix, _ = compute_distance_matrix(
+                depot, customers, base_speed_kmph, dtype=self.dtype
+            )
+            self._matrices[key] = (dist_matrix, {base_speed_kmph: time_matrix})
+            # Depot is addressable both as "DEPOT" and by its real warehouse ID
+            self._index.setdefault(depot.get("id", "DEPOT"), (key, 0))
+            for pos, node_id in enumerate(node_ids):
+                self._index.setdefault(node_id, (key, pos))
+
+        dist_matrix, times = self._matrices[key]
+        if base_speed_kmph not in times:
+            times[base_speed_kmph] = (
+                dist_matrix * (3600.0 / base_speed_kmph) if base_speed_kmph > 0
+                else np.zeros_like(dist_matrix)
+            )
+        return dist_matrix, times[base_speed_kmph], node_ids
+
+    def distance_km(self, id_a, id_b):
+        """Distance between two known node IDs, or None if either was never computed."""
+        a, b = self._index.get(id_a), self._index.get(id_b)
+        if a is None or b is None or a[0] != b[0]:
+            return None
+        return float(self._matrices[a[0]][0][a[1], b[1]])
@@ -1,35 +1,94 @@
-from haversine import haversine
+from helpers.dist_comp import compute_distance_matrix
 import numpy as np
 
-def build_distance_lookup(depot, customers, base_speed_kmph=40):
+
+class DistanceLookup:
+    """
+    Compact distance/time table: an ordered node ID list plus flat float32
+    arrays indexed by position (row-major, size n*n).
+
+    get(a, b) is O(1); to_dense() / to_knn(k) produce the JSON sent to the LLM.
+    """
+
+    def __init__(self, node_ids, distances_km, times_min):
+        self.node_ids = list(node_ids)
+        self.size = len(self.node_ids)
+        self._pos = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.distances_km = np.ascontiguousarray(distances_km, dtype=np.float32).reshape(-1)
+        self.times_min = np.ascontiguousarray(times_min, dtype=np.float32).reshape(-1)
+
+    def __contains__(self, node_id):
+        return node_id in self._pos
+
+    def __len__(self):
+        return self.size
+
+    def get(self, a, b):
+        """Return {"distance_km", "travel_time_min"} for nodes a → b (KeyError if unknown)."""
+        k = self._pos[a] * self.size + self._pos[b]
+        return {
+            "distance_km": round(float(self.distances_km[k]), 2),
+            "travel_time_min": round(float(self.times_min[k]), 1)
+        }
+
+    def _rows(self, flat, decimals):
+        # round in float64 so JSON gets 12.35, not 12.350000381
+        return np.round(flat.astype(np.float64).reshape(self.size, self.size), decimals)
+
+    def to_dense(self):
+        """Full matrix as {"order": [...], "distances_km": [[...]], "times_min": [[...]]}."""
+        return {
+            "order": self.node_ids,
+            "distances_km": self._rows(self.distances_km, 2).tolist(),
+            "times_min": self._rows(self.times_min, 1).tolist()
+        }
+
+    def to_knn(self, k=10):
+        """
+        Only the k nearest neighbours of every node (plus the depot row in full):
+        {"order": [...], "k": k, "depot": {...}, "neighbors": {id: [[nbr_id, km, min], ...]}}
+        """
+        dist = self._rows(self.distances_km, 2)
+        times = self._rows(self.times_min, 1)
+        k = max(0, min(int(k), self.size - 1))
+
+        masked = dist.copy()
+        np.fill_diagonal(masked, np.inf)
+        if k > 0:
+            nearest = np.argpartition(masked, k - 1, axis=1)[:, :k]
+            order = np.take_along_axis(masked, nearest, axis=1).argsort(axis=1)
+            nearest = np.take_along_axis(nearest, order, axis=1)
+        else:
+            nearest = np.empty((self.size, 0), dtype=np.int64)
+
+        ids = self.node_ids
+        neighbors = {
+            ids[i]: [[ids[j], float(dist[i, j]), float(times[i, j])] for j in row]
+            for i, row in enumerate(nearest.tolist())
+        }
+        # Depot legs are always needed to open/close a route
+        depot = {ids[j]: [float(dist[0, j]), float(times[0, j])] for j in range(1, self.size)}
+        return {"order": ids, "k": k, "depot": depot, "neighbors": neighbors}
+
+
+def build_distance_lookup(depot, customers, base_speed_kmph=40, matrix_ctx=None):
     """
-    Build a nested dict {nodeA: {nodeB: {distance_km, travel_time_min}}}.
+    Build a compact DistanceLookup over depot + customers.
 
     Args:
         depot (dict): {id, lat, lon}
         customers (list): [{customer_id, lat, lon, ...}]
         base_speed_kmph (float): assumed baseline average speed (default 40 km/h)
+        matrix_ctx (MatrixContext): optional per-request matrix cache to reuse
 
     Returns:
-        dict: distance lookup table
+        DistanceLookup: lookup.get(a, b) -> {distance_km, travel_time_min}
     """
+    if matrix_ctx is not None:
+        dist_matrix, time_matrix, node_ids = matrix_ctx.get(depot, customers, base_speed_kmph)
+    else:
+        dist_matrix, time_matrix, node_ids = compute_distance_matrix(depot, customers, base_speed_kmph)
     # Use actual depot ID instead of "DEPOT"
-    points = [(depot["id"], depot["lat"], depot["lon"])] + [
-        (c["customer_id"], c["lat"], c["lon"]) for c in customers
-    ]
-
-    lookup = {}
-    for i, (id_i, lat_i, lon_i) in enumerate(points):
-        lookup[id_i] = {}
-        for j, (id_j, lat_j, lon_j) in enumerate(points):
-            if i == j:
-                lookup[id_i][id_j] = {"distance_km": 0.0, "travel_time_min": 0.0}
-            else:
-                dist_km = haversine((lat_i, lon_i), (lat_j, lon_j))
-                travel_time_hr = dist_km / base_speed_kmph if base_speed_kmph > 0 else 0
-                travel_time_min = round(travel_time_hr * 60, 1)
-                lookup[id_i][id_j] = {
-                    "distance_km": round(dist_km, 2),
-                    "travel_time_min": travel_time_min
-                }
-    return lookup
+    node_ids = [depot["id"]] + node_ids[1:]
+
+    return DistanceLookup(node_ids, dist_matrix, np.asarray(time_matrix) / 60.0)
@@ -1,5 +1,6 @@
 from sklearn.neighbors import BallTree
 import numpy as np
+import pandas as pd
 from haversine import haversine
 
 def build_countpoint_tree(df3):
@@ -14,7 +15,86 @@ def match_to_countpoint(customer, df3, tree):
     return row.to_dict(), float(dist[0][0]) * 6371.0  # convert radians → km
 
 
-def enrich_customers(customers, df1, df2, df3, user_prefs=None):
+# Join keys, normalised (strip + lower) once when the reference data is loaded
+KEY_COLUMNS = {
+    "df1": ["local_authority_name"],
+    "df2": ["region_name"],
+    "df3": ["local_authority_name", "region_name"],
+}
+
+
+def normalized_category(series):
+    """strip().lower() a string column as a categorical, doing the string work on unique values only."""
+    cat = series.astype("category")
+    normalized = cat.cat.categories.astype(str).str.strip().str.lower()
+    uniques, inverse = np.unique(np.asarray(normalized, dtype=object), return_inverse=True)
+    codes = cat.cat.codes.to_numpy()
+    new_codes = np.where(codes >= 0, inverse[codes], -1) if len(inverse) else codes
+    return pd.Series(pd.Categorical.from_codes(new_codes, uniques), index=series.index, name=series.name)
+
+
+def is_normalized(df, columns):
+    return all(isinstance(df[c].dtype, pd.CategoricalDtype) for c in columns if c in df)
+
+
+def normalize_reference_frames(df1, df2, df3):
+    """
+    Return copies of the traffic tables with categorical, normalised join keys.
+    The inputs are not modified; frames that are already normalised are returned as-is.
+    """
+    frames = []
+    for name, df in (("df1", df1), ("df2", df2), ("df3", df3)):
+        columns = KEY_COLUMNS[name]
+        if not is_normalized(df, columns):
+            df = df.assign(**{c: normalized_category(df[c]) for c in columns if c in df})
+        frames.append(df)
+    return tuple(frames)
+
+
+def build_reference_indexes(df1, df2):
+    """
+    Pre-aggregate the small reference tables into dict indexes (keys must already be normalised).
+      - density_by_la: local_authority_name -> all_motor_vehicles / link_length_km (first row per name)
+      - hgv_share_by_region: region_name -> sum(all_hgvs) / sum(all_motor_vehicles)
+    """
+    la = df1.drop_duplicates("local_authority_name", keep="first")
+    link = la["link_length_km"] if "link_length_km" in la else pd.Series(0.0, index=la.index)
+    density = (la["all_motor_vehicles"] / link).where(link > 0)
+    density_by_la = {
+        name: (float(d) if d == d else None)   # NaN -> None
+        for name, d in zip(la["local_authority_name"], density)
+    }
+
+    totals = df2.groupby("region_name", sort=False, observed=True)[["all_motor_vehicles", "all_hgvs"]].sum()
+    share = (totals["all_hgvs"] / totals["all_motor_vehicles"]).where(totals["all_motor_vehicles"] > 0)
+    hgv_share_by_region = {
+        name: (float(h) if h == h else None)
+        for name, h in share.items()
+    }
+    return density_by_la, hgv_share_by_region
+
+
+def expected_speeds(road_types, traffic_density, hgvs_pct):
+    """Vectorised speed model: road-type baseline, reduced for congestion / heavy vehicles."""
+    road = pd.Series(road_types, dtype="object").fillna("").astype(str).str.lower()
+    speed = np.select(
+        [road.str.contains("motorway", regex=False),
+         road.str.contains("a road", regex=False),
+         road.str.contains("b road", regex=False),
+         road.str.contains("minor", regex=False)],
+        [70.0, 50.0, 40.0, 30.0],
+        default=40.0  # default baseline
+    )
+    density = np.array([d if d is not None else 0.0 for d in traffic_density], dtype=np.float64)
+    hgvs = np.array([h if h is not None else 0.0 for h in hgvs_pct], dtype=np.float64)
+
+    # Adjust for congestion / heavy vehicles
+    speed = np.where(density > 2e6, speed * 0.7, speed)
+    speed = np.where(hgvs > 0.25, speed * 0.8, speed)
+    return speed
+
+
+def enrich_customers(customers, df1, df2, df3, user_prefs=None, tree=None, indexes=None):
     """
     Enrich customers with traffic + contextual metadata.
     Includes:
@@ -23,14 +103,21 @@ def enrich_customers(customers, df1, df2, df3, user_prefs=None):
       - Region stats (macro mobility, HGV composition)
       - Slot → time_window (usable by OR-Tools)
       - User preference signals (priority, avoid_zones, eco_mode)
+    The reference frames are treated as read-only, so they can be shared
+    across requests and threads. Pass the frames, `tree` and `indexes` from
+    helpers.traffic_store to skip all per-request key normalisation, tree
+    building and aggregation. All customers are matched in one BallTree
+    query, so cost is O(customers) once the reference data is prepared.
     """
-    tree = build_countpoint_tree(df3)
-
-    # Normalize join keys
-    df1["local_authority_name"] = df1["local_authority_name"].str.strip().str.lower()
-    df2["region_name"] = df2["region_name"].str.strip().str.lower()
-    df3["local_authority_name"] = df3["local_authority_name"].str.strip().str.lower()
-    df3["region_name"] = df3["region_name"].str.strip().str.lower()
+    if not customers:
+        return []
+    # Normalised copies only when given raw frames (no-op for the cached ones)
+    df1, df2, df3 = normalize_reference_frames(df1, df2, df3)
+    if tree is None:
+        tree = build_countpoint_tree(df3)
+    if indexes is None:
+        indexes = build_reference_indexes(df1, df2)
+    density_by_la, hgv_share_by_region = indexes
 
     # Slot → numeric minutes
     slot_windows = {
@@ -40,46 +127,41 @@ def enrich_customers(customers, df1, df2, df3, user_prefs=None):
         "Anytime": [480, 1080]      # 08:00–18:00
     }
 
-    enriched = []
-    for c in customers:
-        row_dict, dist_km = match_to_countpoint(c, df3, tree)
-        la_name = str(row_dict.get("local_authority_name", "")).lower()
-        reg_name = str(row_dict.get("region_name", "")).lower()
-
-        # --- df1 (local authority) → traffic density
-        traffic_density = None
-        if la_name in df1["local_authority_name"].values:
-            la_data = df1[df1["local_authority_name"] == la_name].iloc[0]
-            if la_data.get("link_length_km", 0) > 0:
-                traffic_density = la_data["all_motor_vehicles"] / la_data["link_length_km"]
-
-        # --- df2 (region) → HGV share
-        hgvs_pct = None
-        if reg_name in df2["region_name"].values:
-            reg_data = df2[df2["region_name"] == reg_name]
-            total_mv = reg_data["all_motor_vehicles"].sum()
-            if total_mv > 0:
-                hgvs_pct = reg_data["all_hgvs"].sum() / total_mv
-
-        # --- Predicted travel speed (derived feature) ---
-        road_type = str(row_dict.get("road_type", "")).lower()
-        expected_speed = 40.0  # default baseline
-
-        if "motorway" in road_type:
-            expected_speed = 70.0
-        elif "a road" in road_type:
-            expected_speed = 50.0
-        elif "b road" in road_type:
-            expected_speed = 40.0
-        elif "minor" in road_type:
-            expected_speed = 30.0
-
-        # Adjust for congestion / heavy vehicles
-        if traffic_density and traffic_density > 2e6:
-            expected_speed *= 0.7
-        if hgvs_pct and hgvs_pct > 0.25:
-            expected_speed *= 0.8
+    # --- Nearest countpoint for every customer in one query
+    coords = np.radians([[c["lat"], c["lon"]] for c in customers])
+    dist, idx = tree.query(coords, k=1)
+    idx = idx[:, 0]
+    dist_km = dist[:, 0] * 6371.0  # convert radians → km
+
+    def column(name, default=None):
+        if name not in df3:
+            return [default] * len(idx)
+        col = df3[name]
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            # gather codes, never materialise the full string column
+            codes = col.cat.codes.to_numpy()[idx]
+            cats = np.asarray(col.cat.categories, dtype=object)
+            return [cats[c] if c >= 0 else float("nan") for c in codes.tolist()]
+        return col.to_numpy()[idx].tolist()
+
+    la_names = [str(v).lower() for v in column("local_authority_name", "")]
+    reg_names = [str(v).lower() for v in column("region_name", "")]
+    road_types = [str(v).lower() for v in column("road_type", "")]
+    count_points = column("count_point_id")
+    traffic_hourly = column("all_motor_vehicles")
+
+    # --- df1 (local authority) → traffic density, df2 (region) → HGV share
+    traffic_density = [density_by_la.get(la) for la in la_names]
+    hgvs_pct = [hgv_share_by_region.get(reg) for reg in reg_names]
+
+    # --- Predicted travel speed (derived feature) ---
+    speeds = np.round(expected_speeds(road_types, traffic_density, hgvs_pct), 1).tolist()
+
+    priority_customers = set((user_prefs or {}).get("priority_customers", []))
+    avoid_zones = {z.lower() for z in (user_prefs or {}).get("avoid_zones", [])}
 
+    enriched = []
+    for i, c in enumerate(customers):
         # --- Slot → time_window in minutes
         slot_label = c.get("slot_label", "Anytime")
         time_window = slot_windows.get(slot_label, slot_windows["Anytime"])
@@ -87,10 +169,9 @@ def enrich_customers(customers, df1, df2, df3, user_prefs=None):
         # --- User preferences (context-aware AI input)
         priority = "normal"
         if user_prefs:
-            if c["customer_id"] in user_prefs.get("priority_customers", []):
+            if c["customer_id"] in priority_customers:
                 priority = "high"
-            avoid_zones = [z.lower() for z in user_prefs.get("avoid_zones", [])]
-            if la_name in avoid_zones or reg_name in avoid_zones:
+            if la_names[i] in avoid_zones or reg_names[i] in avoid_zones:
                 priority = "avoid"
 
         enriched.append({
@@ -99,16 +180,16 @@ def enrich_customers(customers, df1, df2, df3, user_prefs=None):
             "time_window": time_window,
             "weight": float(c.get("weight", 0)),
 
-            "region": reg_name,
-            "local_authority": la_name,
-            "road_type": road_type,
-            "nearest_count_point": row_dict.get("count_point_id"),
-            "dist_to_countpoint_km": round(dist_km, 2),
+            "region": reg_names[i],
+            "local_authority": la_names[i],
+            "road_type": road_types[i],
+            "nearest_count_point": count_points[i],
+            "dist_to_countpoint_km": round(float(dist_km[i]), 2),
 
-            "traffic_hourly": row_dict.get("all_motor_vehicles"),
-            "traffic_density": traffic_density,
-            "hgvs_pct": hgvs_pct,
-            "expected_speed_kmph": round(expected_speed, 1),
+            "traffic_hourly": traffic_hourly[i],
+            "traffic_density": traffic_density[i],
+            "hgvs_pct": hgvs_pct[i],
+            "expected_speed_kmph": speeds[i],
 
             "priority": priority
         })
@@ -2,9 +2,10 @@ import os
 import re
 import json
 import math
-import requests
 import google.generativeai as genai
 from dotenv import load_dotenv
+from helpers.cache_store import CacheStats
+from helpers.nearby_places import cached_lookups, get_places_cache
 load_dotenv()
 
 # 🔑 Configure Gemini
@@ -28,39 +29,78 @@ def haversine(lat1, lon1, lat2, lon2):
 # -------------------------------
 # Google Places API
 # -------------------------------
+SAFE_STOP_TYPES = ["hospital", "lodging", "parking"]
+
+
+def _safe_stop(place, place_type, lat, lon):
+    """A cached Places result as a rest-stop entry, with its distance from (lat, lon)."""
+    return {
+        "name": place.get("name"),
+        "type": place_type,
+        "address": place.get("address") or "Unknown",
+        "distance_km": round(haversine(lat, lon, place["lat"], place["lon"]), 2)
+    }
+
+
+def get_safe_rest_stops_batch(points, radius=5000, max_workers=None, cache=None, stats=None):
+    """
+    Safe rest stops for many (lat, lon) points at once, through the shared
+    Places cache (nearby_places.cached_lookups) unless another cache is given.
+    Returns one list (top 3 closest to each point) per point, in input order,
+    or None for a point whose lookups could not be made (no API key, failed request).
+    """
+    points = list(points)
+    if not GOOGLE_CLOUD_API:
+        return [None for _ in points]
+    cache = cache if cache is not None else get_places_cache()
+
+    found = cached_lookups(points, SAFE_STOP_TYPES, GOOGLE_CLOUD_API, radius, cache, stats, max_workers)
+    per_point = []
+    for (lat, lon), by_type in zip(points, found):
+        if any(places is None for places in by_type.values()):
+            per_point.append(None)
+            continue
+        results = [_safe_stop(p, place_type, lat, lon) for place_type, places in by_type.items() for p in places
+                   if p.get("lat") is not None and p.get("lon") is not None]
+        per_point.append(sorted(results, key=lambda x: x["distance_km"])[:3])
+    return per_point
+
+
 def get_safe_rest_stops(lat, lon, radius=5000):
     """
     Fetch nearby hospitals, hotels, parking.
     Returns top 3 closest with name, type, address, distance_km.
     """
-    if not GOOGLE_CLOUD_API:
-        return []
-
-    types = ["hospital", "lodging", "parking"]
-    results = []
-
-    for place_type in types:
-        url = (
-            f"https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-            f"?location={lat},{lon}&radius={radius}&type={place_type}&key={GOOGLE_CLOUD_API}"
-        )
-        res = requests.get(url).json()
-
-        if res.get("status") == "OK":
-            for place in res.get("results", []):
-                name = place.get("name")
-                address = place.get("vicinity", "Unknown")
-                loc = place.get("geometry", {}).get("location", {})
-                plat, plon = loc.get("lat"), loc.get("lng")
-                dist = haversine(lat, lon, plat, plon)
-                results.append({
-                    "name": name,
-                    "type": place_type,
-                    "address": address,
-                    "distance_km": round(dist, 2)
-                })
-
-    return sorted(results, key=lambda x: x["distance_km"])[:3]
+    return get_safe_rest_stops_batch([(lat, lon)], radius)[0] or []
+
+
+def enrich_with_rest_stops(routes_json, radius=5000, cache=None):
+    """
+    Attach nearby_safe_stops to every stop of every route.
+    Runs once when the route is saved, so fatigue chat messages read the
+    stored list instead of calling the Places API per message. Stops whose
+    lookup failed are left without the key, so the fatigue endpoint retries
+    them; hit/miss counters land in routes_json["diagnostics"]["rest_stops_cache"].
+    """
+    stops = [stop for route in routes_json.get("refined_routes", []) for stop in route.get("sequence", [])]
+    stats = CacheStats()
+    safe_stops = get_safe_rest_stops_batch(((stop["lat"], stop["lon"]) for stop in stops), radius,
+                                           cache=cache, stats=stats)
+    for stop, nearby in zip(stops, safe_stops):
+        if nearby is not None:
+            stop["nearby_safe_stops"] = nearby
+    routes_json.setdefault("diagnostics", {})["rest_stops_cache"] = stats.as_dict()
+    print("Rest stops cache:", stats.as_dict())
+    return routes_json
+
+
+def has_rest_stops(routes_json):
+    """True if every stop already carries a non-empty precomputed nearby_safe_stops."""
+    return all(
+        stop.get("nearby_safe_stops")
+        for route in routes_json.get("refined_routes", [])
+        for stop in route.get("sequence", [])
+    )
 
 # -------------------------------
 # Payload Cleaning
@@ -78,7 +118,7 @@ def clean_payload(original_json):
                 "distance_to_depot_km": round(
                     haversine(stop_lat, stop_lon, depot_lat, depot_lon), 2
                 ),
-                "nearby_safe_stops": get_safe_rest_stops(stop_lat, stop_lon)
+                "nearby_safe_stops": stop.get("nearby_safe_stops", [])   # precomputed at solve time
             }
             minimal_seq.append(minimal_stop)
 
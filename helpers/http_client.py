@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))                    # seconds per request
+HTTP_MAX_CONCURRENCY = int(os.getenv("HTTP_MAX_CONCURRENCY", "8"))        # fan-out width
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "3"))
+HTTP_BACKOFF = float(os.getenv("HTTP_BACKOFF", "0.5"))                    # 0.5s, 1s, 2s, ...
+
+# Google APIs report throttling in the JSON body with HTTP 200
+RETRYABLE_API_STATUSES = ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide keep-alive session: pooled connections + retry with backoff on 429/5xx."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset(["GET"])
+            )
+            adapter = HTTPAdapter(
+                pool_connections=10,
+                pool_maxsize=max(10, HTTP_MAX_CONCURRENCY * 2),
+                max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def get_json(url, params=None, timeout=None):
+    """
+    GET a JSON API through the shared session.
+    Retries (with backoff) on connection errors, 429/5xx, and on Google's
+    in-body OVER_QUERY_LIMIT / UNKNOWN_ERROR statuses. Returns the decoded body;
+    on persistent failure returns {"status": "REQUEST_FAILED", "error_message": ...}.
+    """
+    body = None
+    for attempt in range(HTTP_RETRIES + 1):
+        try:
+            res = get_session().get(url, params=params, timeout=timeout or HTTP_TIMEOUT)
+            body = res.json()
+        except (requests.RequestException, ValueError) as e:
+            body = {"status": "REQUEST_FAILED", "error_message": str(e)}
+            break   # transport-level retries already happened in the adapter
+
+        if body.get("status") not in RETRYABLE_API_STATUSES or attempt == HTTP_RETRIES:
+            break
+        time.sleep(HTTP_BACKOFF * (2 ** attempt))
+    return body
+
+
+def fan_out(fn, items, max_workers=None):
+    """
+    Run fn(item) for every item on a bounded thread pool; results in input order.
+    Exceptions propagate from the failing item.
+    """
+    items = list(items)
+    if not items:
+        return []
+    workers = max(1, min(max_workers or HTTP_MAX_CONCURRENCY, len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http") as pool:
+        return list(pool.map(fn, items))
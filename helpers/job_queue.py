@@ -0,0 +1,61 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Background solves per worker process (each gunicorn worker has its own pool)
+SOLVE_WORKERS = int(os.getenv("SOLVE_WORKERS", "2"))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Create the pool lazily so it is started after gunicorn forks its workers."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SOLVE_WORKERS, thread_name_prefix="solve")
+        return _executor
+
+
+def submit_job(app, fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the background pool inside a Flask app context."""
+    def run():
+        with app.app_context():
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                print(f"⚠️ Background job {getattr(fn, '__name__', fn)} failed:", e)
+                raise
+
+    return get_executor().submit(run)
+
+
+# Depots solved side by side inside one multi-depot job
+DEPOT_WORKERS = int(os.getenv("DEPOT_WORKERS", "4"))
+
+
+def map_in_app_context(app, fn, items, max_workers=None):
+    """
+    Run fn(item) for every item on a short-lived thread pool, each call inside
+    its own app context (and so its own DB session). Returns {item: result}
+    where a failed call maps to the exception it raised.
+
+    Uses a private pool rather than the shared one: a queued job fanning out
+    onto its own executor would deadlock once every slot holds a parent job.
+    """
+    def run(item):
+        with app.app_context():
+            return fn(item)
+
+    items = list(items)
+    workers = max(1, min(max_workers or DEPOT_WORKERS, len(items)))
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="depot") as pool:
+        futures = {pool.submit(run, item): item for item in items}
+        for future, item in futures.items():
+            try:
+                outcomes[item] = future.result()
+            except Exception as e:
+                outcomes[item] = e
+    return outcomes
@@ -0,0 +1,344 @@
+"""
+Deterministic local-search route improvement.
+
+improve_routes() is a generic engine over point indices and a cost matrix:
+2-opt, Or-opt (segments of 1-3 stops, moved within a route) and relocate /
+exchange moves across vehicles, first-improvement in a fixed scan order,
+under capacity limits, optional time windows (a move may not make any route
+later) and a wall-clock budget. Route endpoints (the depot) stay fixed.
+
+reroute_locally() applies it to the traffic-enriched plan as a drop-in for
+helpers/traffic_reroute.reroute_with_traffic: same refined_routes schema,
+minimising total traffic time, in milliseconds and reproducibly, without
+breaking the slot windows the OR-Tools plan was built for.
+"""
+import copy
+import os
+import time
+
+import numpy as np
+
+from helpers.dist_comp import haversine_matrix
+from helpers.ortools import DEPOT_OPEN_MIN, SERVICE_TIME_MIN
+
+LOCAL_REROUTE_TIME_BUDGET = float(os.getenv("LOCAL_REROUTE_TIME_BUDGET", "0.5"))   # seconds
+# "local" (default) or "llm" for the Gemini reroute pass
+TRAFFIC_REROUTE_ENGINE = os.getenv("TRAFFIC_REROUTE_ENGINE", "local").lower()
+
+DEFAULT_SPEED_KMPH = 40    # used to estimate unknown legs when no leg was fetched
+EPS = 1e-9
+
+
+def route_cost(route, cost):
+    return sum(cost[route[k]][route[k + 1]] for k in range(len(route) - 1))
+
+
+def route_lateness(route, cost, windows, service_s=0.0, start_s=0.0):
+    """
+    Seconds past window close summed over a route's stops. windows[p] is
+    (open_s, close_s) or None; early arrivals wait for the window to open.
+    """
+    t, late = start_s, 0.0
+    for k in range(1, len(route) - 1):
+        t += cost[route[k - 1]][route[k]]
+        window = windows[route[k]]
+        if window is not None:
+            t = max(t, window[0])
+            late += max(0.0, t - window[1])
+        t += service_s
+    return late
+
+
+def _prefix_costs(route, cost):
+    """Forward and reverse cumulative arc costs along a route (for O(1) 2-opt deltas)."""
+    fwd, bwd = [0.0], [0.0]
+    for k in range(len(route) - 1):
+        fwd.append(fwd[-1] + cost[route[k]][route[k + 1]])
+        bwd.append(bwd[-1] + cost[route[k + 1]][route[k]])
+    return fwd, bwd
+
+
+def _two_opt(routes, cost, accept):
+    for a, r in enumerate(routes):
+        if len(r) < 4:
+            continue
+        fwd, bwd = _prefix_costs(r, cost)
+        for i in range(1, len(r) - 2):
+            for j in range(i + 1, len(r) - 1):
+                # reverse r[i..j]; inner arcs change direction (costs may be asymmetric)
+                delta = (cost[r[i - 1]][r[j]] + (bwd[j] - bwd[i]) + cost[r[i]][r[j + 1]]
+                         - cost[r[i - 1]][r[i]] - (fwd[j] - fwd[i]) - cost[r[j]][r[j + 1]])
+                if delta < -EPS:
+                    new = r[:i] + r[i:j + 1][::-1] + r[j + 1:]
+                    if accept(a, new):
+                        r[:] = new
+                        return "two_opt"
+    return None
+
+
+def _move_segment(routes, cost, demand, capacity, loads, max_segment, accept):
+    """Or-opt within a route and relocate across routes: move 1..max_segment stops."""
+    for a, ra in enumerate(routes):
+        for length in range(1, max_segment + 1):
+            for i in range(1, len(ra) - length):
+                seg = ra[i:i + length]
+                prev, nxt = ra[i - 1], ra[i + length]
+                seg_cost = sum(cost[seg[k]][seg[k + 1]] for k in range(length - 1))
+                removal_gain = cost[prev][seg[0]] + seg_cost + cost[seg[-1]][nxt] - cost[prev][nxt]
+                seg_load = sum(demand[p] for p in seg)
+
+                for b, rb in enumerate(routes):
+                    if b != a and capacity[b] is not None and loads[b] + seg_load > capacity[b]:
+                        continue
+                    rest = ra[:i] + ra[i + length:] if b == a else rb
+                    for k in range(1, len(rest)):
+                        if b == a and k == i:
+                            continue   # original position
+                        x, y = rest[k - 1], rest[k]
+                        insert_cost = cost[x][seg[0]] + seg_cost + cost[seg[-1]][y] - cost[x][y]
+                        if insert_cost - removal_gain < -EPS:
+                            new = rest[:k] + seg + rest[k:]
+                            if b == a:
+                                if not accept(a, new):
+                                    continue
+                                ra[:] = new
+                                return "or_opt"
+                            shorter = ra[:i] + ra[i + length:]
+                            if not (accept(a, shorter) and accept(b, new)):
+                                continue
+                            ra[:] = shorter
+                            rb[:] = new
+                            loads[a] -= seg_load
+                            loads[b] += seg_load
+                            return "relocate"
+    return None
+
+
+def _exchange(routes, cost, demand, capacity, loads, accept):
+    """Swap one stop between two routes."""
+    for a in range(len(routes)):
+        ra = routes[a]
+        for b in range(a + 1, len(routes)):
+            rb = routes[b]
+            for i in range(1, len(ra) - 1):
+                u = ra[i]
+                for j in range(1, len(rb) - 1):
+                    v = rb[j]
+                    if ((capacity[a] is not None and loads[a] - demand[u] + demand[v] > capacity[a])
+                            or (capacity[b] is not None and loads[b] - demand[v] + demand[u] > capacity[b])):
+                        continue
+                    delta = (cost[ra[i - 1]][v] + cost[v][ra[i + 1]] - cost[ra[i - 1]][u] - cost[u][ra[i + 1]]
+                             + cost[rb[j - 1]][u] + cost[u][rb[j + 1]] - cost[rb[j - 1]][v] - cost[v][rb[j + 1]])
+                    if delta < -EPS:
+                        if not (accept(a, ra[:i] + [v] + ra[i + 1:]) and accept(b, rb[:j] + [u] + rb[j + 1:])):
+                            continue
+                        ra[i], rb[j] = v, u
+                        loads[a] += demand[v] - demand[u]
+                        loads[b] += demand[u] - demand[v]
+                        return "exchange"
+    return None
+
+
+def improve_routes(routes, cost, demand=None, capacity=None, time_budget=None, max_segment=3,
+                   windows=None, service_s=0.0, start_s=0.0):
+    """
+    Improve a set of routes with local search (the input lists are not modified).
+
+    Args:
+        routes (list[list[int]]): point indices per vehicle, first/last are fixed endpoints
+        cost (list[list[float]]): cost[i][j] of travelling i -> j (may be asymmetric)
+        demand (list[float] | None): load per point (endpoints should be 0)
+        capacity (float | list | None): load limit for every route, or one per
+            route (mixed fleet); None for unlimited
+        time_budget (float | None): seconds, default LOCAL_REROUTE_TIME_BUDGET
+        max_segment (int): longest segment moved by Or-opt / relocate
+        windows (list | None): (open, close) per point in cost units (seconds)
+            or None; a move is rejected if it makes any route later
+            (route_lateness from start_s with service_s per stop)
+
+    Returns:
+        (routes, stats): improved copies and {before, after, moves, stop_reason, elapsed_ms}
+    """
+    time_budget = LOCAL_REROUTE_TIME_BUDGET if time_budget is None else time_budget
+    routes = [list(r) for r in routes]
+    demand = demand if demand is not None else [0] * len(cost)
+    if not isinstance(capacity, (list, tuple)):
+        capacity = [capacity] * len(routes)
+    loads = [sum(demand[p] for p in r[1:-1]) for r in routes]
+
+    if windows is None:
+        def accept(v, new_route):
+            return True
+    else:
+        def accept(v, new_route):
+            return (route_lateness(new_route, cost, windows, service_s, start_s)
+                    <= route_lateness(routes[v], cost, windows, service_s, start_s) + EPS)
+
+    started = time.perf_counter()
+    before = sum(route_cost(r, cost) for r in routes)
+    moves = {"two_opt": 0, "or_opt": 0, "relocate": 0, "exchange": 0}
+    stop_reason = "local_optimum"
+
+    while True:
+        if time.perf_counter() - started > time_budget:
+            stop_reason = "time_budget"
+            break
+        move = (_two_opt(routes, cost, accept)
+                or _move_segment(routes, cost, demand, capacity, loads, max_segment, accept)
+                or _exchange(routes, cost, demand, capacity, loads, accept))
+        if move is None:
+            break
+        moves[move] += 1
+
+    after = sum(route_cost(r, cost) for r in routes)
+    return routes, {
+        "before": round(before, 3),
+        "after": round(after, 3),
+        "moves": moves,
+        "stop_reason": stop_reason,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+def _leg_duration_matrices(points, traffic_matrix):
+    """
+    Normal and traffic seconds between all points. Fetched legs come from the
+    traffic matrix; the rest are estimated from great-circle distance at the
+    average speed observed on fetched legs. "measured" flags the fetched
+    (traffic) legs; the diagonal counts as measured.
+    """
+    lats = [p[0] for p in points]
+    lons = [p[1] for p in points]
+    km = haversine_matrix(lats, lons)
+
+    point_index = {f"{p[0]},{p[1]}": k for k, p in enumerate(points)}
+    legs = []
+    for key, leg in traffic_matrix.items():
+        origin, _, destination = key.partition("|")
+        i, j = point_index.get(origin), point_index.get(destination)
+        if i is not None and j is not None and i != j:
+            legs.append((i, j, leg))
+
+    matrices = {}
+    for kind in ("normal", "traffic"):
+        known = {(i, j): leg[kind] for i, j, leg in legs if leg.get(kind)}
+        known_km = sum(km[i, j] for i, j in known)
+        known_secs = sum(known.values())
+        secs_per_km = known_secs / known_km if known_km > 0 else 3600.0 / DEFAULT_SPEED_KMPH
+
+        secs = km * secs_per_km
+        for (i, j), value in known.items():
+            secs[i, j] = value
+        np.fill_diagonal(secs, 0.0)
+        matrices[kind] = secs
+        if kind == "traffic":
+            measured = np.eye(len(points), dtype=bool)
+            for i, j in known:
+                measured[i, j] = True
+            matrices["measured"] = measured
+    return matrices
+
+
+def _plan_totals(index_routes, node, matrices):
+    """(normal secs, traffic secs, estimated leg count) per route of point-index routes."""
+    totals = []
+    for r in index_routes:
+        legs = [(node[r[k]], node[r[k + 1]]) for k in range(len(r) - 1)]
+        totals.append((sum(matrices["normal"][i, j] for i, j in legs),
+                       sum(matrices["traffic"][i, j] for i, j in legs),
+                       sum(1 for i, j in legs if not matrices["measured"][i, j])))
+    return totals
+
+
+def reroute_locally(traffic_routes, traffic_matrix, demands=None, vehicle_capacity=None, time_budget=None,
+                    time_windows=None, measure=None):
+    """
+    Traffic-aware rerouting of refined_routes with improve_routes().
+
+    Args:
+        traffic_routes (dict): output of add_traffic_durations
+        traffic_matrix (dict): {"lat1,lon1|lat2,lon2": {"normal": s, "traffic": s}}
+        demands (dict | None): stop id -> load
+        vehicle_capacity (float | list | None): load limit per vehicle, or one
+            per refined route (mixed fleet)
+        time_windows (dict | None): stop id -> (open_min, close_min); when
+            given, no move may make a route later than the plan it started from
+            (routes leave at DEPOT_OPEN_MIN, SERVICE_TIME_MIN per stop)
+        measure (callable | None): plan -> (plan, traffic_matrix), e.g.
+            add_traffic_durations. Legs the search did not have measured are
+            estimated, so the reordered plan is measured and kept only if its
+            measured traffic time beats the original plan's.
+
+    Returns:
+        dict: same schema with reordered sequences, refreshed duration metrics
+        (estimated_legs counts legs without a measured duration) and
+        diagnostics["local_reroute"].
+    """
+    plan = copy.deepcopy(traffic_routes)
+    demands = demands or {}
+    routes = plan.get("refined_routes", [])
+
+    stops, index_routes = [], []
+    for route in routes:
+        seq = route.get("sequence", [])
+        index_routes.append(list(range(len(stops), len(stops) + len(seq))))
+        stops.extend(seq)
+    if not stops:
+        return plan
+
+    points = list(dict.fromkeys((s["lat"], s["lon"]) for s in stops))
+    point_of = {p: k for k, p in enumerate(points)}
+    node = [point_of[(s["lat"], s["lon"])] for s in stops]
+    matrices = _leg_duration_matrices(points, traffic_matrix)
+    traffic = matrices["traffic"][np.ix_(node, node)].tolist()
+    demand = [float(demands.get(s.get("id"), 0) or 0) for s in stops]
+
+    # sequences too short to have fixed depot endpoints are left as they are
+    movable = [r for r in index_routes if len(r) >= 2]
+    if isinstance(vehicle_capacity, (list, tuple)):
+        vehicle_capacity = [c for c, r in zip(vehicle_capacity, index_routes) if len(r) >= 2]
+    windows = None
+    if time_windows:
+        windows = [tuple(60.0 * m for m in time_windows[s.get("id")]) if s.get("id") in time_windows else None
+                   for s in stops]
+    improved, stats = improve_routes(
+        movable, traffic, demand, vehicle_capacity, time_budget,
+        windows=windows, service_s=60.0 * SERVICE_TIME_MIN, start_s=60.0 * DEPOT_OPEN_MIN
+    )
+    improved = iter(improved)
+    final = [next(improved) if len(r) >= 2 else r for r in index_routes]
+
+    stats["measured"] = None
+    if measure is not None and final != index_routes:
+        candidate = copy.deepcopy(traffic_routes)
+        for route, r in zip(candidate.get("refined_routes", []), final):
+            route["sequence"] = [stops[k] for k in r]
+        try:
+            _, fetched = measure(candidate)
+            matrices = _leg_duration_matrices(points, {**traffic_matrix, **fetched})
+            before = sum(t for _, t, _ in _plan_totals(index_routes, node, matrices))
+            after = sum(t for _, t, _ in _plan_totals(final, node, matrices))
+            stats["measured"] = {"before": round(float(before), 3), "after": round(float(after), 3),
+                                 "accepted": bool(after < before)}
+        except Exception as e:
+            print("⚠️ Could not measure the rerouted legs, keeping the original order:", e)
+            stats["measured"] = {"accepted": False, "error": str(e)}
+        if not stats["measured"]["accepted"]:
+            final = index_routes
+
+    totals = _plan_totals(final, node, matrices)
+    for route, r, (total_normal, total_traffic, estimated) in zip(routes, final, totals):
+        route["sequence"] = [stops[k] for k in r]
+        metrics = route.setdefault("metrics", {})
+        metrics["estimated_legs"] = estimated
+        metrics["total_normal_duration_secs"] = int(round(total_normal))
+        metrics["total_normal_duration_mins"] = round(total_normal / 60, 2)
+        metrics["total_traffic_duration_secs"] = int(round(total_traffic))
+        metrics["total_traffic_duration_mins"] = round(total_traffic / 60, 2)
+
+    stats["objective"] = "traffic_secs"
+    stats["estimated_legs"] = sum(estimated for _, _, estimated in totals)
+    stats["time_windows"] = windows is not None
+    plan.setdefault("diagnostics", {})["local_reroute"] = stats
+    print("Local reroute:", stats)
+    return plan
@@ -1,43 +1,144 @@
-import requests
+import os
 
-def get_nearby_places(lat, lng, place_type, api_key, radius=5000, limit=5):
+from helpers.cache_store import CacheStats, SqliteTTLCache, geohash_encode
+from helpers.http_client import fan_out, get_json
+
+PLACES_API_URL = os.getenv("PLACES_API_URL", "https://maps.googleapis.com/maps/api/place/nearbysearch/json")
+
+# Places cache: geohash cell + type + radius, persisted in SQLite
+PLACES_CACHE_PATH = os.getenv("PLACES_CACHE_PATH", "cache/places_cache.sqlite3")
+PLACES_CACHE_TTL = int(os.getenv("PLACES_CACHE_TTL", str(7 * 24 * 3600)))   # seconds
+PLACES_CACHE_MAX_ENTRIES = int(os.getenv("PLACES_CACHE_MAX_ENTRIES", "50000"))
+PLACES_CACHE_PRECISION = int(os.getenv("PLACES_CACHE_PRECISION", "6"))     # ≈ 1.2 km cells
+
+_places_cache = None
+
+
+def get_places_cache():
+    """Shared Places cache for this process (created on first use)."""
+    global _places_cache
+    if _places_cache is None:
+        _places_cache = SqliteTTLCache(
+            PLACES_CACHE_PATH, "places_cache", PLACES_CACHE_TTL, PLACES_CACHE_MAX_ENTRIES
+        )
+    return _places_cache
+
+
+def places_cache_key(lat, lng, place_type, radius):
+    return f"{geohash_encode(lat, lng, PLACES_CACHE_PRECISION)}|{place_type}|{radius}"
+
+
+def fetch_nearby_places(lat, lng, place_type, api_key, radius=5000):
     """
-    Fetch nearby places (petrol stations, repair shops, etc.)
-    Returns a list of dicts with name, lat, lon, address
-    """
-    url = (
-        "https://maps.googleapis.com/maps/api/place/nearbysearch/json"
-        f"?location={lat},{lng}"
-        f"&radius={radius}"
-        f"&type={place_type}"
-        f"&key={api_key}"
-    )
-    res = requests.get(url).json()
+    One Places Nearby Search request.
+    Returns the full result list, or None if the API call failed (not cacheable).
+    """
+    res = get_json(PLACES_API_URL, params={
+        "location": f"{lat},{lng}",
+        "radius": radius,
+        "type": place_type,
+        "key": api_key
+    })
+    if res.get("status") not in ("OK", "ZERO_RESULTS"):
+        return None
+
     places = []
-    if res.get("status") == "OK":
-        for place in res.get("results", [])[:limit]:
-            loc = place.get("geometry", {}).get("location", {})
-            places.append({
-                "name": place.get("name"),
-                "address": place.get("vicinity"),
-                "lat": loc.get("lat"),
-                "lon": loc.get("lng")
-            })
+    for place in res.get("results", []):
+        loc = place.get("geometry", {}).get("location", {})
+        places.append({
+            "name": place.get("name"),
+            "address": place.get("vicinity"),
+            "lat": loc.get("lat"),
+            "lon": loc.get("lng")
+        })
     return places
 
 
-def enrich_with_support_stations(routes_json: dict, api_key: str, radius=3000, limit=2):
+def get_nearby_places(lat, lng, place_type, api_key, radius=5000, limit=5, cache=None, stats=None):
     """
-    Enriches each node in routes_json with nearby petrol stations & repair shops.
+    Fetch nearby places (petrol stations, repair shops, etc.)
+    Returns a list of dicts with name, lat, lon, address.
+    With a cache, stops in the same geohash cell share one lookup per
+    place type + radius, and a hit skips HTTP entirely.
     """
-    for route in routes_json.get("refined_routes", []):
-        for node in route.get("sequence", []):
-            lat, lon = node["lat"], node["lon"]
+    key = places_cache_key(lat, lng, place_type, radius) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if stats is not None:
+            stats.record(cached is not None)
+        if cached is not None:
+            return cached[:limit]
 
-            petrol_stations = get_nearby_places(lat, lon, "gas_station", api_key, radius, limit)
-            repair_shops = get_nearby_places(lat, lon, "car_repair", api_key, radius, limit)
+    places = fetch_nearby_places(lat, lng, place_type, api_key, radius)
+    if places is None:
+        return []
+    if key is not None:
+        cache.set(key, places)
+    return places[:limit]
+
+
+def cached_lookups(points, place_types, api_key, radius, cache, stats=None, max_workers=None):
+    """
+    Places lookups for many (lat, lon) points and place types at once.
+
+    Lookups are deduplicated per cache key (geohash cell + type + radius): the
+    first point in a cell stands for the others, cached cells skip HTTP, and the
+    remaining requests run concurrently on the shared HTTP session.
+    Returns one {place_type: places} dict per point, in input order; places is
+    None when the request failed (nothing is cached then).
+    """
+    points = list(points)
+    lookups = []        # (point index, place_type, key)
+    unique = {}         # key -> (lat, lon, place_type)
+    for i, (lat, lon) in enumerate(points):
+        for place_type in place_types:
+            key = places_cache_key(lat, lon, place_type, radius)
+            lookups.append((i, place_type, key))
+            unique.setdefault(key, (lat, lon, place_type))
+
+    def resolve(item):
+        key, (lat, lon, place_type) = item
+        cached = cache.get(key)
+        if cached is not None:
+            return cached, True
+        places = fetch_nearby_places(lat, lon, place_type, api_key, radius)
+        if places is not None:
+            cache.set(key, places)
+        return places, False
+
+    items = list(unique.items())
+    resolved = dict(zip((key for key, _ in items), fan_out(resolve, items, max_workers)))
+
+    per_point = [{} for _ in points]
+    seen = set()
+    for i, place_type, key in lookups:
+        places, from_cache = resolved[key]
+        if stats is not None:
+            # a second point in the same cell is served by the first one's lookup
+            stats.record(from_cache or key in seen)
+        seen.add(key)
+        per_point[i][place_type] = places
+    return per_point
+
+
+def enrich_with_support_stations(routes_json: dict, api_key: str, radius=3000, limit=2, cache=None, max_workers=None):
+    """
+    Enriches each node in routes_json with nearby petrol stations & repair shops
+    (cached_lookups: one request per geohash cell and type, run concurrently).
+    Uses the shared Places cache unless another cache is given; hit/miss
+    counters land in routes_json["diagnostics"]["places_cache"].
+    """
+    cache = cache if cache is not None else get_places_cache()
+    stats = CacheStats()
+    place_types = (("nearby_petrol_stations", "gas_station"), ("nearby_repair_shops", "car_repair"))
 
-            node["nearby_petrol_stations"] = petrol_stations
-            node["nearby_repair_shops"] = repair_shops
+    nodes = [node for route in routes_json.get("refined_routes", []) for node in route.get("sequence", [])]
+    found = cached_lookups(((node["lat"], node["lon"]) for node in nodes), [t for _, t in place_types],
+                           api_key, radius, cache, stats, max_workers)
+    for node, by_type in zip(nodes, found):
+        for field, place_type in place_types:
+            node[field] = (by_type[place_type] or [])[:limit]
 
+    routes_json.setdefault("diagnostics", {})["places_cache"] = stats.as_dict()
+    print("Places cache:", stats.as_dict())
     return routes_json
@@ -110,8 +110,732 @@ def ortools_vrp(
     return routes'''
     
     
+import math
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
 from ortools.constraint_solver import pywrapcp, routing_enums_pb2
-from helpers.dist_comp import compute_distance_matrix
+import numpy as np
+from sklearn.neighbors import BallTree
+from helpers.dist_comp import compute_distance_matrix, travel_time_matrix
+
+DEFAULT_STRATEGY = ("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH")
+
+# Portfolio mode: several first-solution / metaheuristic pairs searched at once
+# in a process pool, best objective wins
+SOLVER_PORTFOLIO = os.getenv("SOLVER_PORTFOLIO", "0").lower() in ("1", "true", "yes", "on")
+SOLVER_PORTFOLIO_STRATEGIES = os.getenv(
+    "SOLVER_PORTFOLIO_STRATEGIES",
+    "PATH_CHEAPEST_ARC:GUIDED_LOCAL_SEARCH,SAVINGS:GUIDED_LOCAL_SEARCH,"
+    "PARALLEL_CHEAPEST_INSERTION:TABU_SEARCH,PATH_CHEAPEST_ARC:SIMULATED_ANNEALING"
+)
+SOLVER_PORTFOLIO_WORKERS = int(os.getenv("SOLVER_PORTFOLIO_WORKERS", "0")) or os.cpu_count() or 1
+
+# Share of time_limit given to a search that starts from the previous plan
+WARM_START_TIME_FRACTION = float(os.getenv("WARM_START_TIME_FRACTION", "0.3"))
+# Minimum share of the current customers the previous plan must cover to be used as a seed
+WARM_START_MIN_OVERLAP = float(os.getenv("WARM_START_MIN_OVERLAP", "0.5"))
+
+# Search budget: min + per-node seconds, capped by time_limit; stop early once
+# the objective has not improved for the stall window
+SOLVER_MIN_TIME_LIMIT = float(os.getenv("SOLVER_MIN_TIME_LIMIT", "1.0"))
+SOLVER_SECONDS_PER_NODE = float(os.getenv("SOLVER_SECONDS_PER_NODE", "0.05"))
+SOLVER_STALL_SECONDS = float(os.getenv("SOLVER_STALL_SECONDS", "0")) or None   # default: scaled
+SOLVER_STALL_FRACTION = 0.25
+SOLVER_MIN_STALL_SECONDS = 0.3
+OBJECTIVE_TRACE_MAX = 100
+
+# Time dimension: customers' time_window (minutes of day) + service time,
+# travel times from each customer's expected_speed_kmph
+SOLVER_TIME_WINDOWS = os.getenv("SOLVER_TIME_WINDOWS", "1").lower() in ("1", "true", "yes", "on")
+SERVICE_TIME_MIN = float(os.getenv("SERVICE_TIME_MIN", "5"))
+DEPOT_OPEN_MIN = int(os.getenv("DEPOT_OPEN_MIN", "480"))       # 08:00
+DEPOT_CLOSE_MIN = int(os.getenv("DEPOT_CLOSE_MIN", "1440"))    # vehicles back by midnight
+DEFAULT_SPEED_KMPH = 40.0
+
+# Candidate graph: each customer's successors restricted to its k nearest
+# customers (either direction) plus the depot. "auto" picks k from the size
+# once there are SOLVER_KNN_MIN_NODES customers; "off" or a fixed k otherwise.
+SOLVER_KNN = os.getenv("SOLVER_KNN", "auto").lower()
+SOLVER_KNN_MIN_NODES = int(os.getenv("SOLVER_KNN_MIN_NODES", "200"))
+SOLVER_KNN_MIN_K = 15
+# "penalty": pruned arcs cost more than crossing the whole map (always feasible);
+# "forbid": pruned arcs leave the NextVar domains (can starve tight fleets)
+SOLVER_KNN_MODE = os.getenv("SOLVER_KNN_MODE", "penalty").lower()
+
+# cluster-first decomposition (helpers/cluster_vrp.py) above this many customers; 0 disables
+SOLVER_CLUSTER_THRESHOLD = int(os.getenv("SOLVER_CLUSTER_THRESHOLD", "300"))
+# soft-window fallback: cost (in meters) per second of lateness
+LATE_PENALTY_PER_SEC = int(os.getenv("LATE_PENALTY_PER_SEC", "100"))
+
+
+def expand_fleet(vehicle_profiles, vehicle_capacity, tank_size, mileage):
+    """
+    Per-vehicle specs from vehicle profiles
+    [{"name", "count", "capacity", "tank_size", "mileage"}, ...]; missing
+    fields fall back to the scalar arguments.
+
+    Returns:
+        (vehicles, profiles): one {"name", "capacity", "tank_size", "mileage", "profile"}
+        per vehicle, and the distinct (tank_size, mileage) pairs they index
+    """
+    vehicles, profiles = [], []
+    for k, spec in enumerate(vehicle_profiles):
+        tank = float(spec.get("tank_size") or tank_size)
+        km_per_l = float(spec.get("mileage") or mileage)
+        if (tank, km_per_l) not in profiles:
+            profiles.append((tank, km_per_l))
+        for _ in range(int(spec.get("count", 1))):
+            vehicles.append({
+                "name": spec.get("name") or f"profile-{k + 1}",
+                "capacity": int(spec.get("capacity") or vehicle_capacity),
+                "tank_size": tank,
+                "mileage": km_per_l,
+                "profile": profiles.index((tank, km_per_l))
+            })
+    return vehicles, profiles
+
+
+def build_cost_arrays(dist_matrix, mileage, tank_size, refuel_flags):
+    """
+    Precompute the integer arrays OR-Tools consumes, once per solve.
+
+    Args:
+        dist_matrix (np.ndarray): [n x n] distances in km
+        mileage (float): km per liter
+        tank_size (float): liters
+        refuel_flags (array-like of bool): True where arriving at the node refills the tank
+
+    Returns:
+        dict with
+          "meters": [n x n] int64 arc lengths (m)
+          "fuel_net_ml": [n x n] int64 fuel delta on each arc (-used, +tank on refuel nodes)
+          "tank_size_ml": int
+    """
+    dist = np.asarray(dist_matrix, dtype=np.float64)
+    tank_size_ml = int(round(tank_size * 1000.0))
+
+    meters = np.rint(dist * 1000.0).astype(np.int64)
+    travel_ml = np.rint((dist / float(mileage)) * 1000.0).astype(np.int64)
+    refuel = np.asarray(refuel_flags, dtype=bool)
+    fuel_net_ml = -travel_ml + refuel[None, :].astype(np.int64) * tank_size_ml
+
+    return {"meters": meters, "fuel_net_ml": fuel_net_ml, "tank_size_ml": tank_size_ml}
+
+
+def solver_budget(num_nodes, time_limit):
+    """(time limit, stall window) in seconds for a problem of num_nodes; time_limit is the cap."""
+    limit = min(float(time_limit), SOLVER_MIN_TIME_LIMIT + SOLVER_SECONDS_PER_NODE * num_nodes)
+    stall = SOLVER_STALL_SECONDS or max(SOLVER_MIN_STALL_SECONDS, SOLVER_STALL_FRACTION * limit)
+    return limit, min(stall, limit)
+
+
+def attach_convergence_monitor(routing, stall_window):
+    """
+    Record the objective trace of a search and finish it once the best
+    objective has not improved for stall_window seconds.
+    Returns the dict the callback fills in.
+    """
+    state = {"started": time.perf_counter(), "best": None, "best_at": None,
+             "trace": [], "solutions": 0, "stalled": False, "active": True}
+
+    def on_solution():
+        if not state["active"]:
+            return   # callbacks stay registered on the model after their search
+        now = time.perf_counter() - state["started"]
+        value = routing.CostVar().Value()
+        state["solutions"] += 1
+        if state["best"] is None or value < state["best"]:
+            state["best"], state["best_at"] = value, now
+            if len(state["trace"]) < OBJECTIVE_TRACE_MAX:
+                state["trace"].append([round(now, 3), int(value)])
+        elif now - state["best_at"] > stall_window and not state["stalled"]:
+            state["stalled"] = True
+            routing.solver().FinishCurrentSearch()
+
+    routing.AddAtSolutionCallback(on_solution)
+    return state
+
+
+def search_summary(state, model, time_limit, stall_window, solution, routing):
+    """Diagnostics of one search: budget, objective trace, time to best, stop reason."""
+    state["active"] = False
+    wall = time.perf_counter() - state["started"]
+    if state["stalled"]:
+        reason = "stalled"
+    elif solution is None:
+        reason = "no_solution"
+    elif wall >= time_limit * 0.95:
+        reason = "time_limit"
+    else:
+        reason = "search_completed"
+    return {
+        "model": model,
+        "time_limit_s": round(time_limit, 3),
+        "stall_window_s": round(stall_window, 3),
+        "wall_s": round(wall, 3),
+        "solutions": state["solutions"],
+        "best_objective": state["best"],
+        "time_to_best_s": round(state["best_at"], 3) if state["best_at"] is not None else None,
+        "objective_trace": state["trace"],
+        "stop_reason": reason,
+        "status": int(routing.status())
+    }
+
+
+def precheck_feasibility(dist_matrix, demands, refuel_flags, customers, num_vehicles,
+                         vehicle_capacity, tank_size, mileage):
+    """
+    Analytic checks run before any solver call (O(n^2) at worst, no search).
+
+      capacity: total demand <= num_vehicles x capacity and no single package
+                above capacity; otherwise no model can succeed
+      fuel:     every customer must be reachable from a fuel source (depot or
+                refuel node) and back to one within tank_size x mileage km;
+                otherwise the fuel-aware model is skipped
+
+    vehicle_capacity, tank_size and mileage may be per-vehicle lists
+    (heterogeneous fleet): packages must fit the largest vehicle and
+    customers the longest range.
+
+    Returns a dict with "verdict" ("ok", "fuel_infeasible" or "infeasible")
+    and the offending quantities/customers.
+    """
+    capacities = np.broadcast_to(np.asarray(vehicle_capacity, dtype=np.int64), (int(num_vehicles),))
+    capacity = int(capacities.max())
+    total_demand = int(sum(demands))
+    fleet_capacity = int(capacities.sum())
+    oversized = [customers[i - 1]["customer_id"] for i in range(1, len(demands)) if demands[i] > capacity]
+
+    dist = np.asarray(dist_matrix, dtype=np.float64)
+    range_km = float(np.max(np.asarray(tank_size, dtype=np.float64) * np.asarray(mileage, dtype=np.float64)))
+    sources = np.flatnonzero(np.asarray(refuel_flags, dtype=bool))
+    sources = np.union1d(sources, [0])   # start with a full tank at the depot
+    out_of_range = []
+    if len(dist) > 1:
+        round_trip = dist[sources, 1:].min(axis=0) + dist[1:, sources].min(axis=1)
+        out_of_range = [customers[i]["customer_id"] for i in np.flatnonzero(round_trip > range_km)]
+
+    reasons = []
+    if total_demand > fleet_capacity:
+        reasons.append("total_demand_exceeds_fleet_capacity")
+    if oversized:
+        reasons.append("package_exceeds_vehicle_capacity")
+    if out_of_range:
+        reasons.append("customer_beyond_fuel_range")
+
+    if total_demand > fleet_capacity or oversized:
+        verdict = "infeasible"
+    elif out_of_range:
+        verdict = "fuel_infeasible"
+    else:
+        verdict = "ok"
+
+    return {
+        "verdict": verdict,
+        "reasons": reasons,
+        "total_demand": total_demand,
+        "fleet_capacity": fleet_capacity,
+        "oversized_packages": oversized,
+        "range_km": round(range_km, 3),
+        "out_of_range_customers": out_of_range
+    }
+
+
+def build_time_model(dist_matrix, customers, speeds_kmph=None, service_min=None):
+    """
+    Time dimension inputs for build_routing_model.
+
+    Travel time comes from travel_time_matrix() at the customers'
+    expected_speed_kmph (DEFAULT_SPEED_KMPH where missing, and at the depot);
+    the service time of the origin node is added to every outgoing arc.
+    Windows are the customers' time_window in minutes of the day (Anytime
+    when missing); the depot is open DEPOT_OPEN_MIN..DEPOT_CLOSE_MIN.
+
+    Returns {"rows", "array", "windows", "service_s", "soft"} with seconds as ints.
+    """
+    service_s = int(round(60 * (SERVICE_TIME_MIN if service_min is None else service_min)))
+    if speeds_kmph is None:
+        speeds_kmph = [DEFAULT_SPEED_KMPH] + [c.get("expected_speed_kmph") or DEFAULT_SPEED_KMPH for c in customers]
+    secs = travel_time_matrix(dist_matrix, speeds_kmph)
+    secs[1:, :] += service_s
+    np.fill_diagonal(secs, 0)
+    array = np.rint(secs).astype(np.int64)
+
+    return {"rows": array.tolist(), "array": array, "windows": node_windows(customers),
+            "service_s": service_s, "soft": False}
+
+
+def node_windows(customers):
+    """(open, close) in seconds of the day per node, depot first."""
+    windows = [(DEPOT_OPEN_MIN * 60, DEPOT_CLOSE_MIN * 60)]
+    for c in customers:
+        open_min, close_min = c.get("time_window") or (DEPOT_OPEN_MIN, DEPOT_CLOSE_MIN)
+        windows.append((int(open_min) * 60, int(close_min) * 60))
+    return windows
+
+
+def precheck_time_windows(time_model, customers):
+    """
+    Customers no vehicle can serve inside their window even on a direct trip:
+    leaving the depot at opening time arrives after the window closes, or
+    serving them cannot finish in time to get back before the depot closes.
+    """
+    secs = time_model["array"]
+    depot_open, depot_close = time_model["windows"][0]
+    unreachable = []
+    for node in range(1, len(secs)):
+        open_s, close_s = time_model["windows"][node]
+        arrival = max(depot_open + int(secs[0, node]), open_s)
+        if arrival > close_s or arrival + int(secs[node, 0]) > depot_close:
+            unreachable.append(customers[node - 1]["customer_id"])
+    return unreachable
+
+
+def simulate_arrivals(node_routes, time_model):
+    """Earliest arrival (seconds of the day) at each stop: leave at depot opening, wait for windows to open."""
+    secs = time_model["array"]
+    windows = time_model["windows"]
+    arrivals = []
+    for nodes in node_routes:
+        t, prev, times = windows[0][0], 0, []
+        for node in nodes:
+            t = max(t + int(secs[prev, node]), windows[node][0])
+            times.append(t)
+            prev = node
+        arrivals.append((times, t + int(secs[prev, 0]) if nodes else t))
+    return arrivals
+
+
+def window_diagnostics(node_routes, arrivals, time_model, customers, unreachable):
+    """On-time / late counts per delivery slot (slot_label, or the window itself)."""
+    windows = time_model["windows"]
+    unreachable = set(unreachable)
+    report = {}
+    for node, cust in enumerate(customers, start=1):
+        open_s, close_s = windows[node]
+        label = cust.get("slot_label") or f"{open_s // 60}-{close_s // 60}"
+        entry = report.setdefault(label, {
+            "window_min": [open_s // 60, close_s // 60], "customers": 0, "on_time": 0, "late": 0,
+            "max_late_min": 0.0, "precheck_unreachable": []
+        })
+        entry["customers"] += 1
+        if cust["customer_id"] in unreachable:
+            entry["precheck_unreachable"].append(cust["customer_id"])
+
+    for nodes, (times, _) in zip(node_routes, arrivals):
+        for node, t in zip(nodes, times):
+            cust = customers[node - 1]
+            open_s, close_s = windows[node]
+            entry = report[cust.get("slot_label") or f"{open_s // 60}-{close_s // 60}"]
+            if t <= close_s:
+                entry["on_time"] += 1
+            else:
+                entry["late"] += 1
+                entry["max_late_min"] = max(entry["max_late_min"], round((t - close_s) / 60, 1))
+    return report
+
+
+def knn_size(num_customers, setting=None):
+    """Neighbours kept per customer for SOLVER_KNN (or setting); 0 means the full graph."""
+    setting = SOLVER_KNN if setting is None else str(setting).lower()
+    if setting in ("off", "0", "false", "no"):
+        return 0
+    if setting == "auto":
+        if num_customers < SOLVER_KNN_MIN_NODES:
+            return 0
+        k = max(SOLVER_KNN_MIN_K, int(4 * math.log2(num_customers)))
+    else:
+        k = int(setting)
+    return k if k < num_customers - 1 else 0
+
+
+def candidate_successors(customers, k):
+    """
+    Allowed next nodes per node from a haversine BallTree: customer i may be
+    followed by its k nearest customers and by those that have i among theirs.
+    Returns node indices per node, depot first (None: unrestricted).
+    """
+    coords = np.radians([[c["lat"], c["lon"]] for c in customers])
+    _, idx = BallTree(coords, metric="haversine").query(coords, k=min(k + 1, len(customers)))
+    allowed = [set() for _ in customers]
+    for i, row in enumerate(idx.tolist()):
+        for j in row:
+            if j != i:
+                allowed[i].add(j)
+                allowed[j].add(i)
+    return [None] + [sorted(j + 1 for j in a) for a in allowed]
+
+
+def penalize_pruned_arcs(meters, candidates):
+    """Arc costs with every non-candidate customer -> customer arc lengthened by the longest arc."""
+    cost = np.array(meters, dtype=np.int64)
+    pruned = np.ones(cost.shape, dtype=bool)
+    pruned[0, :] = pruned[:, 0] = False
+    for node in range(1, len(candidates)):
+        pruned[node, candidates[node]] = False
+    np.fill_diagonal(pruned, False)
+    cost[pruned] += int(cost.max())
+    return cost
+
+
+def seed_routes(initial_routes, customers, demands, meters, num_vehicles, vehicle_capacity):
+    """
+    Map previous vehicle sequences onto the current node set for a warm start.
+
+    Args:
+        initial_routes (list[list[str]]): customer ids per vehicle from the previous plan
+        customers (list[dict]): current customers (node i + 1 is customers[i])
+        demands (list[int]): demand per node, depot first
+        meters (list[list[int]]): arc lengths per node pair
+
+    Customers that are gone are dropped, previous stops beyond a vehicle's
+    capacity or vehicle count are released, and every unplaced customer is
+    added by cheapest insertion (heaviest first).
+
+    Returns:
+        (routes, stats): node indices per vehicle (without depot) or None if some
+        customer could not be placed, plus {"kept", "dropped", "inserted"}
+    """
+    nodes_of = {}
+    for node, cust in enumerate(customers, start=1):
+        nodes_of.setdefault(cust["customer_id"], []).append(node)
+    capacities = [int(c) for c in np.broadcast_to(np.asarray(vehicle_capacity), (int(num_vehicles),))]
+
+    routes, loads, placed, dropped = [], [], set(), 0
+    for seq in list(initial_routes)[:num_vehicles]:
+        route, load = [], 0
+        for cid in seq:
+            nodes = nodes_of.get(cid)
+            if not nodes:
+                dropped += 1
+                continue
+            node = nodes.pop(0)
+            if load + demands[node] > capacities[len(routes)]:
+                nodes.insert(0, node)   # release it; re-inserted below
+                continue
+            route.append(node)
+            load += demands[node]
+            placed.add(node)
+        routes.append(route)
+        loads.append(load)
+    while len(routes) < num_vehicles:
+        routes.append([])
+        loads.append(0)
+    kept = len(placed)
+
+    pool = [node for node in range(1, len(customers) + 1) if node not in placed]
+    for node in sorted(pool, key=lambda n: (-demands[n], n)):
+        best = None
+        for v, route in enumerate(routes):
+            if loads[v] + demands[node] > capacities[v]:
+                continue
+            path = [0] + route + [0]
+            for k in range(1, len(path)):
+                delta = meters[path[k - 1]][node] + meters[node][path[k]] - meters[path[k - 1]][path[k]]
+                if best is None or delta < best[0]:
+                    best = (delta, v, k - 1)
+        if best is None:
+            return None, {"kept": kept, "dropped": dropped, "inserted": 0}
+        _, v, k = best
+        routes[v].insert(k, node)
+        loads[v] += demands[node]
+
+    return routes, {"kept": kept, "dropped": dropped, "inserted": len(pool)}
+
+
+def parse_strategies(spec):
+    """"FIRST:META,FIRST:META" -> [(first_solution, metaheuristic), ...]"""
+    strategies = []
+    for item in spec.split(","):
+        first, _, meta = item.strip().partition(":")
+        if first:
+            strategies.append((first.strip().upper(), (meta or DEFAULT_STRATEGY[1]).strip().upper()))
+    return strategies
+
+
+def build_routing_model(meter_rows, demands, num_vehicles, vehicle_capacity, fuel_rows=None, tank_size_ml=None,
+                        time_model=None, candidates=None, vehicle_profile=None, cost_rows=None):
+    """
+    Capacity model over precomputed matrices, plus the FuelRemain dimension when
+    fuel_rows is given and the Time dimension when time_model is given:
+    {"rows": travel + service seconds, "windows": [(open_s, close_s)] per node,
+     "soft": late arrivals allowed at LATE_PENALTY_PER_SEC instead of pruned}.
+    candidates (candidate_successors) removes every other arc from the
+    NextVar domains, so no move ever considers it.
+    Heterogeneous fleet: vehicle_profile gives each vehicle's profile index,
+    cost_rows / fuel_rows are one matrix per profile and vehicle_capacity /
+    tank_size_ml are per-vehicle lists.
+    """
+    manager = pywrapcp.RoutingIndexManager(len(meter_rows), int(num_vehicles), 0)
+    routing = pywrapcp.RoutingModel(manager)
+
+    if vehicle_profile is None:
+        # distance matrix (meters)
+        dist_cb_idx = routing.RegisterTransitMatrix(meter_rows)
+        routing.SetArcCostEvaluatorOfAllVehicles(dist_cb_idx)
+    else:
+        # per-profile arc costs (fuel used at that profile's mileage)
+        cost_cb = [routing.RegisterTransitMatrix(rows) for rows in cost_rows]
+        for v, profile in enumerate(vehicle_profile):
+            routing.SetArcCostEvaluatorOfVehicle(cost_cb[profile], v)
+
+    # capacity
+    demand_cb_idx = routing.RegisterUnaryTransitVector(demands)
+    routing.AddDimensionWithVehicleCapacity(
+        demand_cb_idx,
+        0,
+        [int(c) for c in np.broadcast_to(np.asarray(vehicle_capacity), (int(num_vehicles),))],
+        True,
+        "Capacity"
+    )
+
+    # optional fuel (remaining) model with refuel nodes
+    if fuel_rows is not None and vehicle_profile is not None:
+        fuel_cb = [routing.RegisterTransitMatrix(rows) for rows in fuel_rows]
+        routing.AddDimensionWithVehicleTransitAndCapacity(
+            [fuel_cb[profile] for profile in vehicle_profile],
+            0,
+            [int(t) for t in tank_size_ml],
+            False,
+            "FuelRemain"
+        )
+        fuel_dim = routing.GetDimensionOrDie("FuelRemain")
+        for v in range(int(num_vehicles)):
+            fuel_dim.CumulVar(routing.Start(v)).SetValue(int(tank_size_ml[v]))
+    elif fuel_rows is not None:
+        fuel_cb_idx = routing.RegisterTransitMatrix(fuel_rows)
+        routing.AddDimension(
+            fuel_cb_idx,
+            0,
+            tank_size_ml,
+            False,
+            "FuelRemain"
+        )
+        fuel_dim = routing.GetDimensionOrDie("FuelRemain")
+        # set start full tank
+        for v in range(int(num_vehicles)):
+            fuel_dim.CumulVar(routing.Start(v)).SetValue(tank_size_ml)
+
+    # optional time dimension: waiting allowed, windows hard (or soft on fallback)
+    if time_model is not None:
+        windows = time_model["windows"]
+        depot_open, depot_close = windows[0]
+        time_cb_idx = routing.RegisterTransitMatrix(time_model["rows"])
+        routing.AddDimension(time_cb_idx, depot_close, depot_close, False, "Time")
+        time_dim = routing.GetDimensionOrDie("Time")
+        for node in range(1, len(windows)):
+            index = manager.NodeToIndex(node)
+            open_s, close_s = windows[node]
+            if time_model.get("soft"):
+                time_dim.CumulVar(index).SetRange(open_s, depot_close)
+                time_dim.SetCumulVarSoftUpperBound(index, close_s, LATE_PENALTY_PER_SEC)
+            else:
+                time_dim.CumulVar(index).SetRange(open_s, close_s)
+        for v in range(int(num_vehicles)):
+            time_dim.CumulVar(routing.Start(v)).SetRange(depot_open, depot_close)
+            time_dim.CumulVar(routing.End(v)).SetRange(depot_open, depot_close)
+
+    if candidates is not None:
+        ends = [routing.End(v) for v in range(int(num_vehicles))]
+        for node in range(1, len(candidates)):
+            allowed = [manager.NodeToIndex(j) for j in candidates[node]] + ends
+            routing.NextVar(manager.NodeToIndex(node)).SetValues(allowed)
+
+    return manager, routing
+
+
+def run_search(meter_rows, demands, num_vehicles, vehicle_capacity, time_limit,
+               fuel_rows=None, tank_size_ml=None, hint=None, strategy=DEFAULT_STRATEGY, time_model=None,
+               candidates=None, vehicle_profile=None, cost_rows=None):
+    """
+    Build the model and search it with one strategy pair: from the hint first
+    when given (WARM_START_TIME_FRACTION of the budget), else / then from scratch.
+
+    Returns:
+        dict: {"strategy", "routes" (node indices per vehicle, depot excluded, or None),
+               "objective", "warm_used", "search": [search_summary, ...]}
+    """
+    manager, routing = build_routing_model(
+        meter_rows, demands, num_vehicles, vehicle_capacity, fuel_rows, tank_size_ml, time_model, candidates,
+        vehicle_profile, cost_rows
+    )
+    label = "+".join(strategy)
+    model = "with_fuel" if fuel_rows is not None else "without_fuel"
+    if time_model is not None:
+        model += "_soft_windows" if time_model.get("soft") else "_windows"
+    if candidates is not None:
+        model += "_knn"
+
+    # size-scaled budget, early stop on convergence
+    limit_s, stall_s = solver_budget(len(meter_rows), time_limit)
+    search_params = pywrapcp.DefaultRoutingSearchParameters()
+    search_params.first_solution_strategy = getattr(routing_enums_pb2.FirstSolutionStrategy, strategy[0])
+    search_params.local_search_metaheuristic = getattr(routing_enums_pb2.LocalSearchMetaheuristic, strategy[1])
+    search_params.time_limit.FromMilliseconds(int(limit_s * 1000))
+
+    searches, solution, warm_used = [], None, False
+    if hint is not None:
+        warm_s = max(SOLVER_MIN_STALL_SECONDS, limit_s * WARM_START_TIME_FRACTION)
+        search_params.time_limit.FromMilliseconds(int(warm_s * 1000))
+        routing.CloseModelWithParameters(search_params)
+        initial = routing.ReadAssignmentFromRoutes(hint, True)
+        if initial is not None:
+            warm_used = True
+            state = attach_convergence_monitor(routing, min(stall_s, warm_s))
+            solution = routing.SolveFromAssignmentWithParameters(initial, search_params)
+            searches.append(search_summary(state, model + "_warm", warm_s, min(stall_s, warm_s), solution, routing))
+        # seed violates this model (e.g. fuel range): full search
+        search_params.time_limit.FromMilliseconds(int(limit_s * 1000))
+
+    if not solution:
+        state = attach_convergence_monitor(routing, stall_s)
+        solution = routing.SolveWithParameters(search_params)
+        searches.append(search_summary(state, model, limit_s, stall_s, solution, routing))
+
+    for summary in searches:
+        summary["strategy"] = label
+
+    routes = None
+    if solution:
+        routes = []
+        for v in range(int(num_vehicles)):
+            nodes = []
+            index = solution.Value(routing.NextVar(routing.Start(v)))
+            while not routing.IsEnd(index):
+                nodes.append(manager.IndexToNode(index))
+                index = solution.Value(routing.NextVar(index))
+            routes.append(nodes)
+
+    return {
+        "strategy": label,
+        "routes": routes,
+        "objective": solution.ObjectiveValue() if solution else None,
+        "warm_used": warm_used,
+        "search": searches
+    }
+
+
+_portfolio_pool = None
+_portfolio_lock = threading.Lock()
+
+
+def get_portfolio_pool(reset=False):
+    """Process pool for portfolio searches (spawned, so safe next to the web server threads)."""
+    global _portfolio_pool
+    if reset:
+        with _portfolio_lock:
+            if _portfolio_pool is not None:
+                _portfolio_pool.shutdown(wait=False, cancel_futures=True)
+            _portfolio_pool = None
+    with _portfolio_lock:
+        if _portfolio_pool is None:
+            _portfolio_pool = ProcessPoolExecutor(
+                max_workers=SOLVER_PORTFOLIO_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _portfolio_pool
+
+
+def _share_array(array):
+    """Copy an array into a new shared memory block; returns (block, spec for workers)."""
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def _read_shared_rows(spec):
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf).tolist()
+    finally:
+        block.close()
+
+
+def _portfolio_worker(meters_spec, fuel_spec, demands, num_vehicles, vehicle_capacity,
+                      time_limit, tank_size_ml, hint, strategy, time_spec=None, candidates=None, fleet_spec=None):
+    """Runs in a pool process: attach the shared matrices and search one strategy pair."""
+    meter_rows = _read_shared_rows(meters_spec)
+    fuel_rows = _read_shared_rows(fuel_spec) if fuel_spec else None
+    time_model = None
+    if time_spec is not None:
+        time_model = {**time_spec, "rows": _read_shared_rows(time_spec["rows"])}
+    vehicle_profile, cost_rows = None, None
+    if fleet_spec is not None:
+        vehicle_profile = fleet_spec["vehicle_profile"]
+        cost_rows = [_read_shared_rows(spec) for spec in fleet_spec["cost"]]
+        if fleet_spec["fuel"] is not None:
+            fuel_rows = [_read_shared_rows(spec) for spec in fleet_spec["fuel"]]
+    return run_search(
+        meter_rows, demands, num_vehicles, vehicle_capacity, time_limit,
+        fuel_rows, tank_size_ml, hint, tuple(strategy), time_model, candidates, vehicle_profile, cost_rows
+    )
+
+
+def run_portfolio(strategies, arrays, demands, num_vehicles, vehicle_capacity, time_limit, use_fuel, hint=None,
+                  time_model=None, candidates=None, fleet=None):
+    """
+    Search every strategy pair concurrently in the process pool under the same
+    budget. The meter (and fuel) matrices are placed in shared memory once
+    instead of being pickled to each worker. Returns one run_search() result
+    per strategy, in order.
+    """
+    blocks = []
+    try:
+        meters_block, meters_spec = _share_array(arrays["meters"])
+        blocks.append(meters_block)
+        fuel_spec = None
+        if use_fuel and fleet is None:
+            fuel_block, fuel_spec = _share_array(arrays["fuel_net_ml"])
+            blocks.append(fuel_block)
+        fleet_spec = None
+        if fleet is not None:
+            fleet_spec = {"vehicle_profile": fleet["vehicle_profile"], "cost": [], "fuel": [] if use_fuel else None}
+            for key, matrices in (("cost", fleet["cost"]), ("fuel", fleet["fuel"] if use_fuel else [])):
+                for matrix in matrices:
+                    block, spec = _share_array(matrix)
+                    blocks.append(block)
+                    fleet_spec[key].append(spec)
+        time_spec = None
+        if time_model is not None:
+            time_block, rows_spec = _share_array(time_model["array"])
+            blocks.append(time_block)
+            time_spec = {"rows": rows_spec, "windows": time_model["windows"], "soft": time_model.get("soft", False)}
+
+        pool = get_portfolio_pool()
+        try:
+            futures = [
+                pool.submit(
+                    _portfolio_worker, meters_spec, fuel_spec, demands, int(num_vehicles), vehicle_capacity,
+                    time_limit, arrays["tank_size_ml"], hint, strategy, time_spec, candidates, fleet_spec
+                )
+                for strategy in strategies
+            ]
+        except BrokenProcessPool:
+            get_portfolio_pool(reset=True)
+            raise
+        results = []
+        for strategy, future in zip(strategies, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    get_portfolio_pool(reset=True)
+                print(f"⚠️ Portfolio strategy {'+'.join(strategy)} failed:", e)
+                results.append({"strategy": "+".join(strategy), "routes": None, "objective": None,
+                                "warm_used": False, "search": [], "error": str(e)})
+        return results
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
 
 def ortools_vrp(
     depot,
@@ -121,135 +845,320 @@ def ortools_vrp(
     mileage=15,
     fuel_price=1.35,
     tank_size=45,
-    time_limit=10
+    time_limit=10,
+    matrix_ctx=None,
+    initial_routes=None,
+    portfolio=None,
+    time_windows=None,
+    decompose=None,
+    knn=None,
+    vehicle_profiles=None
 ):
     """
     Tries refuel-aware solve first; if that returns no solution,
     re-runs the solver WITHOUT any fuel dimension and returns that result.
+    precheck_feasibility() runs first: a capacity-infeasible problem returns
+    "no_solution_precheck" without searching, and a fuel-infeasible one goes
+    straight to the model without fuel.
+    With initial_routes (customer ids per vehicle from the previous plan) the
+    search starts from those sequences mapped onto the current orders, and
+    gets WARM_START_TIME_FRACTION of the time limit; seeds that keep less than
+    WARM_START_MIN_OVERLAP of the current customers are ignored.
+    time_limit is an upper bound: each search gets solver_budget() seconds for
+    its size and stops once the objective stalls; per-search objective trace,
+    time to best and stop reason are in diagnostics["search"].
+    portfolio (default SOLVER_PORTFOLIO) runs the SOLVER_PORTFOLIO_STRATEGIES
+    pairs in parallel processes and keeps the best objective; a list of
+    (first_solution, metaheuristic) names selects the pairs explicitly.
+    When customers carry a time_window (minutes of the day, from the slot
+    map) and time_windows (default SOLVER_TIME_WINDOWS) is on, a Time
+    dimension with SERVICE_TIME_MIN per stop and travel times at each
+    customer's expected_speed_kmph makes the windows hard constraints, so
+    late plans are pruned during search. If no hard-window plan exists,
+    lateness at LATE_PENALTY_PER_SEC is allowed before the fuel model is
+    dropped (diagnostics["fuel_dropped"] says why it was); per-slot on-time /
+    late counts are in diagnostics["time_windows"] and each route gets the
+    planned arrival_min per stop.
+    Above SOLVER_CLUSTER_THRESHOLD customers (or with decompose=True) the
+    problem is split into geographic clusters solved as independent sub-VRPs
+    (helpers/cluster_vrp.py); decompose=False forces one model.
+    From SOLVER_KNN_MIN_NODES customers the search works on a candidate
+    graph: each stop's k nearest neighbours and the depot (knn / SOLVER_KNN:
+    "auto", "off" or a fixed k). Other arcs are priced out (SOLVER_KNN_MODE
+    "penalty") or removed from the model ("forbid", retried on the full graph
+    when it leaves no solution); search objectives include the penalties.
+    vehicle_profiles ([{"name", "count", "capacity", "tank_size", "mileage"}])
+    replace num_vehicles and the scalar vehicle settings with a mixed fleet in
+    one model: per-vehicle capacity, tank size and fuel use, and arc costs in
+    fuel (ml at each vehicle's mileage) so cheaper vehicles take longer legs.
+    Mixed fleets are always solved as one model (no decomposition).
+    The distance matrix is computed once (or taken from matrix_ctx) and
+    shared by both attempts; arc costs, demands and fuel use are registered
+    as precomputed integer matrices/vectors so local search never calls
+    back into Python.
     Returns: {"routes": [...], "diagnostics": {...}}
     """
-    diagnostics = {"attempts": []}
-
-    # inner builder that can optionally add fuel (use_fuel=True/False)
-    def build_and_solve(use_fuel: bool):
-        dist_matrix,_,_= compute_distance_matrix(depot, customers)
-        print(f"Distance matrix computed {len(dist_matrix)}x{len(dist_matrix)}, {dist_matrix}")
-        n = len(dist_matrix)
-        if n == 0:
-            return None, None, None  # no problem
+    if decompose is None:
+        decompose = 0 < SOLVER_CLUSTER_THRESHOLD < len(customers)
+    if decompose and not vehicle_profiles:
+        # large depot: one small model per cluster instead of the N x N model (the
+        # caller may still hold a full matrix, e.g. app.py's distance lookup)
+        from helpers.cluster_vrp import solve_clustered
+        return solve_clustered(
+            depot, customers, num_vehicles, vehicle_capacity, mileage, fuel_price, tank_size, time_limit,
+            time_windows=time_windows, knn=knn, initial_routes=initial_routes, matrix_ctx=matrix_ctx
+        )
 
-        demands = [0] + [int(round(c.get("weight", 0))) for c in customers]
-        manager = pywrapcp.RoutingIndexManager(n, int(num_vehicles), 0)
-        routing = pywrapcp.RoutingModel(manager)
+    diagnostics = {"attempts": [], "search": []}
 
-        # distance callback (meters)
-        def distance_callback(from_index, to_index):
-            frm = manager.IndexToNode(from_index)
-            to = manager.IndexToNode(to_index)
-            return int(round(dist_matrix[frm][to] * 1000.0))
+    if matrix_ctx is not None:
+        dist_matrix, _, _ = matrix_ctx.get(depot, customers)
+    else:
+        dist_matrix, _, _ = compute_distance_matrix(depot, customers)
+    print(f"Distance matrix computed {len(dist_matrix)}x{len(dist_matrix)}")
 
-        dist_cb_idx = routing.RegisterTransitCallback(distance_callback)
-        routing.SetArcCostEvaluatorOfAllVehicles(dist_cb_idx)
+    all_nodes = [depot] + customers
+    refuel_flags = [node.get("is_fuel", False) for node in all_nodes]
+    demands = [0] + [int(round(c.get("weight", 0))) for c in customers]
 
-        # capacity
-        def demand_callback(from_index):
-            return int(demands[manager.IndexToNode(from_index)])
-        demand_cb_idx = routing.RegisterUnaryTransitCallback(demand_callback)
-        routing.AddDimensionWithVehicleCapacity(
-            demand_cb_idx,
-            0,
-            [int(vehicle_capacity)] * int(num_vehicles),
-            True,
-            "Capacity"
-        )
+    vehicles = None
+    if vehicle_profiles:
+        vehicles, profiles = expand_fleet(vehicle_profiles, vehicle_capacity, tank_size, mileage)
+        num_vehicles = len(vehicles)
+        vehicle_capacity = [v["capacity"] for v in vehicles]
+        tank_size = [v["tank_size"] for v in vehicles]
+        mileage = [v["mileage"] for v in vehicles]
+        fleet_summary = {}
+        for v in vehicles:
+            entry = fleet_summary.setdefault(v["name"], {
+                "capacity": v["capacity"], "tank_size": v["tank_size"], "mileage": v["mileage"], "count": 0
+            })
+            entry["count"] += 1
+        diagnostics["fleet"] = fleet_summary
 
-        # optional fuel (remaining) model with refuel nodes if requested
-        fuel_dim = None
-        if use_fuel:
-            tank_size_ml = int(round(tank_size * 1000.0))
-            mileage_f = float(mileage)
-            all_nodes = [depot] + customers
-            refuel_nodes = [i for i, node in enumerate(all_nodes) if node.get("is_fuel", False)]
-
-            def fuel_remaining_callback(from_index, to_index):
-                frm = manager.IndexToNode(from_index)
-                to = manager.IndexToNode(to_index)
-                distance_km = float(dist_matrix[frm][to])
-                travel_ml = int(round((distance_km / mileage_f) * 1000.0))
-                net = -travel_ml
-                if to in refuel_nodes:
-                    net += tank_size_ml
-                return net
-
-            fuel_cb_idx = routing.RegisterTransitCallback(fuel_remaining_callback)
-            routing.AddDimension(
-                fuel_cb_idx,
-                0,
-                tank_size_ml,
-                False,
-                "FuelRemain"
-            )
-            fuel_dim = routing.GetDimensionOrDie("FuelRemain")
-            # set start full tank
-            for v in range(int(num_vehicles)):
-                fuel_dim.CumulVar(routing.Start(v)).SetValue(tank_size_ml)
+    precheck = precheck_feasibility(
+        dist_matrix, demands, refuel_flags, customers, num_vehicles, vehicle_capacity, tank_size, mileage
+    )
+    diagnostics["precheck"] = precheck
+    if precheck["verdict"] == "infeasible":
+        print("Precheck: no feasible plan:", precheck["reasons"])
+        diagnostics["result"] = "no_solution_precheck"
+        return {"routes": [], "diagnostics": diagnostics}
 
-        # solve
-        search_params = pywrapcp.DefaultRoutingSearchParameters()
-        search_params.first_solution_strategy = routing_enums_pb2.FirstSolutionStrategy.PATH_CHEAPEST_ARC
-        search_params.local_search_metaheuristic = routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH
-        search_params.time_limit.seconds = int(time_limit)
+    if time_windows is None:
+        time_windows = SOLVER_TIME_WINDOWS
+    time_model = None
+    if time_windows and any(c.get("time_window") for c in customers):
+        time_model = build_time_model(dist_matrix, customers)
+        unreachable = precheck_time_windows(time_model, customers)
+        # hard windows cannot hold for these customers; go straight to soft windows
+        time_model["soft"] = bool(unreachable)
+        diagnostics["time_windows"] = {
+            "mode": "soft" if unreachable else "hard",
+            "service_time_min": time_model["service_s"] / 60,
+            "precheck_unreachable": unreachable
+        }
+        if unreachable:
+            print("Precheck: time windows unreachable for", unreachable)
 
-        solution = routing.SolveWithParameters(search_params)
-        return solution, routing, manager
-
-    # Attempt 1: with fuel
-    diagnostics["attempts"].append("try_with_fuel")
-    sol, routing, manager = build_and_solve(use_fuel=True)
-    if sol:
-        diagnostics["result"] = "solution_with_fuel"
-        diagnostics["used_fuel_model"] = True
+    fleet = None
+    if vehicles is None:
+        arrays = build_cost_arrays(dist_matrix, mileage, tank_size, refuel_flags)
     else:
-        # Attempt 2: without fuel
-        diagnostics["attempts"].append("retry_without_fuel")
-        sol, routing, manager = build_and_solve(use_fuel=False)
-        if sol:
-            diagnostics["result"] = "solution_without_fuel"
-            diagnostics["used_fuel_model"] = False
+        # one fuel matrix per (tank, mileage) profile; arc cost = fuel in ml
+        profile_arrays = [build_cost_arrays(dist_matrix, km_per_l, tank, refuel_flags) for tank, km_per_l in profiles]
+        arrays = {**profile_arrays[0],
+                  "tank_size_ml": [profile_arrays[v["profile"]]["tank_size_ml"] for v in vehicles]}
+        fleet = {
+            "vehicle_profile": [v["profile"] for v in vehicles],
+            "cost": [np.rint(arrays["meters"] / km_per_l).astype(np.int64) for _, km_per_l in profiles],
+            "fuel": [a["fuel_net_ml"] for a in profile_arrays]
+        }
+    # list-of-lists conversion is the expensive part; do it once for both attempts
+    meter_rows = arrays["meters"].tolist()
+    fuel_rows = None
+    fleet_rows = None
+
+    hint = None
+    if initial_routes:
+        hint, seed_stats = seed_routes(
+            initial_routes, customers, demands, meter_rows, int(num_vehicles), vehicle_capacity
+        )
+        overlap = seed_stats["kept"] / max(1, len(customers))
+        diagnostics["warm_start"] = {**seed_stats, "overlap": round(overlap, 3), "used": False}
+        if seed_stats["kept"] == 0 or overlap < WARM_START_MIN_OVERLAP:
+            # a mostly re-inserted seed is no better than a first solution: keep the full budget
+            hint = None
+            diagnostics["warm_start"]["skipped"] = "low_overlap"
+
+    if portfolio is None:
+        portfolio = SOLVER_PORTFOLIO
+    strategies = [DEFAULT_STRATEGY]
+    if portfolio:
+        pairs = parse_strategies(SOLVER_PORTFOLIO_STRATEGIES) if portfolio is True else [tuple(p) for p in portfolio]
+        # one process per pair keeps every pair inside the same wall-clock budget
+        strategies = pairs[:max(1, SOLVER_PORTFOLIO_WORKERS)] or strategies
+
+    # arc costs the search sees; real meters stay in meter_rows for route details
+    candidates, cost_arrays, cost_rows = None, arrays, meter_rows
+    k = knn_size(len(customers), knn)
+    if k:
+        successors = candidate_successors(customers, k)
+        diagnostics["candidate_graph"] = {
+            "k": k,
+            "mode": SOLVER_KNN_MODE,
+            "arcs": sum(len(c) for c in successors[1:]) + len(customers),   # + return to depot
+            "dense_arcs": len(customers) * len(customers),
+            "full_graph_fallbacks": 0
+        }
+        if SOLVER_KNN_MODE == "forbid":
+            candidates = successors
+        elif fleet is not None:
+            fleet["cost"] = [penalize_pruned_arcs(cost, successors) for cost in fleet["cost"]]
         else:
-            diagnostics["result"] = "no_solution_even_without_fuel"
-            return {"routes": [], "diagnostics": diagnostics}
+            cost_arrays = {**arrays, "meters": penalize_pruned_arcs(arrays["meters"], successors)}
+            cost_rows = cost_arrays["meters"].tolist()
+
+    def build_and_solve(use_fuel: bool, time_model=None, candidates=candidates):
+        """Best node routes of one model (with or without fuel / time windows), or None."""
+        nonlocal fuel_rows, fleet_rows
+        if len(dist_matrix) == 0:
+            return None  # no problem
+
+        results = None
+        if len(strategies) > 1:
+            try:
+                results = run_portfolio(
+                    strategies, cost_arrays, demands, num_vehicles, vehicle_capacity, time_limit, use_fuel, hint,
+                    time_model, candidates, fleet
+                )
+            except BrokenProcessPool as e:
+                print("⚠️ Portfolio pool unavailable, solving in-process:", e)
+            if results and all(r.get("error") for r in results):
+                diagnostics.setdefault("portfolio_errors", []).extend(r["error"] for r in results)
+                results = None
+        if results is None and fleet is not None:
+            if fleet_rows is None:
+                fleet_rows = {"cost": [c.tolist() for c in fleet["cost"]], "fuel": None}
+            if use_fuel and fleet_rows["fuel"] is None:
+                fleet_rows["fuel"] = [f.tolist() for f in fleet["fuel"]]
+            results = [run_search(
+                meter_rows, demands, num_vehicles, vehicle_capacity, time_limit,
+                fleet_rows["fuel"] if use_fuel else None, arrays["tank_size_ml"], hint, strategies[0], time_model,
+                candidates, fleet["vehicle_profile"], fleet_rows["cost"]
+            )]
+        elif results is None:
+            if use_fuel and fuel_rows is None:
+                fuel_rows = arrays["fuel_net_ml"].tolist()
+            results = [run_search(
+                cost_rows, demands, num_vehicles, vehicle_capacity, time_limit,
+                fuel_rows if use_fuel else None, arrays["tank_size_ml"], hint, strategies[0], time_model,
+                candidates
+            )]
+
+        for result in results:
+            diagnostics["search"].extend(result["search"])
+            if result["warm_used"]:
+                diagnostics["warm_start"]["used"] = True
+        solved = [r for r in results if r["routes"] is not None]
+        if len(results) > 1:
+            diagnostics.setdefault("portfolio", []).append({
+                "model": ("with_fuel" if use_fuel else "without_fuel")
+                         + ("" if time_model is None else "_soft_windows" if time_model["soft"] else "_windows"),
+                "results": [
+                    {"strategy": r["strategy"], "objective": r["objective"], "error": r.get("error"),
+                     "stop_reason": r["search"][-1]["stop_reason"] if r["search"] else None}
+                    for r in results
+                ],
+                "winner": min(solved, key=lambda r: r["objective"])["strategy"] if solved else None
+            })
+        if not solved and candidates is not None and not use_fuel:
+            # the pruned graph may cut the only feasible tours; the fuel model has its own retry
+            diagnostics["candidate_graph"]["full_graph_fallbacks"] += 1
+            return build_and_solve(use_fuel, time_model, candidates=None)
+        if not solved:
+            return None
+        return min(solved, key=lambda r: r["objective"])["routes"]
 
-    # extract routes from the found solution
+    # Attempts: fuel + hard windows, fuel + soft windows, then the same without
+    # fuel, so lateness is allowed before the fuel-range guarantee is given up
+    hard_windows = time_model is not None and not time_model["soft"]
+    attempts = [("try_with_fuel", True, False)]
+    if hard_windows:
+        attempts.append(("retry_soft_windows", True, True))
+    attempts.append(("retry_without_fuel", False, False))
+    if hard_windows:
+        attempts.append(("retry_without_fuel_soft_windows", False, True))
+
+    node_routes = None
+    for label, use_fuel, soft in attempts:
+        if use_fuel and precheck["verdict"] == "fuel_infeasible":
+            if "skip_fuel_precheck" not in diagnostics["attempts"]:
+                print("Precheck: fuel model infeasible for", precheck["out_of_range_customers"])
+                diagnostics["attempts"].append("skip_fuel_precheck")
+            continue
+        diagnostics["attempts"].append(label)
+        if time_model is not None and hard_windows:
+            time_model["soft"] = soft
+            diagnostics["time_windows"]["mode"] = "soft" if soft else "hard"
+        node_routes = build_and_solve(use_fuel=use_fuel, time_model=time_model)
+        if node_routes is not None:
+            diagnostics["result"] = ("solution_soft_windows" if soft
+                                     else "solution_with_fuel" if use_fuel else "solution_without_fuel")
+            diagnostics["used_fuel_model"] = use_fuel
+            if not use_fuel:
+                # fuel is only dropped once even soft windows left no in-range plan
+                diagnostics["fuel_dropped"] = ("precheck_out_of_range" if precheck["verdict"] == "fuel_infeasible"
+                                               else "no_solution_with_fuel")
+            break
+    if node_routes is None:
+        diagnostics["result"] = "no_solution_even_without_fuel"
+        return {"routes": [], "diagnostics": diagnostics}
+
+    arrivals = None
+    if time_model is not None:
+        arrivals = simulate_arrivals(node_routes, time_model)
+        diagnostics["time_windows"]["windows"] = window_diagnostics(
+            node_routes, arrivals, time_model, customers, diagnostics["time_windows"]["precheck_unreachable"]
+        )
+
+    routes = describe_routes(node_routes, customers, meter_rows, mileage, fuel_price, arrivals)
+    if vehicles is not None:
+        for route, vehicle in zip(routes, vehicles):
+            route["vehicle_type"] = vehicle["name"]
+            route["capacity"] = vehicle["capacity"]
+    return {"routes": routes, "diagnostics": diagnostics}
+
+
+def describe_routes(node_routes, customers, meter_rows, mileage, fuel_price, arrivals=None):
+    """
+    Route details (ids, load, km, fuel) from node sequences (without depot) and
+    the meter matrix; mileage may be per vehicle.
+    """
     routes = []
-    mileage_f = float(mileage)
-    for v in range(int(num_vehicles)):
-        route_ids = []
-        load = 0
-        dist_m = 0
-        index = routing.Start(v)
-        while not routing.IsEnd(index):
-            node = manager.IndexToNode(index)
-            if node != 0:
-                cust = customers[node - 1]
-                route_ids.append(cust["customer_id"])
-                load += int(round(cust.get("weight", 0)))
-            next_index = sol.Value(routing.NextVar(index))
-            dist_m += int(routing.GetArcCostForVehicle(index, next_index, v))
-            index = next_index
+    for v, nodes in enumerate(node_routes):
+        mileage_f = float(mileage[v] if isinstance(mileage, (list, tuple)) else mileage)
+        route_ids = [customers[node - 1]["customer_id"] for node in nodes]
+        load = sum(int(round(customers[node - 1].get("weight", 0))) for node in nodes)
+        path = [0] + list(nodes) + [0]
+        dist_m = sum(meter_rows[a][b] for a, b in zip(path, path[1:]))
 
         km = float(dist_m) / 1000.0
         liters_used = km / mileage_f if km > 0 else 0.0
         cost = liters_used * float(fuel_price)
 
-        routes.append({
+        route = {
             "vehicle_id": int(v),
             "route": route_ids,
             "load": int(load),
             "total_distance_km": round(km, 3),
             "fuel_used_l": round(liters_used, 3),
             "fuel_cost": round(cost, 2)
-        })
-
+        }
+        if arrivals is not None:
+            times, finish = arrivals[v]
+            route["arrival_min"] = [round(t / 60, 1) for t in times]
+            route["return_min"] = round(finish / 60, 1)
+        routes.append(route)
     return routes
 
@@ -1,9 +1,24 @@
+# Above this many nodes only the k nearest neighbours per node are sent
+DENSE_MATRIX_MAX_NODES = 60
+KNN_NEIGHBOURS = 10
+
+
+def serialize_distance_lookup(distance_lookup, dense_max_nodes=DENSE_MATRIX_MAX_NODES, k=KNN_NEIGHBOURS):
+    """Dense rows for small problems, k-nearest neighbours per node for large ones."""
+    if not hasattr(distance_lookup, "to_dense"):
+        return distance_lookup  # already plain JSON
+    if len(distance_lookup) <= dense_max_nodes:
+        return distance_lookup.to_dense()
+    return distance_lookup.to_knn(k)
+
+
 def make_payload_for_llm(depot, routes, distance_lookup, customers_info, preferences):
     """
     Build payload for LLM-based route refinement.
     depot: dict {id, lat, lon}
     routes: output from OR-Tools (list of dicts, each with 'route': [...])
-    distance_lookup: dict with {"order": [...], "distances_km": [...], "times_min": [...]}
+    distance_lookup: DistanceLookup (serialized to {"order": [...], "distances_km": [...], "times_min": [...]}
+                     or its k-nearest form for large problems)
     customers_info: dict {cid: {...}} or list of {...}
     preferences: dict of user preferences
     """
@@ -35,7 +50,7 @@ def make_payload_for_llm(depot, routes, distance_lookup, customers_info, prefere
         "depot": depot,
         "baseline_routes": [],
         "customers": customers,
-        "distance_matrix": distance_lookup,
+        "distance_matrix": serialize_distance_lookup(distance_lookup),
         "user_preferences": preferences,
     }
 
@@ -50,6 +65,13 @@ def make_payload_for_llm(depot, routes, distance_lookup, customers_info, prefere
                 "fuel_used_l": r.get("fuel_used_l", 0),
                 "fuel_cost": r.get("fuel_cost", 0),
             }
+            if "vehicle_type" in r:
+                # mixed fleet: the LLM must keep each vehicle's own capacity
+                baseline_entry["vehicle_type"] = r["vehicle_type"]
+                baseline_entry["capacity"] = r["capacity"]
+            if "arrival_min" in r:
+                # solver-planned arrival (minutes of the day) per stop, within each time_window
+                baseline_entry["arrival_min"] = r["arrival_min"]
         else:
             # fallback if routes are just lists of customers
             seq = [c["customer_id"] if isinstance(c, dict) else c for c in r]
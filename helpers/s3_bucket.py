@@ -1,6 +1,7 @@
 import pandas as pd
 import boto3
 import os
+import tempfile
 
 # AWS creds (better load from env vars)
 AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY")
@@ -23,4 +24,60 @@ s3 = boto3.client(
 def read_csv_from_s3(bucket, key):
     """Read CSV directly into pandas from S3"""
     obj = s3.get_object(Bucket=bucket, Key=key)
-    return pd.read_csv(obj["Body"])
\ No newline at end of file
+    return pd.read_csv(obj["Body"])
+
+def get_s3_etag(bucket, key):
+    """Return the object's ETag (cheap HEAD request) to detect changes without downloading"""
+    return s3.head_object(Bucket=bucket, Key=key)["ETag"]
+
+
+def upload_dir_to_s3(local_dir, bucket, prefix, last=None):
+    """Upload every file in local_dir under prefix/ (the `last` file is uploaded after the others)"""
+    names = sorted(os.listdir(local_dir), key=lambda name: name == last)
+    for name in names:
+        s3.upload_file(os.path.join(local_dir, name), bucket, f"{prefix}/{name}")
+
+
+def download_dir_from_s3(bucket, prefix, local_dir, last=None, etag=None):
+    """
+    Download every object under prefix/ into local_dir.
+    Files are written to a per-process temp name and renamed into place
+    (`last` renamed after the others), so readers that memory-map the old
+    files and other workers downloading the same directory are unaffected.
+    With etag (of the `last` object), the download is skipped when local_dir
+    already holds that version.
+    """
+    os.makedirs(local_dir, exist_ok=True)
+    etag_file = os.path.join(local_dir, ".etag")
+    if etag and last and os.path.exists(os.path.join(local_dir, last)):
+        try:
+            with open(etag_file, encoding="utf-8") as f:
+                if f.read().strip() == etag:
+                    return local_dir
+        except FileNotFoundError:
+            pass
+
+    paginator = s3.get_paginator("list_objects_v2")
+    keys = [
+        obj["Key"]
+        for page in paginator.paginate(Bucket=bucket, Prefix=f"{prefix}/")
+        for obj in page.get("Contents", [])
+    ]
+    keys.sort(key=lambda key: os.path.basename(key) == last)
+    for key in keys:
+        target = os.path.join(local_dir, os.path.basename(key))
+        fd, part = tempfile.mkstemp(dir=local_dir, suffix=".part")
+        os.close(fd)
+        try:
+            s3.download_file(bucket, key, part)
+            os.replace(part, target)
+        except BaseException:
+            if os.path.exists(part):
+                os.remove(part)
+            raise
+    if etag:
+        fd, part = tempfile.mkstemp(dir=local_dir, suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(etag)
+        os.replace(part, etag_file)
+    return local_dir
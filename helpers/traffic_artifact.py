@@ -0,0 +1,156 @@
+"""
+Compact columnar artifact for the traffic reference data.
+
+Converts the raw traffic CSVs into a directory of typed NumPy columns
+(.npy, memory-mapped on load), categorical string columns stored as codes,
+plus the serialized count point BallTree:
+
+    data/traffic_artifact/
+        manifest.json                      # tables, columns, categories
+        df1.<column>.npy / df2.* / df3.*   # one file per column
+        countpoint_tree.joblib             # BallTree, arrays memory-mapped on load
+
+Because every array is memory-mapped read-only, several gunicorn workers
+loading the same artifact share page-cache pages instead of each holding a
+private copy, and a load takes milliseconds instead of a CSV parse.
+
+Build it with:
+    python -m helpers.traffic_artifact --data-dir data [--upload-bucket BUCKET]
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from helpers.enrich import build_countpoint_tree, normalize_reference_frames
+
+ARTIFACT_DIRNAME = "traffic_artifact"
+MANIFEST = "manifest.json"
+TREE_FILE = "countpoint_tree.joblib"
+FORMAT_VERSION = 1
+
+# Only the columns helpers/enrich.py reads
+SOURCES = {
+    "df1": ("local_authority_traffic.csv", ["local_authority_name", "all_motor_vehicles", "link_length_km"]),
+    "df2": ("region_traffic.csv", ["region_name", "all_motor_vehicles", "all_hgvs"]),
+    "df3": ("dft_traffic_counts_raw_counts.csv", [
+        "count_point_id", "latitude", "longitude", "local_authority_name",
+        "region_name", "road_type", "all_motor_vehicles"
+    ]),
+}
+
+
+def _column_file(table, column):
+    return f"{table}.{column}.npy"
+
+
+def _read_source(path, columns):
+    """Read only the used columns (those present) from a source CSV."""
+    return pd.read_csv(path, usecols=lambda c: c in columns)
+
+
+def _write_table(df, table, out_dir):
+    meta = {"rows": int(len(df)), "columns": {}}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype == object or isinstance(series.dtype, pd.StringDtype):
+            series = series.astype("category")
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # codes keep pandas' own (smallest) dtype so from_codes can reuse the mmap
+            np.save(os.path.join(out_dir, _column_file(table, column)), series.cat.codes.to_numpy())
+            meta["columns"][column] = {
+                "kind": "category",
+                "categories": [str(c) for c in series.cat.categories]
+            }
+        else:
+            np.save(os.path.join(out_dir, _column_file(table, column)), series.to_numpy())
+            meta["columns"][column] = {"kind": "numeric"}
+    return meta
+
+
+def build_artifact(data_dir="data", out_dir=None):
+    """Convert the raw CSVs under data_dir into the columnar artifact. Returns the output dir."""
+    out_dir = out_dir or os.path.join(data_dir, ARTIFACT_DIRNAME)
+    started = time.perf_counter()
+
+    frames = [_read_source(os.path.join(data_dir, SOURCES[t][0]), SOURCES[t][1]) for t in ("df1", "df2", "df3")]
+    df1, df2, df3 = normalize_reference_frames(*frames)
+    tree = build_countpoint_tree(df3)
+
+    # Write into a temp dir next to the target, then swap in file by file so
+    # workers that have the old artifact mapped keep reading valid inodes.
+    parent = os.path.dirname(os.path.abspath(out_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=".traffic_artifact-", dir=parent)
+    try:
+        manifest = {"format": FORMAT_VERSION, "created_at": time.time(), "tree": TREE_FILE, "tables": {}}
+        for table, df in (("df1", df1), ("df2", df2), ("df3", df3)):
+            manifest["tables"][table] = _write_table(df, table, tmp_dir)
+        joblib.dump(tree, os.path.join(tmp_dir, TREE_FILE))
+        with open(os.path.join(tmp_dir, MANIFEST), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+
+        os.makedirs(out_dir, exist_ok=True)
+        files = sorted(os.listdir(tmp_dir), key=lambda name: name == MANIFEST)  # manifest last
+        for name in files:
+            os.replace(os.path.join(tmp_dir, name), os.path.join(out_dir, name))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"Traffic artifact written to {out_dir} ({len(df3)} count points) in {time.perf_counter() - started:.2f}s")
+    return out_dir
+
+
+def artifact_exists(artifact_dir):
+    return os.path.exists(os.path.join(artifact_dir, MANIFEST))
+
+
+def load_artifact(artifact_dir, mmap=True):
+    """
+    Load (df1, df2, df3, tree) from an artifact directory.
+    Columns are read-only memory maps when mmap=True; key columns are
+    already normalised categoricals, ready for enrich_customers.
+    """
+    with open(os.path.join(artifact_dir, MANIFEST), encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported traffic artifact format: {manifest.get('format')!r}")
+
+    mmap_mode = "r" if mmap else None
+    frames = []
+    for table in ("df1", "df2", "df3"):
+        columns = {}
+        for column, meta in manifest["tables"][table]["columns"].items():
+            values = np.load(os.path.join(artifact_dir, _column_file(table, column)), mmap_mode=mmap_mode)
+            if meta["kind"] == "category":
+                dtype = pd.CategoricalDtype(meta["categories"])
+                values = pd.Categorical.from_codes(values, dtype=dtype, validate=False)
+            columns[column] = values
+        frames.append(pd.DataFrame(columns, copy=False))
+
+    tree = joblib.load(os.path.join(artifact_dir, manifest["tree"]), mmap_mode=mmap_mode)
+    return frames[0], frames[1], frames[2], tree
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the columnar traffic reference artifact.")
+    parser.add_argument("--data-dir", default="data", help="directory holding the raw traffic CSVs")
+    parser.add_argument("--out", default=None, help="output directory (default: <data-dir>/traffic_artifact)")
+    parser.add_argument("--upload-bucket", default=None, help="also upload the artifact to this S3 bucket")
+    args = parser.parse_args()
+
+    out_dir = build_artifact(args.data_dir, args.out)
+    if args.upload_bucket:
+        from helpers.s3_bucket import upload_dir_to_s3
+        upload_dir_to_s3(out_dir, args.upload_bucket, ARTIFACT_DIRNAME, last=MANIFEST)
+        print(f"Uploaded to s3://{args.upload_bucket}/{ARTIFACT_DIRNAME}/")
+
+
+if __name__ == "__main__":
+    main()
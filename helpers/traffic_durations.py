@@ -1,28 +1,70 @@
-import requests
 import datetime
 import json
 import os
 
-def get_matrix_durations(origins, destinations, api_key):
+from helpers.cache_store import CacheStats, SqliteTTLCache
+from helpers.http_client import fan_out, get_json
+
+DISTANCE_MATRIX_URL = os.getenv("DISTANCE_MATRIX_URL", "https://maps.googleapis.com/maps/api/distancematrix/json")
+
+# Leg duration cache: rounded coordinates + departure bucket, persisted in SQLite
+TRAFFIC_CACHE_PATH = os.getenv("TRAFFIC_CACHE_PATH", "cache/traffic_cache.sqlite3")
+TRAFFIC_CACHE_TTL = int(os.getenv("TRAFFIC_CACHE_TTL", str(7 * 24 * 3600)))    # seconds
+TRAFFIC_CACHE_MAX_ENTRIES = int(os.getenv("TRAFFIC_CACHE_MAX_ENTRIES", "200000"))
+TRAFFIC_CACHE_DECIMALS = int(os.getenv("TRAFFIC_CACHE_DECIMALS", "4"))         # ≈ 11 m
+TRAFFIC_BUCKET_MINUTES = int(os.getenv("TRAFFIC_BUCKET_MINUTES", "15"))
+
+# Distance Matrix API limits: 25 origins, 25 destinations, 100 elements per request
+MAX_ORIGINS_PER_REQUEST = 25
+MAX_DESTINATIONS_PER_REQUEST = 25
+
+
+def leg_key(origin, destination):
+    """JSON-safe key of one leg: "lat1,lon1|lat2,lon2"."""
+    return f"{origin[0]},{origin[1]}|{destination[0]},{destination[1]}"
+
+
+_traffic_cache = None
+
+
+def get_traffic_cache():
+    """Shared leg duration cache for this process (created on first use)."""
+    global _traffic_cache
+    if _traffic_cache is None:
+        _traffic_cache = SqliteTTLCache(
+            TRAFFIC_CACHE_PATH, "traffic_cache", TRAFFIC_CACHE_TTL, TRAFFIC_CACHE_MAX_ENTRIES
+        )
+    return _traffic_cache
+
+
+def departure_bucket(departure_time):
+    """Day-of-week x time-of-day slot of a unix timestamp, e.g. "2@34" (Wed 08:30-08:45)."""
+    dt = datetime.datetime.fromtimestamp(departure_time)
+    return f"{dt.weekday()}@{(dt.hour * 60 + dt.minute) // TRAFFIC_BUCKET_MINUTES}"
+
+
+def traffic_cache_key(origin, destination, bucket):
+    d = TRAFFIC_CACHE_DECIMALS
+    return (
+        f"{round(origin[0], d)},{round(origin[1], d)}|"
+        f"{round(destination[0], d)},{round(destination[1], d)}|{bucket}"
+    )
+
+
+def get_matrix_durations(origins, destinations, api_key, departure_time=None):
     """
     Calls Google Distance Matrix API for multiple origin-destination pairs.
     Returns dict { "lat1,lon1|lat2,lon2": {"normal": secs, "traffic": secs} }
     """
-    departure_time = int(datetime.datetime.now().timestamp())
-    origins_str = "|".join([f"{lat},{lon}" for lat, lon in origins])
-    destinations_str = "|".join([f"{lat},{lon}" for lat, lon in destinations])
-
-    url = (
-        "https://maps.googleapis.com/maps/api/distancematrix/json"
-        f"?origins={origins_str}"
-        f"&destinations={destinations_str}"
-        f"&departure_time={departure_time}"
-        f"&traffic_model=best_guess"
-        f"&mode=driving"
-        f"&key={api_key}"
-    )
-
-    res = requests.get(url).json()
+    departure_time = departure_time or int(datetime.datetime.now().timestamp())
+    res = get_json(DISTANCE_MATRIX_URL, params={
+        "origins": "|".join([f"{lat},{lon}" for lat, lon in origins]),
+        "destinations": "|".join([f"{lat},{lon}" for lat, lon in destinations]),
+        "departure_time": departure_time,
+        "traffic_model": "best_guess",
+        "mode": "driving",
+        "key": api_key
+    })
     result = {}
 
     if res.get("status") == "OK":
@@ -36,37 +78,105 @@ def get_matrix_durations(origins, destinations, api_key):
                     normal, traffic = 0, 0
 
                 # ✅ JSON-safe key
-                key = f"{origin[0]},{origin[1]}|{destination[0]},{destination[1]}"
-                result[key] = {"normal": normal, "traffic": traffic}
+                result[leg_key(origin, destination)] = {"normal": normal, "traffic": traffic}
     else:
         print("⚠️ Matrix Error:", res.get("status"), res.get("error_message"))
 
     return result
 
 
-def add_traffic_durations(routes_json: dict, api_key: str):
+def plan_leg_batches(legs):
+    """
+    Pack (origin, destination) legs into Distance Matrix requests that only
+    contain needed elements: legs sharing an origin become one 1 x m request,
+    the remaining legs sharing a destination one m x 1 request, the rest 1 x 1.
+    Returns a list of (origins, destinations); billed elements == len(legs).
+    """
+    by_origin = {}
+    for origin, destination in dict.fromkeys(legs):
+        by_origin.setdefault(origin, []).append(destination)
+
+    batches, singles = [], []
+    for origin, destinations in by_origin.items():
+        if len(destinations) == 1:
+            singles.append((origin, destinations[0]))
+            continue
+        for i in range(0, len(destinations), MAX_DESTINATIONS_PER_REQUEST):
+            batches.append(([origin], destinations[i:i + MAX_DESTINATIONS_PER_REQUEST]))
+
+    by_destination = {}
+    for origin, destination in singles:
+        by_destination.setdefault(destination, []).append(origin)
+    for destination, origins in by_destination.items():
+        for i in range(0, len(origins), MAX_ORIGINS_PER_REQUEST):
+            batches.append((origins[i:i + MAX_ORIGINS_PER_REQUEST], [destination]))
+    return batches
+
+
+def get_leg_durations(legs, api_key, max_workers=None, cache=None, stats=None, departure_time=None):
+    """
+    Durations for exactly the given (origin, destination) legs.
+    With a cache, legs already fetched for the same departure bucket are served
+    from it and only the misses go to the API. Batches run concurrently;
+    results merge into the get_matrix_durations key format.
+    """
+    departure_time = departure_time or int(datetime.datetime.now().timestamp())
+    bucket = departure_bucket(departure_time)
+    legs = list(dict.fromkeys(legs))
+
+    durations, missing = {}, []
+    for origin, destination in legs:
+        cached = cache.get(traffic_cache_key(origin, destination, bucket)) if cache is not None else None
+        if stats is not None and cache is not None:
+            stats.record(cached is not None)
+        if cached is not None:
+            durations[leg_key(origin, destination)] = cached
+        else:
+            missing.append((origin, destination))
+
+    batches = plan_leg_batches(missing)
+    results = fan_out(
+        lambda batch: get_matrix_durations(batch[0], batch[1], api_key, departure_time),
+        batches,
+        max_workers
+    )
+
+    fetched = {}
+    for result in results:
+        fetched.update(result)
+    if cache is not None:
+        for origin, destination in missing:
+            value = fetched.get(leg_key(origin, destination))
+            if value and value.get("normal"):   # failed elements come back as zeros
+                cache.set(traffic_cache_key(origin, destination, bucket), value)
+    durations.update(fetched)
+
+    print(f"Traffic legs: {len(legs) - len(missing)} cached, {len(fetched)}/{len(missing)} fetched in {len(batches)} requests")
+    return durations
+
+
+def add_traffic_durations(routes_json: dict, api_key: str, cache=None):
     """
     Enriches routes_json with normal + traffic durations (mins/secs).
-    No caching — everything fresh per call.
+    Leg durations come from the shared time-bucketed cache unless another
+    cache is given; hit/miss counters land in routes_json["diagnostics"]["traffic_cache"].
     """
+    cache = cache if cache is not None else get_traffic_cache()
+    stats = CacheStats()
     distance_lookup = {}
 
-    # Collect all pairs
-    pairs_needed = set()
+    # Collect consecutive legs only (not the full point x point matrix)
+    legs_needed = []
     for route in routes_json["refined_routes"]:
         seq = route["sequence"]
         for i in range(len(seq) - 1):
             origin = (seq[i]["lat"], seq[i]["lon"])
             destination = (seq[i+1]["lat"], seq[i+1]["lon"])
-            key = f"{origin[0]},{origin[1]}|{destination[0]},{destination[1]}"
-            pairs_needed.add((origin, destination, key))
-
-    if pairs_needed:
-        unique_points = {pt for (origin, dest, key) in pairs_needed for pt in (origin, dest)}
-        unique_points = list(unique_points)
+            if origin != destination:
+                legs_needed.append((origin, destination))
 
-        # Fetch new durations
-        distance_lookup = get_matrix_durations(unique_points, unique_points, api_key)
+    if legs_needed:
+        distance_lookup = get_leg_durations(legs_needed, api_key, cache=cache, stats=stats)
 
     # Attach durations to routes
     for route in routes_json["refined_routes"]:
@@ -77,8 +187,7 @@ def add_traffic_durations(routes_json: dict, api_key: str):
         for i in range(len(seq) - 1):
             origin = (seq[i]["lat"], seq[i]["lon"])
             destination = (seq[i+1]["lat"], seq[i+1]["lon"])
-            key = f"{origin[0]},{origin[1]}|{destination[0]},{destination[1]}"
-            durations = distance_lookup.get(key, {"normal": 0, "traffic": 0})
+            durations = distance_lookup.get(leg_key(origin, destination), {"normal": 0, "traffic": 0})
 
             total_normal += durations.get("normal", 0)
             total_traffic += durations.get("traffic", 0)
@@ -88,7 +197,9 @@ def add_traffic_durations(routes_json: dict, api_key: str):
         route["metrics"]["total_normal_duration_mins"] = round(total_normal / 60, 2)
         route["metrics"]["total_traffic_duration_secs"] = total_traffic
         route["metrics"]["total_traffic_duration_mins"] = round(total_traffic / 60, 2)
-        
+
+    routes_json.setdefault("diagnostics", {})["traffic_cache"] = stats.as_dict()
+    print("Traffic cache:", stats.as_dict())
     print(routes_json)
     print(distance_lookup)
 
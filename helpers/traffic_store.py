@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+import pandas as pd
+
+from helpers.enrich import build_countpoint_tree, build_reference_indexes, normalize_reference_frames
+from helpers.traffic_artifact import ARTIFACT_DIRNAME, MANIFEST, artifact_exists, load_artifact
+
+# Reference CSVs (same names locally under data/ and as S3 keys)
+LOCAL_AUTHORITY_CSV = "local_authority_traffic.csv"
+REGION_CSV = "region_traffic.csv"
+COUNTS_CSV = "dft_traffic_counts_raw_counts.csv"
+
+
+class TrafficReference:
+    """
+    Loaded traffic tables (join keys already normalised to categoricals),
+    the BallTree over count points and the pre-aggregated join indexes.
+    Shared across requests and threads: treat as read-only.
+    """
+
+    def __init__(self, df1, df2, df3, tree, indexes, version):
+        self.df1 = df1          # local authority traffic
+        self.df2 = df2          # region traffic
+        self.df3 = df3          # DFT raw count points
+        self.tree = tree        # BallTree over df3 lat/lon (radians, haversine)
+        self.indexes = indexes  # (density_by_la, hgv_share_by_region)
+        self.version = version
+        self.loaded_at = time.time()
+
+
+class TrafficReferenceStore:
+    """
+    Process-wide cache of the traffic reference data.
+
+    Loads lazily on first use and keeps the parsed frames and BallTree in
+    memory. Sources are re-checked at most every `check_interval` seconds
+    (file mtime locally, ETag on S3) and reloaded only when they changed;
+    if that check fails, the loaded reference keeps being served until the
+    next interval.
+
+    The columnar artifact (helpers/traffic_artifact.py) is preferred when
+    present, locally under <data_dir>/traffic_artifact or on S3 under
+    traffic_artifact/ (downloaded once, then memory-mapped); otherwise the
+    raw CSVs are parsed.
+    """
+
+    def __init__(self, data_dir="data", use_s3=False, bucket=None, check_interval=60, artifact_dir=None):
+        self.data_dir = data_dir
+        self.use_s3 = use_s3
+        self.bucket = bucket
+        self.check_interval = check_interval
+        self.artifact_dir = artifact_dir or os.path.join(data_dir, ARTIFACT_DIRNAME)
+        self._ref = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _source_version(self):
+        """Tuple that changes whenever any source file changes: ("artifact", ...) or ("csv", ...)."""
+        keys = (LOCAL_AUTHORITY_CSV, REGION_CSV, COUNTS_CSV)
+        if self.use_s3:
+            from botocore.exceptions import ClientError
+            from helpers.s3_bucket import get_s3_etag
+            try:
+                return ("artifact", get_s3_etag(self.bucket, f"{ARTIFACT_DIRNAME}/{MANIFEST}"))
+            except ClientError as e:
+                # only a missing artifact means "use the CSVs"; other errors propagate to get()
+                if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+                    raise
+            return ("csv",) + tuple(get_s3_etag(self.bucket, k) for k in keys)
+        if artifact_exists(self.artifact_dir):
+            return ("artifact", os.stat(os.path.join(self.artifact_dir, MANIFEST)).st_mtime_ns)
+        return ("csv",) + tuple(os.stat(os.path.join(self.data_dir, k)).st_mtime_ns for k in keys)
+
+    def _read(self, name):
+        if self.use_s3:
+            from helpers.s3_bucket import read_csv_from_s3
+            return read_csv_from_s3(self.bucket, name)
+        return pd.read_csv(os.path.join(self.data_dir, name))
+
+    def _load(self, version):
+        started = time.perf_counter()
+        if version[0] == "artifact":
+            if self.use_s3:
+                from helpers.s3_bucket import download_dir_from_s3
+                download_dir_from_s3(self.bucket, ARTIFACT_DIRNAME, self.artifact_dir, last=MANIFEST,
+                                     etag=version[1])
+            df1, df2, df3, tree = load_artifact(self.artifact_dir)
+        else:
+            df1, df2, df3 = normalize_reference_frames(
+                self._read(LOCAL_AUTHORITY_CSV), self._read(REGION_CSV), self._read(COUNTS_CSV)
+            )
+            tree = build_countpoint_tree(df3)
+        ref = TrafficReference(df1, df2, df3, tree, build_reference_indexes(df1, df2), version)
+        print(f"Traffic reference loaded from {version[0]} ({len(df3)} count points) "
+              f"in {time.perf_counter() - started:.3f}s")
+        return ref
+
+    def get(self):
+        """Return the current TrafficReference, (re)loading it if needed."""
+        now = time.monotonic()
+        ref = self._ref
+        if ref is not None and now - self._checked_at < self.check_interval:
+            return ref
+
+        with self._lock:
+            if self._ref is not None and now - self._checked_at < self.check_interval:
+                return self._ref
+            try:
+                version = self._source_version()
+                if self._ref is None or self._ref.version != version:
+                    self._ref = self._load(version)
+            except Exception as e:
+                if self._ref is None:
+                    raise
+                # a failed HEAD/stat (or reload) must not fail solves while a reference is loaded
+                print(f"⚠️ Traffic reference check failed, serving cached version {self._ref.version}:", e)
+            self._checked_at = now
+            return self._ref
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_traffic_reference(use_s3=False, bucket=None, data_dir="data"):
+    """Shared TrafficReference for this worker process (one store per source)."""
+    key = (bool(use_s3), bucket, data_dir)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = TrafficReferenceStore(data_dir, use_s3, bucket)
+    return store.get()
@@ -2,12 +2,18 @@ import google.generativeai as genai
 import json
 import re
 import os
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
 # 🔑 Configure Gemini
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
 
+# Max Gemini calls in flight at once per solve
+TRIP_DESCRIPTION_CONCURRENCY = int(os.getenv("TRIP_DESCRIPTION_CONCURRENCY", "4"))
+# Stored in place of a vehicle's description when Gemini fails (no error details)
+DESCRIPTION_FALLBACK = "Trip description unavailable for this vehicle. Follow the stop order in the route."
+
 def clean_response(raw_text: str) -> str:
     """Cleans Gemini response (removes markdown/code fences)."""
     return re.sub(r"```(json|text)?", "", raw_text).strip()
@@ -29,25 +35,48 @@ Guidelines:
 - Avoid JSON or markdown in the response.
 """
 
-def generate_trip_descriptions(routes_json: dict) -> str:
+def describe_vehicle_route(route: dict, model_name="gemini-1.5-flash") -> str:
+    """Generate the pre-trip description for a single vehicle's route."""
+    model = genai.GenerativeModel(model_name)
+    vehicle_id = route.get("vehicle")
+    vehicle_data_str = json.dumps(route, indent=2)
+
+    response = model.generate_content(
+        [
+            BASE_PROMPT,
+            f"Here is the route for vehicle {vehicle_id}:\n{vehicle_data_str}"
+        ]
+    )
+    return clean_response(response.text)
+
+
+def _describe_or_fallback(route: dict) -> str:
+    # A failure for one vehicle must not lose the other descriptions
+    try:
+        return describe_vehicle_route(route)
+    except Exception as e:
+        # the error stays in the log: the summary is stored and shown to drivers
+        print(f"⚠️ Trip description failed for vehicle {route.get('vehicle')}:", e)
+        return DESCRIPTION_FALLBACK
+
+
+def generate_trip_descriptions(routes_json: dict, max_workers=None) -> str:
     """
     Generates a driver-friendly trip description for each vehicle.
-    Returns one combined string (can also split per vehicle if needed).
+    Vehicles are described concurrently (at most `max_workers`, default
+    TRIP_DESCRIPTION_CONCURRENCY, Gemini calls in flight) and reassembled
+    in route order. Returns one combined string.
     """
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    trip_description = ""
+    routes = routes_json.get("refined_routes", [])
+    if not routes:
+        return ""
 
-    for route in routes_json.get("refined_routes", []):
-        vehicle_id = route.get("vehicle")
-        vehicle_data_str = json.dumps(route, indent=2)
-
-        response = model.generate_content(
-            [
-                BASE_PROMPT,
-                f"Here is the route for vehicle {vehicle_id}:\n{vehicle_data_str}"
-            ]
-        )
-        text = clean_response(response.text)
-        trip_description += f"\n\n=== Vehicle {vehicle_id} Trip Description ===\n{text}"
+    workers = max(1, min(max_workers or TRIP_DESCRIPTION_CONCURRENCY, len(routes)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="trip-desc") as pool:
+        texts = list(pool.map(_describe_or_fallback, routes))
+
+    trip_description = ""
+    for route, text in zip(routes, texts):
+        trip_description += f"\n\n=== Vehicle {route.get('vehicle')} Trip Description ===\n{text}"
 
     return trip_description
@@ -100,3 +100,22 @@ class Node(db.Model):
     def __repr__(self):
         return f"<Node {self.id} (Order {self.order_id}) - User {self.user_id}>"
 
+
+
+class SolveJob(db.Model):
+    __tablename__ = "solve_jobs"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(100), unique=True, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    status = db.Column(db.String(20), default="queued")   # queued/running/succeeded/failed
+    stage = db.Column(db.String(100))                      # current pipeline stage
+    params = db.Column(JSON)                               # parsed solve config
+    trip_id = db.Column(db.String(100))                    # set on success
+    result = db.Column(JSON)                               # result / failure diagnostics
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<SolveJob {self.job_id} ({self.status})>"
@@ -1,3 +1,4 @@
+import time
 import pytest
 import requests
 
@@ -72,8 +73,27 @@ def test_solve_vrp(token):
         "vehicleCapacity": 150
     }
     r = requests.post(f"{BASE_URL}/api/solve", headers=auth_headers(token), json=payload)
+    assert r.status_code == 202
+    job_id = r.json()["job_id"]
+
+    # Poll the background job until it finishes
+    deadline = time.time() + 300
+    while time.time() < deadline:
+        r = requests.get(f"{BASE_URL}/api/solve/{job_id}", headers=auth_headers(token))
+        assert r.status_code == 200
+        if r.json()["job_status"] in ("succeeded", "failed"):
+            break
+        time.sleep(2)
+
+    assert r.json()["job_status"] == "succeeded", r.json().get("error")
+    r = requests.get(f"{BASE_URL}/api/routes/{r.json()['trip_id']}", headers=auth_headers(token))
     assert r.status_code == 200
-    assert "routes" in r.json()
+    assert "refined_routes" in r.json()["route"]
+
+
+def test_solve_job_not_found(token):
+    r = requests.get(f"{BASE_URL}/api/solve/does-not-exist", headers=auth_headers(token))
+    assert r.status_code == 404
 
 
 def test_situation_endpoints(token):
@@ -0,0 +1,1098 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from haversine import haversine
+
+from helpers.dist_comp import compute_distance_matrix, MatrixContext
+from helpers.dist_look import build_distance_lookup
+from helpers.enrich import enrich_customers
+from helpers.traffic_store import TrafficReferenceStore
+
+
+# ----------------------------
+# Fixtures
+# ----------------------------
+DEPOT = {"id": "W010", "lat": 51.5072, "lon": -0.1276}
+CUSTOMERS = [
+    {"customer_id": "C001", "lat": 51.7520, "lon": -1.2577, "weight": 20},
+    {"customer_id": "C002", "lat": 52.2053, "lon": 0.1218, "weight": 35},
+    {"customer_id": "C003", "lat": 51.4545, "lon": -2.5879, "weight": 10},
+    {"customer_id": "C004", "lat": 51.5080, "lon": -0.1280, "weight": 5},
+]
+
+
+
+@pytest.fixture
+def traffic_dir(tmp_path):
+    """Tiny stand-ins for the three traffic reference CSVs under data/."""
+    pd.DataFrame({
+        "local_authority_name": [" Oxfordshire", "Cambridgeshire ", "City of London"],
+        "all_motor_vehicles": [3.0e9, 1.0e9, 5.0e8],
+        "link_length_km": [1000.0, 2000.0, 0.0],
+    }).to_csv(tmp_path / "local_authority_traffic.csv", index=False)
+    pd.DataFrame({
+        "region_name": ["South East", "South East", "East of England", "London"],
+        "all_motor_vehicles": [100.0, 300.0, 200.0, 100.0],
+        "all_hgvs": [40.0, 60.0, 20.0, 30.0],
+    }).to_csv(tmp_path / "region_traffic.csv", index=False)
+    pd.DataFrame({
+        "count_point_id": [11, 22, 33, 44],
+        "latitude": [51.75, 52.20, 51.45, 51.51],
+        "longitude": [-1.26, 0.12, -2.59, -0.13],
+        "local_authority_name": ["Oxfordshire", "CAMBRIDGESHIRE", "Bristol", "City of London"],
+        "region_name": ["South East", "East of England", "South West", " London "],
+        "road_type": ["Major", "Minor", "Major", "Minor"],
+        "road_name": ["M40", "U", "A4", "U"],
+        "all_motor_vehicles": [5000, 300, 2500, 800],
+    }).to_csv(tmp_path / "dft_traffic_counts_raw_counts.csv", index=False)
+    return tmp_path
+
+
+# ----------------------------
+# Tests
+# ----------------------------
+def test_distance_matrix_matches_haversine():
+    dist, time_s, node_ids = compute_distance_matrix(DEPOT, CUSTOMERS)
+    points = [(DEPOT["lat"], DEPOT["lon"])] + [(c["lat"], c["lon"]) for c in CUSTOMERS]
+
+    assert node_ids == ["DEPOT", "C001", "C002", "C003", "C004"]
+    for i, p in enumerate(points):
+        for j, q in enumerate(points):
+            assert abs(dist[i][j] - haversine(p, q)) < 1e-9
+            assert abs(time_s[i][j] - haversine(p, q) / 40 * 3600) < 1e-6
+
+
+def test_distance_matrix_float32_and_full_fill():
+    d32, _, _ = compute_distance_matrix(DEPOT, CUSTOMERS, dtype=np.float32)
+    d_full, _, _ = compute_distance_matrix(DEPOT, CUSTOMERS, symmetric=False)
+
+    assert d32.dtype == np.float32
+    assert np.allclose(d32, d_full, atol=1e-3)
+    assert np.array_equal(d_full, d_full.T)
+
+
+def test_distance_lookup_uses_depot_id():
+    lookup = build_distance_lookup(DEPOT, CUSTOMERS)
+
+    assert lookup.get("W010", "W010") == {"distance_km": 0.0, "travel_time_min": 0.0}
+    expected = haversine((DEPOT["lat"], DEPOT["lon"]), (CUSTOMERS[0]["lat"], CUSTOMERS[0]["lon"]))
+    assert lookup.get("W010", "C001")["distance_km"] == round(expected, 2)
+    assert lookup.get("W010", "C001")["travel_time_min"] == round(expected / 40 * 60, 1)
+
+
+def test_distance_lookup_serializers():
+    lookup = build_distance_lookup(DEPOT, CUSTOMERS)
+    dense = lookup.to_dense()
+    knn = lookup.to_knn(k=2)
+
+    assert dense["order"] == ["W010", "C001", "C002", "C003", "C004"]
+    assert dense["distances_km"][0][1] == lookup.get("W010", "C001")["distance_km"]
+    # London depot: C004 is next door, Cambridge (C002) is closer than Oxford (C001)
+    assert [n[0] for n in knn["neighbors"]["W010"]] == ["C004", "C002"]
+    assert all(len(v) == 2 for v in knn["neighbors"].values())
+    assert set(knn["depot"]) == {"C001", "C002", "C003", "C004"}
+
+
+def test_matrix_context_computes_once():
+    ctx = MatrixContext()
+    dist_a, _, _ = ctx.get(DEPOT, CUSTOMERS)
+    dist_b, _, _ = ctx.get(DEPOT, CUSTOMERS)
+    lookup = build_distance_lookup(DEPOT, CUSTOMERS, matrix_ctx=ctx)
+
+    assert dist_a is dist_b
+    assert ctx.distance_km("W010", "C002") == dist_a[0][2]
+    assert ctx.distance_km("C002", "DEPOT") == dist_a[2][0]
+    assert ctx.distance_km("C002", "unknown") is None
+    assert lookup.get("C001", "C002")["distance_km"] == round(float(dist_a[1][2]), 2)
+
+
+def test_traffic_store_loads_once_and_reloads_on_change(traffic_dir):
+    store = TrafficReferenceStore(data_dir=str(traffic_dir), check_interval=0)
+    first = store.get()
+
+    assert store.get() is first
+    assert len(first.df3) == 4
+
+    counts = traffic_dir / "dft_traffic_counts_raw_counts.csv"
+    stat = os.stat(counts)
+    os.utime(counts, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert store.get() is not first
+
+
+def test_traffic_store_serves_cached_reference_when_check_fails(traffic_dir):
+    store = TrafficReferenceStore(data_dir=str(traffic_dir), check_interval=0)
+    first = store.get()
+
+    counts = traffic_dir / "dft_traffic_counts_raw_counts.csv"
+    counts.rename(traffic_dir / "moved.csv")
+    assert store.get() is first
+    with pytest.raises(FileNotFoundError):
+        TrafficReferenceStore(data_dir=str(traffic_dir)).get()
+
+
+def test_traffic_store_s3_errors_do_not_switch_to_csv(traffic_dir, monkeypatch):
+    import helpers.s3_bucket as s3_bucket
+    from botocore.exceptions import ClientError
+
+    code = {"manifest": "404"}
+
+    def etag(bucket, key):
+        if key.endswith("manifest.json"):
+            raise ClientError({"Error": {"Code": code["manifest"]}}, "HeadObject")
+        return f'"{key}"'
+
+    monkeypatch.setattr(s3_bucket, "get_s3_etag", etag)
+    store = TrafficReferenceStore(data_dir=str(traffic_dir), use_s3=True, bucket="b", check_interval=0)
+    assert store._source_version()[0] == "csv"          # no artifact uploaded: CSV ETags
+
+    code["manifest"] = "503"                             # transient: not a reason to rebuild from CSVs
+    with pytest.raises(ClientError):
+        store._source_version()
+    cached = TrafficReferenceStore(data_dir=str(traffic_dir), check_interval=0).get()
+    store._ref = cached
+    assert store.get() is cached
+
+
+def test_enrich_customers_leaves_raw_frames_untouched(traffic_dir):
+    raw = [pd.read_csv(traffic_dir / name) for name in
+           ("local_authority_traffic.csv", "region_traffic.csv", "dft_traffic_counts_raw_counts.csv")]
+    snapshot = [df.copy(deep=True) for df in raw]
+
+    enriched = enrich_customers(CUSTOMERS, *raw)
+    assert enriched[0]["local_authority"] == "oxfordshire"     # joined on normalised keys
+    for df, before in zip(raw, snapshot):
+        pd.testing.assert_frame_equal(df, before)              # same values and (object) dtypes
+    assert raw[0]["local_authority_name"].tolist()[0] == " Oxfordshire"
+
+
+def test_enrich_customers_joins_reference_tables(traffic_dir):
+    ref = TrafficReferenceStore(data_dir=str(traffic_dir)).get()
+    prefs = {"priority_customers": ["C002"], "avoid_zones": ["South West"]}
+    enriched = enrich_customers(CUSTOMERS, ref.df1, ref.df2, ref.df3, prefs, tree=ref.tree)
+    by_id = {e["customer_id"]: e for e in enriched}
+
+    oxford = by_id["C001"]
+    assert oxford["nearest_count_point"] == 11
+    assert oxford["local_authority"] == "oxfordshire"
+    assert oxford["traffic_density"] == 3.0e6
+    assert oxford["hgvs_pct"] == 0.25
+    assert oxford["expected_speed_kmph"] == 28.0     # default 40, congested
+    assert by_id["C002"]["priority"] == "high"
+    assert by_id["C002"]["expected_speed_kmph"] == 30.0  # minor road
+    assert by_id["C003"]["priority"] == "avoid"
+    assert by_id["C004"]["traffic_density"] is None  # zero link length
+    assert by_id["C004"]["hgvs_pct"] == 0.3
+    assert by_id["C004"]["expected_speed_kmph"] == 24.0
+
+
+def test_traffic_artifact_roundtrip(traffic_dir):
+    from helpers.traffic_artifact import build_artifact
+
+    csv_ref = TrafficReferenceStore(data_dir=str(traffic_dir)).get()
+    build_artifact(str(traffic_dir))
+    ref = TrafficReferenceStore(data_dir=str(traffic_dir)).get()
+
+    assert ref.version[0] == "artifact"
+    assert not ref.df3["latitude"].to_numpy().flags.writeable  # read-only memory map
+    assert "road_name" not in ref.df3  # unused columns are pruned
+    assert ref.indexes == csv_ref.indexes
+    assert (enrich_customers(CUSTOMERS, ref.df1, ref.df2, ref.df3, tree=ref.tree, indexes=ref.indexes)
+            == enrich_customers(CUSTOMERS, csv_ref.df1, csv_ref.df2, csv_ref.df3, tree=csv_ref.tree))
+
+
+def test_trip_descriptions_keep_order_and_isolate_failures(monkeypatch):
+    import helpers.trip_description as trip_description
+
+    def fake_describe(route):
+        if route["vehicle"] == "V2":
+            raise RuntimeError("quota exceeded")
+        return f"notes for {route['vehicle']}"
+
+    monkeypatch.setattr(trip_description, "describe_vehicle_route", fake_describe)
+    text = trip_description.generate_trip_descriptions(
+        {"refined_routes": [{"vehicle": f"V{i}"} for i in range(1, 6)]}, max_workers=3
+    )
+
+    headers = [line for line in text.splitlines() if line.startswith("===")]
+    assert headers == [f"=== Vehicle V{i} Trip Description ===" for i in range(1, 6)]
+    assert "notes for V5" in text
+    assert trip_description.DESCRIPTION_FALLBACK in text
+    assert "quota exceeded" not in text                 # error details stay in the log
+
+
+@pytest.fixture
+def places_stub():
+    """Local stand-in for the Places Nearby Search API; counts requests."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            calls.append(query)
+            if query["type"][0] == "busy" and len(calls) == 1:
+                body = {"status": "OVER_QUERY_LIMIT", "results": []}   # throttled once
+                payload = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+                return
+            lat, lng = map(float, query["location"][0].split(","))
+            body = {"status": "OK", "results": [
+                {"name": f"{query['type'][0]} {i}", "vicinity": "High St",
+                 "geometry": {"location": {"lat": lat + i * 0.001, "lng": lng}}}
+                for i in range(3)
+            ]}
+            payload = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/nearbysearch/json", calls
+    server.shutdown()
+
+
+def test_geohash_encode():
+    from helpers.cache_store import geohash_encode
+
+    assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+    assert geohash_encode(51.5072, -0.1276, 6) == "gcpvj0"
+
+
+def test_places_cache_hits_skip_http(places_stub, tmp_path, monkeypatch):
+    import helpers.nearby_places as nearby_places
+    from helpers.cache_store import SqliteTTLCache
+
+    url, calls = places_stub
+    monkeypatch.setattr(nearby_places, "PLACES_API_URL", url)
+    cache = SqliteTTLCache(str(tmp_path / "places.sqlite3"), "places_cache", ttl_seconds=3600)
+
+    def plan():
+        return {"refined_routes": [{"vehicle": "V1", "sequence": [
+            {"id": "W010", "lat": 51.5072, "lon": -0.1276},
+            {"id": "C004", "lat": 51.5073, "lon": -0.1277},   # same cell as the depot
+            {"id": "C001", "lat": 51.7520, "lon": -1.2577},
+        ]}]}
+
+    first = nearby_places.enrich_with_support_stations(plan(), api_key="k", cache=cache)
+    assert len(calls) == 4
+    assert first["diagnostics"]["places_cache"] == {"hits": 2, "misses": 4, "hit_rate": 0.333}
+    assert len(first["refined_routes"][0]["sequence"][0]["nearby_petrol_stations"]) == 2
+
+    second = nearby_places.enrich_with_support_stations(plan(), api_key="k", cache=cache)
+    assert len(calls) == 4
+    assert second["diagnostics"]["places_cache"]["misses"] == 0
+
+    # expired entries are refetched
+    conn = cache._conn()
+    conn.execute("UPDATE places_cache SET created_at = created_at - 7200")
+    conn.commit()
+    nearby_places.enrich_with_support_stations(plan(), api_key="k", cache=cache)
+    assert len(calls) == 8
+
+
+def test_http_fan_out_keeps_order_and_runs_concurrently():
+    import threading
+    import time
+    from helpers.http_client import fan_out
+
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def work(i):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return i * i
+
+    started = time.perf_counter()
+    assert fan_out(work, range(8), max_workers=8) == [i * i for i in range(8)]
+    assert peak[0] > 1
+    assert time.perf_counter() - started < 0.05 * 8
+
+
+def test_http_get_json_retries_throttled_status(places_stub, monkeypatch):
+    import helpers.http_client as http_client
+
+    url, calls = places_stub
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF", 0.01)
+    body = http_client.get_json(url, params={"location": "51.5,-0.1", "type": "busy"})
+    assert body["status"] == "OK"
+    assert len(calls) == 2
+
+
+def test_rest_stops_precomputed_once(places_stub, tmp_path, monkeypatch):
+    import helpers.fatigue as fatigue
+    import helpers.http_client as http_client
+    import helpers.nearby_places as nearby_places
+    from helpers.cache_store import SqliteTTLCache
+
+    url, calls = places_stub
+    monkeypatch.setattr(nearby_places, "PLACES_API_URL", url)
+    monkeypatch.setattr(fatigue, "GOOGLE_CLOUD_API", "k")
+    cache = SqliteTTLCache(str(tmp_path / "places.sqlite3"), "places_cache", ttl_seconds=3600)
+    plan = {"depot": {"id": "W010", "lat": 51.5072, "lon": -0.1276}, "refined_routes": [
+        {"vehicle": "V1", "sequence": [
+            {"id": "C001", "lat": 51.7520, "lon": -1.2577},
+            {"id": "C002", "lat": 52.2053, "lon": 0.1218},
+        ]},
+        {"vehicle": "V2", "sequence": [{"id": "C004", "lat": 51.5073, "lon": -0.1277}]},
+    ]}
+
+    assert not fatigue.has_rest_stops(plan)
+    fatigue.enrich_with_rest_stops(plan, cache=cache)
+    assert len(calls) == 3 * 3
+    assert fatigue.has_rest_stops(plan)
+    nearby = plan["refined_routes"][0]["sequence"][0]["nearby_safe_stops"]
+    assert len(nearby) == 3 and nearby[0]["distance_km"] == 0.0
+    assert plan["diagnostics"]["rest_stops_cache"]["misses"] == 9
+
+    # the next solve over the same customers is served from the geohash cache
+    fatigue.enrich_with_rest_stops(plan, cache=cache)
+    assert len(calls) == 3 * 3
+    assert plan["diagnostics"]["rest_stops_cache"] == {"hits": 9, "misses": 0, "hit_rate": 1.0}
+    assert plan["refined_routes"][0]["sequence"][0]["nearby_safe_stops"] == nearby
+
+    def no_network(*args, **kwargs):
+        raise AssertionError("clean_payload must not call the Places API")
+
+    monkeypatch.setattr(http_client, "get_json", no_network)
+    monkeypatch.setattr(nearby_places, "get_json", no_network)
+    minimal = fatigue.clean_payload(plan)
+    assert minimal["refined_routes"][0]["sequence"][0]["nearby_safe_stops"] == nearby
+    assert minimal["refined_routes"][1]["sequence"][0]["distance_to_depot_km"] == 0.01
+
+
+def test_rest_stops_failed_lookup_is_retried(tmp_path, monkeypatch):
+    import helpers.fatigue as fatigue
+    import helpers.nearby_places as nearby_places
+    from helpers.cache_store import SqliteTTLCache
+
+    cache = SqliteTTLCache(str(tmp_path / "places.sqlite3"), "places_cache", ttl_seconds=3600)
+    plan = {"refined_routes": [{"vehicle": "V1", "sequence": [{"id": "C001", "lat": 51.7520, "lon": -1.2577}]}]}
+
+    monkeypatch.setattr(fatigue, "GOOGLE_CLOUD_API", None)
+    fatigue.enrich_with_rest_stops(plan, cache=cache)
+    assert "nearby_safe_stops" not in plan["refined_routes"][0]["sequence"][0]
+
+    # parking fails (not cached): the stop stays unenriched so the fatigue endpoint tries again
+    monkeypatch.setattr(fatigue, "GOOGLE_CLOUD_API", "k")
+    monkeypatch.setattr(nearby_places, "fetch_nearby_places",
+                        lambda lat, lon, place_type, api_key, radius: None if place_type == "parking" else [])
+    fatigue.enrich_with_rest_stops(plan, cache=cache)
+    assert "nearby_safe_stops" not in plan["refined_routes"][0]["sequence"][0]
+    assert not fatigue.has_rest_stops(plan)
+
+    plan["refined_routes"][0]["sequence"][0]["nearby_safe_stops"] = []
+    assert not fatigue.has_rest_stops(plan)
+
+
+@pytest.fixture
+def matrix_stub():
+    """Local stand-in for the Distance Matrix API; records origins/destinations per request."""
+    import json
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = parse_qs(urlparse(self.path).query)
+            origins = query["origins"][0].split("|")
+            destinations = query["destinations"][0].split("|")
+            calls.append((origins, destinations))
+            rows = [{"elements": [
+                {"status": "OK", "duration": {"value": 600}, "duration_in_traffic": {"value": 900}}
+                for _ in destinations
+            ]} for _ in origins]
+            payload = json.dumps({"status": "OK", "rows": rows}).encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}/distancematrix/json", calls
+    server.shutdown()
+
+
+def test_traffic_durations_fetch_only_route_legs(matrix_stub, tmp_path, monkeypatch):
+    import helpers.traffic_durations as traffic_durations
+    from helpers.cache_store import SqliteTTLCache
+
+    url, calls = matrix_stub
+    monkeypatch.setattr(traffic_durations, "DISTANCE_MATRIX_URL", url)
+    depot = {"id": "W010", "lat": DEPOT["lat"], "lon": DEPOT["lon"]}
+    stops = [{"id": f"S{i}", "lat": 51.0 + i * 0.01, "lon": -1.0} for i in range(40)]
+    plan = {"refined_routes": [
+        {"vehicle": "V1", "sequence": [depot] + stops[:30] + [depot]},
+        {"vehicle": "V2", "sequence": [depot] + stops[30:] + [depot]},
+    ]}
+
+    cache = SqliteTTLCache(str(tmp_path / "traffic.sqlite3"), "traffic_cache", ttl_seconds=3600)
+    enriched, lookup = traffic_durations.add_traffic_durations(plan, api_key="k", cache=cache)
+
+    legs = 31 + 11
+    assert len(lookup) == legs
+    assert sum(len(o) * len(d) for o, d in calls) == legs        # no unused elements billed
+    assert all(len(o) <= 25 and len(d) <= 25 for o, d in calls)
+    assert len(calls) < legs                                      # depot legs are packed together
+    metrics = enriched["refined_routes"][0]["metrics"]
+    assert metrics["total_normal_duration_secs"] == 31 * 600
+    assert metrics["total_traffic_duration_secs"] == 31 * 900
+    key = traffic_durations.leg_key((depot["lat"], depot["lon"]), (stops[0]["lat"], stops[0]["lon"]))
+    assert lookup[key] == {"normal": 600, "traffic": 900}
+
+
+def test_traffic_leg_cache_per_departure_bucket(matrix_stub, tmp_path, monkeypatch):
+    import datetime
+    import helpers.traffic_durations as traffic_durations
+    from helpers.cache_store import CacheStats, SqliteTTLCache
+
+    url, calls = matrix_stub
+    monkeypatch.setattr(traffic_durations, "DISTANCE_MATRIX_URL", url)
+    cache = SqliteTTLCache(str(tmp_path / "traffic.sqlite3"), "traffic_cache", ttl_seconds=3600)
+    legs = [((51.50721, -0.12761), (51.752, -1.2577)), ((51.752, -1.2577), (52.2053, 0.1218))]
+    monday_0800 = datetime.datetime(2026, 10, 12, 8, 0).timestamp()
+
+    stats = CacheStats()
+    traffic_durations.get_leg_durations(legs, "k", cache=cache, stats=stats, departure_time=monday_0800)
+    assert len(calls) == 2 and stats.misses == 2
+
+    # same 15-minute slot, coordinates equal after rounding: no API call
+    stats = CacheStats()
+    nearby = [((51.507212, -0.127613), (51.752, -1.2577))] + legs[1:]
+    durations = traffic_durations.get_leg_durations(nearby, "k", cache=cache, stats=stats, departure_time=monday_0800 + 600)
+    assert len(calls) == 2 and stats.as_dict() == {"hits": 2, "misses": 0, "hit_rate": 1.0}
+    assert durations[traffic_durations.leg_key(*nearby[0])] == {"normal": 600, "traffic": 900}
+
+    # next slot is a different bucket
+    traffic_durations.get_leg_durations(legs, "k", cache=cache, departure_time=monday_0800 + 900)
+    assert len(calls) == 4
+    assert traffic_durations.departure_bucket(monday_0800) == "0@32"
+
+
+def test_improve_routes_untangles_and_respects_capacity():
+    from helpers.local_reroute import improve_routes, route_cost
+
+    # depot 0 plus points on a line; each route zig-zags
+    xs = [0, 1, 2, 3, 4, 5, 6]
+    cost = [[abs(a - b) for b in xs] for a in xs]
+    demand = [0, 1, 1, 1, 1, 1, 1]
+    routes = [[0, 3, 1, 5, 0], [0, 2, 6, 4, 0]]
+
+    improved, stats = improve_routes(routes, cost, demand, capacity=3, time_budget=5)
+    assert routes == [[0, 3, 1, 5, 0], [0, 2, 6, 4, 0]]               # input untouched
+    assert sorted(p for r in improved for p in r[1:-1]) == [1, 2, 3, 4, 5, 6]
+    assert all(r[0] == 0 and r[-1] == 0 for r in improved)
+    assert all(sum(demand[p] for p in r) <= 3 for r in improved)
+    assert stats["stop_reason"] == "local_optimum"
+    assert stats["after"] == sum(route_cost(r, cost) for r in improved) == 2 * 3 + 2 * 6
+    assert improve_routes(routes, cost, demand, capacity=3, time_budget=5)[0] == improved
+
+
+def test_reroute_locally_keeps_schema_and_is_deterministic():
+    from helpers.local_reroute import reroute_locally
+    from helpers.traffic_durations import leg_key
+
+    depot = {"id": "W010", "lat": DEPOT["lat"], "lon": DEPOT["lon"]}
+    stops = {c["customer_id"]: {"id": c["customer_id"], "lat": c["lat"], "lon": c["lon"]} for c in CUSTOMERS}
+    plan = {"depot": depot, "refined_routes": [
+        {"vehicle": "V1", "sequence": [depot, stops["C001"], stops["C004"], stops["C003"], depot],
+         "metrics": {"notes": "kept"}},
+        {"vehicle": "V2", "sequence": [depot, stops["C002"], depot]},
+    ]}
+    point = lambda s: (s["lat"], s["lon"])
+    matrix = {leg_key(point(depot), point(stops["C001"])): {"normal": 3600, "traffic": 5400}}
+    demands = {c["customer_id"]: c["weight"] for c in CUSTOMERS}
+
+    first = reroute_locally(plan, matrix, demands, vehicle_capacity=100, time_budget=5)
+    second = reroute_locally(plan, matrix, demands, vehicle_capacity=100, time_budget=5)
+    ids = lambda p: [[s["id"] for s in r["sequence"]] for r in p["refined_routes"]]
+    assert ids(first) == ids(second)
+    assert ids(plan)[0] == ["W010", "C001", "C004", "C003", "W010"]       # input untouched
+    assert sorted(i for r in ids(first) for i in r[1:-1]) == ["C001", "C002", "C003", "C004"]
+    assert all(r[0] == r[-1] == "W010" for r in ids(first))
+
+    diag = first["diagnostics"]["local_reroute"]
+    assert diag["after"] < diag["before"]
+    metrics = first["refined_routes"][0]["metrics"]
+    assert metrics["notes"] == "kept"
+    assert sum(r["metrics"]["total_traffic_duration_secs"] for r in first["refined_routes"]) == pytest.approx(diag["after"], abs=2)
+    assert diag["estimated_legs"] == sum(r["metrics"]["estimated_legs"] for r in first["refined_routes"]) > 0
+    assert diag["measured"] is None
+
+    def measure_with(secs):
+        def measure(candidate):
+            legs = {}
+            for r in candidate["refined_routes"]:
+                for a, b in zip(r["sequence"], r["sequence"][1:]):
+                    if point(a) != point(b):
+                        legs[leg_key(point(a), point(b))] = {"normal": secs, "traffic": secs}
+            return candidate, legs
+        return measure
+
+    # every original leg measured; the new order's legs turn out slow: keep the original order
+    measured = {leg_key(point(a), point(b)): {"normal": 600, "traffic": 600}
+                for r in plan["refined_routes"] for a, b in zip(r["sequence"], r["sequence"][1:])}
+    kept = reroute_locally(plan, {**measured, **matrix}, demands, vehicle_capacity=100, time_budget=5,
+                           measure=measure_with(10 ** 5))
+    assert kept["diagnostics"]["local_reroute"]["measured"]["accepted"] is False
+    assert ids(kept) == ids(plan)
+
+    accepted = reroute_locally(plan, matrix, demands, vehicle_capacity=100, time_budget=5, measure=measure_with(1))
+    assert accepted["diagnostics"]["local_reroute"]["measured"]["accepted"] is True
+    assert ids(accepted) == ids(first)
+    assert all(r["metrics"]["estimated_legs"] == 0 for r in accepted["refined_routes"])
+
+
+def test_seed_routes_drops_removed_and_inserts_new_orders():
+    from helpers.ortools import seed_routes
+
+    customers = [dict(c) for c in CUSTOMERS]
+    demands = [0] + [int(c["weight"]) for c in customers]
+    dist, _, _ = compute_distance_matrix(DEPOT, customers)
+    meters = np.rint(dist * 1000).astype(int).tolist()
+
+    previous = [["C003", "C999", "C001"], ["C002"]]          # C999 was delivered, C004 is new
+    routes, stats = seed_routes(previous, customers, demands, meters, num_vehicles=2, vehicle_capacity=200)
+    assert stats == {"kept": 3, "dropped": 1, "inserted": 1}
+    assert routes[0][:1] == [3] and 4 in routes[0] + routes[1]
+    assert sorted(n for r in routes for n in r) == [1, 2, 3, 4]
+
+    # nothing fits a vehicle this small: no usable seed
+    assert seed_routes(previous, customers, demands, meters, 2, vehicle_capacity=1)[0] is None
+
+
+def test_ortools_vrp_warm_start_returns_diagnostics():
+    from helpers.ortools import ortools_vrp
+
+    result = ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, time_limit=1,
+                         initial_routes=[["C004", "C001", "C003"], ["C002"]])
+    assert result["diagnostics"]["warm_start"]["used"] is True
+    assert sorted(c for r in result["routes"] for c in r["route"]) == ["C001", "C002", "C003", "C004"]
+
+    # a previous trip with none (or few) of today's customers is not worth the reduced budget
+    for previous in ([["X1", "X2"], ["X3"]], [["C001", "X2"]]):
+        result = ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, time_limit=1,
+                             initial_routes=previous)
+        warm = result["diagnostics"]["warm_start"]
+        assert warm["used"] is False and warm["skipped"] == "low_overlap"
+        assert [s["model"] for s in result["diagnostics"]["search"]] == ["with_fuel"]
+
+
+def test_ortools_vrp_stops_early_on_convergence():
+    import time
+    from helpers.ortools import ortools_vrp, solver_budget
+
+    assert solver_budget(5, 10) == (1.25, 0.3125)
+    assert solver_budget(1000, 10)[0] == 10
+
+    started = time.perf_counter()
+    result = ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, time_limit=10)
+    assert time.perf_counter() - started < 1.5
+
+    search = result["diagnostics"]["search"][-1]
+    assert search["stop_reason"] == "stalled"
+    assert search["objective_trace"][-1][1] == search["best_objective"]
+    assert search["time_to_best_s"] <= search["wall_s"]
+
+
+def test_ortools_vrp_precheck_rejects_without_search():
+    import time
+    from helpers.ortools import ortools_vrp
+
+    started = time.perf_counter()
+    result = ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=1, vehicle_capacity=30, time_limit=10)
+    assert time.perf_counter() - started < 0.5
+    diag = result["diagnostics"]
+    assert result["routes"] == [] and diag["result"] == "no_solution_precheck"
+    assert diag["precheck"]["reasons"] == ["total_demand_exceeds_fleet_capacity", "package_exceeds_vehicle_capacity"]
+    assert diag["precheck"]["oversized_packages"] == ["C002"]
+    assert diag["search"] == []
+
+    # Bristol is ~170 km from London: its round trip exceeds a 15 l x 15 km/l range, so only the no-fuel model runs
+    result = ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, tank_size=15, mileage=15)
+    diag = result["diagnostics"]
+    assert diag["precheck"]["out_of_range_customers"] == ["C003"]
+    assert diag["attempts"] == ["skip_fuel_precheck", "retry_without_fuel"]
+    assert diag["result"] == "solution_without_fuel"
+
+
+def test_ortools_vrp_portfolio_picks_best_strategy(monkeypatch):
+    import helpers.ortools as ortools
+
+    monkeypatch.setattr(ortools, "SOLVER_PORTFOLIO_WORKERS", 2)
+    pairs = [("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH"), ("SAVINGS", "TABU_SEARCH")]
+    result = ortools.ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, portfolio=pairs)
+
+    portfolio = result["diagnostics"]["portfolio"][0]
+    assert [r["strategy"] for r in portfolio["results"]] == ["PATH_CHEAPEST_ARC+GUIDED_LOCAL_SEARCH", "SAVINGS+TABU_SEARCH"]
+    assert all(r["error"] is None for r in portfolio["results"])
+    best = min(r["objective"] for r in portfolio["results"])
+    assert sum(r["total_distance_km"] for r in result["routes"]) == pytest.approx(best / 1000, abs=0.01)
+    assert sorted(c for r in result["routes"] for c in r["route"]) == ["C001", "C002", "C003", "C004"]
+
+
+def test_build_cost_arrays_rounding_and_refuel_mask():
+    from helpers.ortools import build_cost_arrays
+
+    dist = np.array([[0.0, 1.2344, 2.0], [1.2346, 0.0, 0.0005], [2.0, 0.0004, 0.0]])
+    arrays = build_cost_arrays(dist, mileage=4.0, tank_size=10.0004, refuel_flags=[False, False, True])
+
+    assert arrays["tank_size_ml"] == 10000
+    assert arrays["meters"].dtype == np.int64 and arrays["fuel_net_ml"].dtype == np.int64
+    # km -> m rounded to the nearest metre (half to even), not truncated
+    assert arrays["meters"].tolist() == [[0, 1234, 2000], [1235, 0, 0], [2000, 0, 0]]
+    # fuel used in ml (km / mileage), and +tank only on arcs into the refuel node (column 2)
+    travel_ml = [[0, 309, 500], [309, 0, 0], [500, 0, 0]]
+    expected = [[-travel_ml[i][j] + (10000 if j == 2 else 0) for j in range(3)] for i in range(3)]
+    assert arrays["fuel_net_ml"].tolist() == expected
+
+
+def test_ortools_vrp_respects_slot_windows():
+    from helpers.ortools import ortools_vrp
+
+    slots = {"C001": ("Morning", (480, 720)), "C002": ("Afternoon", (720, 1020)),
+             "C003": ("Anytime", (480, 1080)), "C004": ("Evening", (1020, 1260))}
+    customers = [{**c, "slot_label": slots[c["customer_id"]][0], "time_window": slots[c["customer_id"]][1]}
+                 for c in CUSTOMERS]
+    result = ortools_vrp(DEPOT, customers, num_vehicles=2, vehicle_capacity=200, time_limit=2)
+    diag = result["diagnostics"]
+    assert diag["time_windows"]["mode"] == "hard" and diag["time_windows"]["precheck_unreachable"] == []
+    assert diag["search"][0]["model"] == "with_fuel_windows"
+    windows = diag["time_windows"]["windows"]
+    assert {label: w["on_time"] for label, w in windows.items()} == {
+        "Morning": 1, "Afternoon": 1, "Anytime": 1, "Evening": 1}
+    arrival = {c: t for r in result["routes"] for c, t in zip(r["route"], r["arrival_min"])}
+    for cid, (_, (open_min, close_min)) in slots.items():
+        assert open_min <= arrival[cid] <= close_min
+
+    # Bristol is ~2.5 h from the depot: a 08:00-08:20 window is unreachable, so lateness is allowed and reported
+    customers[2]["time_window"] = (480, 500)
+    result = ortools_vrp(DEPOT, customers, num_vehicles=2, vehicle_capacity=200, time_limit=2)
+    tw = result["diagnostics"]["time_windows"]
+    assert tw["mode"] == "soft" and tw["precheck_unreachable"] == ["C003"]
+    assert tw["windows"]["Anytime"]["late"] == 1 and tw["windows"]["Anytime"]["max_late_min"] > 100
+    assert sorted(c for r in result["routes"] for c in r["route"]) == ["C001", "C002", "C003", "C004"]
+
+
+@pytest.mark.parametrize("method", ["sweep", "kmeans"])
+def test_solve_clustered_covers_every_customer(method):
+    from benchmarks.bench_distance_matrix import synthetic_problem
+    from helpers.cluster_vrp import solve_clustered
+
+    depot, customers = synthetic_problem(41, 0)
+    for c in customers:
+        c["time_window"] = (480, 1080)
+    result = solve_clustered(depot, customers, num_vehicles=4, vehicle_capacity=12, tank_size=10 ** 4,
+                             time_limit=1, method=method, max_nodes=12)
+    diag = result["diagnostics"]
+    assert diag["result"] == "solution_clustered"
+    assert sum(diag["clusters"]["sizes"]) == 40 and max(diag["clusters"]["sizes"]) <= 12
+    assert sum(diag["clusters"]["vehicles"]) == 4
+    assert sorted(c for r in result["routes"] for c in r["route"]) == sorted(c["customer_id"] for c in customers)
+    assert all(r["load"] <= 12 for r in result["routes"])
+    assert [r["vehicle_id"] for r in result["routes"]] == list(range(len(result["routes"])))
+    assert sum(w["customers"] for w in diag["time_windows"]["windows"].values()) == 40
+
+
+def test_solve_clustered_mixed_windowed_clusters():
+    from benchmarks.bench_distance_matrix import synthetic_problem
+    from helpers.cluster_vrp import solve_clustered
+
+    # only stops west of the depot carry a window, so the eastern clusters report none
+    depot, customers = synthetic_problem(41, 0)
+    for c in customers:
+        if c["lon"] < depot["lon"]:
+            c["time_window"] = (480, 1080)
+        else:
+            c.pop("time_window", None)
+    windowed = sum(1 for c in customers if "time_window" in c)
+    assert 0 < windowed < 40
+    result = solve_clustered(depot, customers, num_vehicles=4, vehicle_capacity=12, tank_size=10 ** 4,
+                             time_limit=1, max_nodes=10)
+    diag = result["diagnostics"]
+    assert diag["result"] == "solution_clustered"
+    assert diag["time_windows"]["mode"] == "hard" and diag["time_windows"]["precheck_unreachable"] == []
+    assert sorted(c for r in result["routes"] for c in r["route"]) == sorted(c["customer_id"] for c in customers)
+
+
+def test_solve_clustered_warm_start():
+    from benchmarks.bench_distance_matrix import synthetic_problem
+    from helpers.cluster_vrp import cluster_warm_starts, solve_clustered
+
+    depot, customers = synthetic_problem(41, 0)
+    kwargs = dict(num_vehicles=4, vehicle_capacity=12, tank_size=10 ** 4, time_limit=1, max_nodes=12)
+    first = solve_clustered(depot, customers, **kwargs)
+    previous = [r["route"] for r in first["routes"]] + [["GONE"]]
+
+    split = cluster_warm_starts(previous, [customers[:20], customers[20:]])
+    assert sorted(c for seqs in split for seq in seqs for c in seq) == sorted(c["customer_id"] for c in customers)
+    assert all(len(a) >= len(b) for seqs in split for a, b in zip(seqs, seqs[1:]))
+
+    result = solve_clustered(depot, customers, initial_routes=previous, **kwargs)
+    warm = result["diagnostics"]["warm_start"]
+    # boundary repair can move stops across clusters, so a few may be re-inserted
+    assert warm["used"] and warm["kept"] + warm["inserted"] == 40 and warm["kept"] >= 30
+    assert warm["dropped"] == 1
+    assert warm["clusters"] == result["diagnostics"]["clusters"]["count"]
+
+
+def _failing_cluster_solver(monkeypatch, fails):
+    """Patch ortools_vrp in-process so calls for which fails(customers, kwargs) is true find no solution."""
+    import helpers.ortools as solver
+
+    real = solver.ortools_vrp
+    monkeypatch.setattr(solver, "SOLVER_PORTFOLIO_WORKERS", 1)
+
+    def fake(depot, customers, **kwargs):
+        if fails(customers, kwargs):
+            return {"routes": [], "diagnostics": {"attempts": [], "search": [], "result": "no_solution"}}
+        return real(depot, customers, **kwargs)
+
+    monkeypatch.setattr(solver, "ortools_vrp", fake)
+
+
+def test_solve_clustered_retries_failed_cluster(monkeypatch):
+    from benchmarks.bench_distance_matrix import synthetic_problem
+    from helpers.cluster_vrp import solve_clustered
+
+    depot, customers = synthetic_problem(41, 0)
+    target, tries = customers[0]["customer_id"], []
+
+    def fails(custs, kwargs):
+        if any(c["customer_id"] == target for c in custs):
+            tries.append(kwargs["num_vehicles"])
+            return len(tries) == 1
+        return False
+
+    _failing_cluster_solver(monkeypatch, fails)
+    result = solve_clustered(depot, customers, num_vehicles=12, vehicle_capacity=12, tank_size=10 ** 4,
+                             time_limit=1, max_nodes=12)
+    diag = result["diagnostics"]
+    assert diag["result"] == "solution_clustered"
+    assert "cluster_retry_more_vehicles" in diag["attempts"]
+    [k] = diag["cluster_retry"]["failed_clusters"]
+    assert diag["cluster_retry"]["lent_vehicles"] == {k: 1} and diag["cluster_retry"]["still_failed"] == []
+    assert tries == [tries[0], tries[0] + 1] and sum(diag["clusters"]["vehicles"]) == 12
+    assert sorted(c for r in result["routes"] for c in r["route"]) == sorted(c["customer_id"] for c in customers)
+
+
+def test_solve_clustered_falls_back_to_monolithic(monkeypatch):
+    from benchmarks.bench_distance_matrix import synthetic_problem
+    from helpers.cluster_vrp import solve_clustered
+
+    depot, customers = synthetic_problem(41, 0)
+    target = customers[0]["customer_id"]
+    # the cluster holding target never solves on its own; the whole problem does
+    _failing_cluster_solver(monkeypatch, lambda custs, kwargs: len(custs) < 40
+                            and any(c["customer_id"] == target for c in custs))
+    result = solve_clustered(depot, customers, num_vehicles=6, vehicle_capacity=12, tank_size=10 ** 4,
+                             time_limit=1, max_nodes=12)
+    diag = result["diagnostics"]
+    assert diag["attempts"][0] == "cluster_fallback_monolithic"
+    assert len(diag["cluster_retry"]["still_failed"]) == 1
+    assert result["routes"] and diag["result"] != "solution_clustered"
+    assert sorted(c for r in result["routes"] for c in r["route"]) == sorted(c["customer_id"] for c in customers)
+
+
+def test_knn_candidate_graph(monkeypatch):
+    import helpers.ortools as ortools
+
+    assert ortools.knn_size(50, "auto") == 0            # small problems keep the full graph
+    assert ortools.knn_size(1000, "auto") == 39
+    assert ortools.knn_size(1000, "off") == 0 and ortools.knn_size(10, "20") == 0
+
+    successors = ortools.candidate_successors(CUSTOMERS, 1)
+    assert successors[0] is None
+    for node, allowed in enumerate(successors[1:], start=1):
+        assert node not in allowed and all(node in successors[j] for j in allowed)
+
+    full = ortools.ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, time_limit=1, knn="off")
+    full_km = sum(r["total_distance_km"] for r in full["routes"])
+    for mode in ("penalty", "forbid"):
+        monkeypatch.setattr(ortools, "SOLVER_KNN_MODE", mode)
+        result = ortools.ortools_vrp(DEPOT, CUSTOMERS, num_vehicles=2, vehicle_capacity=200, time_limit=1, knn="1")
+        graph = result["diagnostics"]["candidate_graph"]
+        assert graph["k"] == 1 and graph["mode"] == mode and graph["arcs"] < graph["dense_arcs"]
+        assert sorted(c for r in result["routes"] for c in r["route"]) == ["C001", "C002", "C003", "C004"]
+        # reported distances are real meters, not penalised costs
+        assert sum(r["total_distance_km"] for r in result["routes"]) < 2 * full_km
+
+
+def test_ortools_vrp_mixed_fleet(monkeypatch):
+    import helpers.ortools as ortools
+
+    profiles = [
+        {"name": "van", "count": 1, "capacity": 40, "tank_size": 60, "mileage": 20},
+        {"name": "truck", "count": 1, "capacity": 100, "tank_size": 200, "mileage": 8},
+    ]
+    for pairs in (None, [("PATH_CHEAPEST_ARC", "GUIDED_LOCAL_SEARCH"), ("SAVINGS", "TABU_SEARCH")]):
+        monkeypatch.setattr(ortools, "SOLVER_PORTFOLIO_WORKERS", 2)
+        result = ortools.ortools_vrp(DEPOT, CUSTOMERS, time_limit=1, vehicle_profiles=profiles, portfolio=pairs or False)
+        diag = result["diagnostics"]
+        assert diag["result"] == "solution_with_fuel"
+        assert diag["fleet"]["van"]["count"] == 1 and diag["fleet"]["truck"]["capacity"] == 100
+        assert [r["vehicle_type"] for r in result["routes"]] == ["van", "truck"]
+        for route, profile in zip(result["routes"], profiles):
+            assert route["load"] <= profile["capacity"]
+            assert route["fuel_used_l"] == pytest.approx(route["total_distance_km"] / profile["mileage"], abs=1e-3)
+        assert sorted(c for r in result["routes"] for c in r["route"]) == ["C001", "C002", "C003", "C004"]
+
+    # a 35 kg package fits the truck only; 70 kg in total exceeds the van alone
+    vans = [{"name": "van", "count": 2, "capacity": 30}]
+    result = ortools.ortools_vrp(DEPOT, CUSTOMERS, time_limit=1, vehicle_profiles=vans)
+    assert result["diagnostics"]["precheck"]["oversized_packages"] == ["C002"]
+    assert result["diagnostics"]["result"] == "no_solution_precheck"
+
+
+def test_improve_routes_per_route_capacity():
+    from helpers.local_reroute import improve_routes
+
+    # points 1 and 2 sit next to each other but on different routes; only route 0 can take both
+    cost = [[0, 10, 10], [10, 0, 1], [10, 1, 0]]
+    routes = [[0, 1, 0], [0, 2, 0]]
+    improved, _ = improve_routes(routes, cost, demand=[0, 5, 5], capacity=[10, 5])
+    assert sorted(len(r) for r in improved) == [2, 4] and len(improved[0]) == 4
+    improved, _ = improve_routes(routes, cost, demand=[0, 5, 5], capacity=[5, 5])
+    assert improved == routes
+
+
+def test_map_in_app_context_isolates_failures():
+    from flask import Flask, current_app
+    from helpers.job_queue import map_in_app_context
+
+    app = Flask("depots")
+
+    def solve(warehouse_id):
+        if warehouse_id == "W2":
+            raise ValueError("no vehicles")
+        return f"{current_app.name}:{warehouse_id}"
+
+    outcomes = map_in_app_context(app, solve, ["W1", "W2", "W3"], max_workers=2)
+    assert outcomes["W1"] == "depots:W1" and outcomes["W3"] == "depots:W3"
+    assert isinstance(outcomes["W2"], ValueError)
+
+
+def test_ortools_vrp_relaxes_windows_before_fuel():
+    from helpers.ortools import ortools_vrp
+
+    # one vehicle cannot reach Oxford and Cambridge both by 11:00: lateness, but fuel is kept
+    windows = {"C001": (480, 660), "C002": (480, 660), "C003": (480, 1260), "C004": (480, 1260)}
+    customers = [{**c, "time_window": windows[c["customer_id"]]} for c in CUSTOMERS]
+    result = ortools_vrp(DEPOT, customers, num_vehicles=1, vehicle_capacity=200, tank_size=10 ** 4, time_limit=1)
+    diag = result["diagnostics"]
+    assert diag["attempts"] == ["try_with_fuel", "retry_soft_windows"]
+    assert diag["result"] == "solution_soft_windows" and diag["used_fuel_model"] and "fuel_dropped" not in diag
+    assert diag["time_windows"]["mode"] == "soft" and diag["time_windows"]["precheck_unreachable"] == []
+
+    # out of range as well: fuel goes last, and the reason is reported
+    result = ortools_vrp(DEPOT, customers, num_vehicles=1, vehicle_capacity=200, tank_size=1, mileage=1, time_limit=1)
+    diag = result["diagnostics"]
+    assert diag["attempts"] == ["skip_fuel_precheck", "retry_without_fuel", "retry_without_fuel_soft_windows"]
+    assert not diag["used_fuel_model"] and diag["fuel_dropped"] == "precheck_out_of_range"
+
+
+def test_improve_routes_respects_time_windows():
+    from helpers.local_reroute import improve_routes, route_lateness
+
+    # merging both stops onto one vehicle saves 19 s, but either order serves one of them late
+    cost = [[0, 10, 10], [10, 0, 1], [10, 1, 0]]
+    routes = [[0, 1, 0], [0, 2, 0]]
+    windows = [None, (0, 10), (0, 12)]
+    assert route_lateness([0, 1, 2, 0], cost, windows, service_s=5) == 4
+    improved, _ = improve_routes(routes, cost, windows=windows, service_s=5)
+    assert improved == routes
+    improved, _ = improve_routes(routes, cost, windows=[None, None, (0, 20)], service_s=5)
+    assert sorted(len(r) for r in improved) == [2, 4]
+
+
+def test_download_dir_from_s3_skips_current_etag(tmp_path, monkeypatch):
+    import helpers.s3_bucket as s3_bucket
+
+    downloads = []
+
+    class FakeS3:
+        def get_paginator(self, name):
+            return self
+
+        def paginate(self, Bucket, Prefix):
+            return [{"Contents": [{"Key": f"{Prefix}manifest.json"}, {"Key": f"{Prefix}df3.npy"}]}]
+
+        def download_file(self, bucket, key, path):
+            downloads.append((key, os.path.basename(path)))
+            with open(path, "w") as f:
+                f.write(key)
+
+    monkeypatch.setattr(s3_bucket, "s3", FakeS3())
+    out = tmp_path / "artifact"
+    s3_bucket.download_dir_from_s3("bucket", "traffic_artifact", str(out), last="manifest.json", etag='"v1"')
+    assert [key for key, _ in downloads] == ["traffic_artifact/df3.npy", "traffic_artifact/manifest.json"]
+    assert all(part.endswith(".part") and part not in ("df3.npy.part", "manifest.json.part") for _, part in downloads)
+    assert sorted(os.listdir(out)) == [".etag", "df3.npy", "manifest.json"]
+
+    s3_bucket.download_dir_from_s3("bucket", "traffic_artifact", str(out), last="manifest.json", etag='"v1"')
+    assert len(downloads) == 2
+    s3_bucket.download_dir_from_s3("bucket", "traffic_artifact", str(out), last="manifest.json", etag='"v2"')
+    assert len(downloads) == 4
+
+
+@pytest.fixture(scope="module")
+def solve_app(tmp_path_factory):
+    """app.py on a throwaway SQLite file (shared by the depot threads), no external services."""
+    for key, value in {"SUPABASE_URL": "https://example.supabase.co", "SUPABASE_KEY": "x" * 40,
+                       "SUPABASE_JWT_SECRET": "secret"}.items():
+        os.environ.setdefault(key, value)
+    import config
+    config.Config.DB_URI = f"sqlite:///{tmp_path_factory.mktemp('db') / 'solve.sqlite3'}"
+    config.Config.ENGINE_OPTIONS = {}
+    import app as solve_app
+    with solve_app.app.app_context():
+        solve_app.db.create_all()
+    return solve_app
+
+
+def test_run_multi_depot_solve_groups_by_warehouse(solve_app, monkeypatch):
+    from model import db, Node, User
+
+    with solve_app.app.app_context():
+        user = User(user_id="uid-multi", warehouse="W1")
+        db.session.add(user)
+        db.session.commit()
+        for k, warehouse in enumerate(["W1", "W2", "W3", "W1", "W2", "W3"]):
+            db.session.add(Node(order_id=k + 1, user_id=user.id, warehouse_id=warehouse,
+                                cust_lat=51.5, cust_long=-0.1, status="pending"))
+        db.session.commit()
+        user_id = user.id
+
+    reference = object()
+    calls = []
+
+    def fake_pipeline(user, config, report_stage=print, warehouse_id=None, traffic_ref=None):
+        calls.append((warehouse_id, traffic_ref))
+        if warehouse_id == "W2":
+            raise solve_app.SolveError("Route not possible", {"precheck": {}})
+        return {"trip_id": f"trip-{warehouse_id}", "message": ""}
+
+    monkeypatch.setattr(solve_app, "run_solve_pipeline", fake_pipeline)
+    monkeypatch.setattr(solve_app, "get_traffic_reference", lambda **kwargs: reference)
+
+    with solve_app.app.app_context():
+        user = db.session.get(User, user_id)
+        result = solve_app.run_multi_depot_solve(user, {}, report_stage=lambda stage: None)
+        assert sorted(w for w, _ in calls) == ["W1", "W2", "W3"]
+        assert all(ref is reference for _, ref in calls)          # loaded once, shared
+        assert result["trip_ids"] == ["trip-W1", "trip-W3"]
+        assert result["depots"] == {"W1": "trip-W1", "W3": "trip-W3"}
+        assert result["failed"] == {"W2": {"error": "Route not possible", "diagnostics": {"precheck": {}}}}
+
+        calls.clear()
+        result = solve_app.run_multi_depot_solve(user, {"warehouses": ["W3"]}, report_stage=lambda stage: None)
+        assert [w for w, _ in calls] == ["W3"] and result["trip_ids"] == ["trip-W3"]
+        with pytest.raises(solve_app.SolveError, match="No depot could be routed"):
+            solve_app.run_multi_depot_solve(user, {"warehouses": ["W2"]}, report_stage=lambda stage: None)
+        with pytest.raises(solve_app.SolveError, match="No pending nodes"):
+            solve_app.run_multi_depot_solve(user, {"warehouses": ["W9"]}, report_stage=lambda stage: None)
+
+
+def test_solve_jobs_bookkeeping_and_stale_expiry(solve_app):
+    from datetime import datetime, timedelta
+    from model import db, SolveJob, User
+
+    def pipeline(user, params, report_stage):
+        report_stage("ortools")
+        if params.get("fail"):
+            raise solve_app.SolveError("Route not possible", {"precheck": {}})
+        return {"trip_id": "t-1"}
+
+    with solve_app.app.app_context():
+        user = User(user_id="uid-jobs", warehouse="W1")
+        db.session.add(user)
+        db.session.commit()
+        old = datetime.utcnow() - timedelta(seconds=solve_app.SOLVE_JOB_STALE_SECONDS + 60)
+        for job_id, params, updated_at in [("ok", {}, None), ("bad", {"fail": True}, None), ("lost", {}, old)]:
+            db.session.add(SolveJob(job_id=job_id, user_id=user.id, status="queued", stage="queued",
+                                    params=params, updated_at=updated_at or datetime.utcnow()))
+        db.session.commit()
+
+        def job(job_id):
+            return SolveJob.query.filter_by(job_id=job_id).first()
+
+        assert solve_app.expire_stale_job(job("ok")).status == "queued"
+        assert solve_app.expire_stale_job(job("lost")).status == "failed"
+        assert "stalled" in job("lost").error
+
+        for job_id in ("ok", "bad", "lost"):
+            solve_app.run_job(job_id, pipeline, lambda result: result["trip_id"])
+        assert (job("ok").status, job("ok").trip_id, job("ok").stage) == ("succeeded", "t-1", "done")
+        assert (job("bad").status, job("bad").error) == ("failed", "Route not possible")
+        assert job("bad").result == {"diagnostics": {"precheck": {}}}
+        assert job("lost").status == "failed" and job("lost").trip_id is None   # never started
+
+
+def test_previous_route_sequences_stays_on_the_users_depot(solve_app):
+    from datetime import datetime, timedelta
+    from model import db, Route, User
+
+    def plan(depot, ids):
+        return {"depot": {"id": depot}, "refined_routes": [
+            {"vehicle": "V1", "sequence": [{"id": depot}] + [{"id": c} for c in ids] + [{"id": depot}]}]}
+
+    with solve_app.app.app_context():
+        user = User(user_id="uid-warm", warehouse="W1")
+        db.session.add(user)
+        db.session.commit()
+        now = datetime.utcnow()
+        db.session.add(Route(trip_id="w1-old", user_id=user.id, route_detail=plan("W1", ["C1"]),
+                             created_at=now - timedelta(hours=1)))
+        db.session.add(Route(trip_id="w2-new", user_id=user.id, route_detail=plan("W2", ["C9"]), created_at=now))
+        db.session.commit()
+
+        assert solve_app.previous_route_sequences(user) == [["C1"]]
+        assert solve_app.previous_route_sequences(user, warehouse_id="W2") == [["C9"]]
+        assert solve_app.previous_route_sequences(user, trip_id="w2-new") is None
+
+
+def test_single_depot_solve_rejects_mixed_warehouses(solve_app, monkeypatch):
+    import jwt
+    from model import db, Node, User
+
+    with solve_app.app.app_context():
+        user = User(user_id="uid-mixed", warehouse="W1")
+        db.session.add(user)
+        db.session.commit()
+        for k, warehouse in enumerate(["W1", "W2"]):
+            db.session.add(Node(order_id=100 + k, user_id=user.id, warehouse_id=warehouse,
+                                cust_lat=51.5, cust_long=-0.1, status="pending"))
+        db.session.commit()
+
+    queued = []
+    monkeypatch.setattr(solve_app, "submit_job", lambda app, fn, job_id: queued.append(job_id))
+    token = jwt.encode({"sub": "uid-mixed"}, solve_app.SUPABASE_JWT_SECRET, algorithm="HS256")
+    client = solve_app.app.test_client()
+    r = client.post("/api/solve", json={}, headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 400 and "/api/solve/multi-depot" in r.get_json()["message"]
+    assert queued == []